@@ -1,11 +1,31 @@
-from flask import Flask, render_template, send_file, jsonify, request
+from flask import Flask, Response, render_template, send_file, jsonify, request, stream_with_context
+import json
 import os
-from db import get_downloaded_files, init_db, get_videos_by_genre, get_genre_statistics
-from pipeline import run_pipeline
+import queue
+from config import (DIRECT_URL_BATCH_MAX, MEDIA_DIR, SENDFILE_MODE, SENDFILE_ACCEL_PREFIX,
+                    SENDFILE_TRANSCODE_ACCEL_PREFIX, TRANSCODE_CACHE_DIR, EVENTS_RETRY_SECONDS)
+from db import (get_downloaded_files, init_db, get_videos_by_genre, get_genre_statistics, not_downloaded_ids,
+                get_download, get_trending, video_exists)
+from download_audio import AUDIO_MIMETYPES, ensure_mp3
+from download_queue import enqueue_downloads, get_job, start_worker_threads
+from events import broadcaster, format_sse
+from export import DATASETS as EXPORT_DATASETS, FORMATS as EXPORT_FORMATS, stream_export
+from media_cache import forget_missing, touch
+import ledger
+import metrics
+import profiling
+from response_cache import cached_json
+from pipeline_jobs import get_run as get_pipeline_run, start_run as start_pipeline_run
+from pipeline import PIPELINE_STAGES
 from rank_shorts import rank_top_n
-from search_trends import search_by_custom_query
+from search_trends import normalize_query, refresh_in_background, search_freshness, shared_custom_search
+from stream_proxy import RangeNotSatisfiable, open_stream
+from url_cache import resolve as resolve_audio_url, resolve_many
 
 app = Flask(__name__)
+app.config['USE_X_SENDFILE'] = SENDFILE_MODE == 'x-sendfile'
+metrics.init_app(app)
+profiling.init_app(app)
 
 @app.route('/')
 def index():
@@ -17,63 +37,187 @@ def api_files():
     files = get_downloaded_files()
     return jsonify(files)
 
+@app.route('/metrics')
+def metrics_endpoint():
+    """Метрики процесса в текстовом формате Prometheus"""
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+@app.route('/api/admin/profiles')
+def api_admin_profiles():
+    """Список последних профилей (нужен заголовок X-Profile-Token)"""
+    if not profiling.token_ok(request.headers.get(profiling.TOKEN_HEADER)):
+        return jsonify({"error": "Forbidden"}), 403
+    return jsonify(profiling.list_profiles())
+
+@app.route('/api/admin/profiles/<name>')
+def api_admin_profile(name):
+    """Профиль в формате collapsed stacks (flamegraph.pl, speedscope)"""
+    if not profiling.token_ok(request.headers.get(profiling.TOKEN_HEADER)):
+        return jsonify({"error": "Forbidden"}), 403
+    path = profiling.profile_path(name)
+    if not path:
+        return jsonify({"error": "Profile not found"}), 404
+    return send_file(path, mimetype='text/plain', as_attachment=True, download_name=name)
+
 @app.route('/api/trending')
+@cached_json
 def api_trending():
-    from db import get_conn
-    with get_conn() as con:
-        rows = con.execute("""
-            SELECT v.video_id, v.title, v.channel_title, v.duration_sec,
-                   v.primary_genre, v.genre_confidence,
-                   s.view_count, s.like_count, s.comment_count, s.snapshot_date
-            FROM videos v
-            LEFT JOIN (
-                SELECT video_id, view_count, like_count, comment_count, snapshot_date,
-                       ROW_NUMBER() OVER (PARTITION BY video_id ORDER BY snapshot_date DESC) as rn
-                FROM stats
-            ) s ON v.video_id = s.video_id AND s.rn = 1
-            WHERE v.is_short = 1
-            ORDER BY v.last_seen DESC
-            LIMIT 10
-        """).fetchall()
+    return jsonify(get_trending(10))
+
+@app.route('/api/events')
+def api_events():
+    """
+    Server-Sent Events для дашборда: snapshot (текущие тренды при подключении),
+    trending (изменения трендов после записи новых данных), pipeline (этапы запуска пайплайна)
+    """
+    q = broadcaster.subscribe()
+    if q is None:
+        # лимит подключений процесса: дашборд переключится на опрос и попробует позже
+        return Response(f"retry: {EVENTS_RETRY_SECONDS * 1000}\n\n", status=503, mimetype='text/event-stream',
+                        headers={"Retry-After": str(EVENTS_RETRY_SECONDS), "Cache-Control": "no-cache"})
+    snapshot = broadcaster.snapshot()
     
-    trending = []
-    for row in rows:
-        item = {
-            "video_id": row["video_id"],
-            "title": row["title"],
-            "channel_title": row["channel_title"],
-            "duration_sec": row["duration_sec"],
-            "primary_genre": row["primary_genre"],
-            "genre_confidence": row["genre_confidence"],
-            "stats": {
-                "view_count": row["view_count"] or 0,
-                "like_count": row["like_count"] or 0,
-                "comment_count": row["comment_count"] or 0,
-                "last_updated": row["snapshot_date"]
-            }
-        }
-        trending.append(item)
+    def generate():
+        try:
+            yield format_sse("snapshot", snapshot)
+            while True:
+                try:
+                    message = q.get(timeout=15)
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+                    continue
+                if message is None:
+                    return
+                yield message
+        finally:
+            broadcaster.unsubscribe(q)
+    
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+def _accel_path(audio_path):
+    """Путь для X-Accel-Redirect или None, если файл не лежит ни в одном location nginx"""
+    path = os.path.abspath(audio_path)
+    for root, prefix in ((MEDIA_DIR, SENDFILE_ACCEL_PREFIX), (TRANSCODE_CACHE_DIR, SENDFILE_TRANSCODE_ACCEL_PREFIX)):
+        root = os.path.abspath(root)
+        if prefix and os.path.commonpath([path, root]) == root:
+            return prefix.rstrip('/') + '/' + os.path.relpath(path, root).replace(os.sep, '/')
+    return None
+
+def _send_audio(audio_path, etag=None, download_name=None):
+    """
+    Отдаёт аудиофайл с ETag, Last-Modified и поддержкой Range.
+    В режиме SENDFILE_MODE=x-accel байты отдаёт nginx, Flask только ставит заголовок
+    """
+    ext = os.path.splitext(audio_path)[1].lstrip('.')
+    mimetype = AUDIO_MIMETYPES.get(ext, 'application/octet-stream')
+    accel_path = _accel_path(audio_path) if SENDFILE_MODE == 'x-accel' else None
     
-    return jsonify(trending)
+    if accel_path:
+        response = Response(mimetype=mimetype)
+        response.headers['X-Accel-Redirect'] = accel_path
+        if download_name:
+            response.headers['Content-Disposition'] = f'attachment; filename="{download_name}"'
+        return response
+    
+    return send_file(audio_path, mimetype=mimetype, conditional=True, etag=etag or True,
+                     as_attachment=download_name is not None, download_name=download_name)
+
+def _wants_mp3(audio_path, want):
+    """
+    Нужна ли mp3-версия: ?format=mp3 или ?format=native решают явно, без параметра mp3 отдаётся,
+    если клиент не перечислил исходный тип в Accept (старые клиенты всегда получали mp3)
+    """
+    if want:
+        return want == 'mp3'
+    native = AUDIO_MIMETYPES.get(os.path.splitext(audio_path)[1].lstrip('.'))
+    listed = {mimetype for mimetype, quality in request.accept_mimetypes if quality > 0}
+    return native not in listed
 
 @app.route('/download/<video_id>')
 def download_file(video_id):
-    files = get_downloaded_files()
-    for file_info in files:
-        if file_info['video_id'] == video_id:
-            audio_path = file_info['audio_path']
-            if os.path.exists(audio_path):
-                return send_file(audio_path, as_attachment=True, 
-                               download_name=f"{video_id}.mp3")
+    """
+    Скачивание аудио. По умолчанию mp3; исходный формат (opus/m4a) - с ?format=native или
+    если клиент указал его тип в Accept. mp3-версия создаётся при первом запросе и кэшируется
+    """
+    want = request.args.get('format', '').lower()
+    download = get_download(video_id)
+    
+    if download and download['audio_path'] and os.path.exists(download['audio_path']):
+        audio_path = download['audio_path']
+        etag = download['blob_hash']
+        if not audio_path.lower().endswith('.mp3') and _wants_mp3(audio_path, want):
+            try:
+                audio_path = ensure_mp3(video_id, audio_path)
+            except Exception as e:
+                return jsonify({"status": "error", "message": f"Ошибка перекодирования: {e}"}), 500
+            etag = f"{etag}-mp3" if etag else None
+        touch(video_id)
+        ext = os.path.splitext(audio_path)[1].lstrip('.') or 'mp3'
+        response = _send_audio(audio_path, etag=etag, download_name=f"{video_id}.{ext}")
+        if not want:
+            response.vary.add('Accept')
+        return response
+    
+    # Файл вытеснен из кэша или ещё не скачан - ставим в очередь, если трек известен
+    if video_exists(video_id) and forget_missing(video_id):
+        job_id = enqueue_downloads([video_id])[video_id]
+        return jsonify({
+            "status": "pending",
+            "message": "Файл скачивается, повторите запрос позже",
+            "job_id": job_id,
+            "status_url": f"/api/download_jobs/{job_id}"
+        }), 202
     return "Файл не найден", 404
 
 @app.route('/run_pipeline', methods=['POST'])
 def run_pipeline_endpoint():
-    try:
-        run_pipeline()
-        return jsonify({"status": "success", "message": "Пайплайн выполнен успешно"})
-    except Exception as e:
-        return jsonify({"status": "error", "message": str(e)}), 500
+    """
+    Запускает пайплайн в фоне и сразу возвращает id запуска.
+    Если пайплайн уже выполняется, возвращает id текущего запуска (409)
+    """
+    run, started = start_pipeline_run()
+    return jsonify({
+        "status": "started" if started else "running",
+        "message": "Пайплайн запущен" if started else "Пайплайн уже выполняется",
+        "run_id": run["run_id"],
+        "status_url": f"/api/pipeline/runs/{run['run_id']}",
+        "run": run
+    }), 202 if started else 409
+
+def _ledger_run(run_id):
+    """Запуск из журнала (его выполняет другой процесс) в формате pipeline_jobs.get_run"""
+    run = ledger.get_run(run_id)
+    if run:
+        saved = {s["stage"]: s for s in run["stages"]}
+        run["stages"] = [{"name": name, "title": title, "status": saved.get(name, {}).get("status", "pending"),
+                          "count": saved.get(name, {}).get("item_count"), "error": saved.get(name, {}).get("error")}
+                         for name, title in PIPELINE_STAGES]
+    return run
+
+@app.route('/api/pipeline/runs/<run_id>')
+def api_pipeline_run(run_id):
+    """
+    Статус запуска пайплайна: этапы, количество элементов и время выполнения
+    Пример: GET /api/pipeline/runs/3f2a9c1b7d4e
+    """
+    run = get_pipeline_run(run_id) or _ledger_run(run_id)
+    if not run:
+        return jsonify({
+            "status": "error",
+            "message": "Запуск не найден"
+        }), 404
+    return jsonify({"status": "success", "run": run})
+
+@app.route('/api/pipeline/runs')
+def api_pipeline_runs():
+    """
+    Журнал последних запусков пайплайна с этапами и сравнение последнего запуска
+    с медианой предыдущих (latest_vs_baseline)
+    Пример: GET /api/pipeline/runs?limit=20
+    """
+    limit = min(request.args.get('limit', 10, type=int), 100)
+    return jsonify({"status": "success", **ledger.report(limit)})
 
 @app.route('/search', methods=['POST'])
 def search_custom():
@@ -85,17 +229,19 @@ def search_custom():
         if not query:
             return jsonify({"status": "error", "message": "Поисковый запрос не может быть пустым"}), 400
         
-        found = search_by_custom_query(query, max_results)
+        found = shared_custom_search(query, max_results)
         return jsonify({"status": "success", "message": f"Найдено {found} Shorts по запросу '{query}'", "found": found})
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
 
 @app.route('/api/search_queries')
+@cached_json
 def api_search_queries():
     from config import SEARCH_QUERIES
     return jsonify(SEARCH_QUERIES)
 
 @app.route('/api/genres')
+@cached_json
 def api_genres():
     stats = get_genre_statistics()
     return jsonify(stats)
@@ -128,7 +274,7 @@ def api_search_and_download():
             }), 400
         
         # Выполняем поиск
-        found = search_by_custom_query(query, max_results)
+        found = shared_custom_search(query, max_results)
         
         if found == 0:
             return jsonify({
@@ -184,6 +330,7 @@ def api_search_and_download():
         }), 500
 
 @app.route('/api/search_links')
+@cached_json
 def api_search_links():
     """
     API endpoint для поиска треков и получения только ссылок (без скачивания)
@@ -298,10 +445,6 @@ def api_direct_download(video_id):
     Пример: GET /api/direct_download/nSo6GM5ke7M
     """
     try:
-        import yt_dlp
-        import tempfile
-        import os
-        
         # Получаем информацию о видео из базы
         from db import get_conn
         with get_conn() as con:
@@ -317,35 +460,16 @@ def api_direct_download(video_id):
                 "message": "Трек не найден"
             }), 404
         
-        # Настройки yt-dlp для получения прямой ссылки
-        ydl_opts = {
-            "format": "bestaudio/best",
-            "quiet": True,
-            "no_warnings": True,
-            "extract_flat": False,
-        }
-        
         url = f"https://www.youtube.com/watch?v={video_id}"
         
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=False)
-            
-            # Ищем лучший аудио формат
-            audio_url = None
-            audio_format = None
-            
-            if 'formats' in info:
-                for fmt in info['formats']:
-                    if fmt.get('acodec') != 'none' and fmt.get('vcodec') == 'none':
-                        audio_url = fmt.get('url')
-                        audio_format = fmt.get('ext', 'mp3')
-                        break
-            
-            if not audio_url:
-                return jsonify({
-                    "status": "error",
-                    "message": "Не удалось получить прямую ссылку на аудио"
-                }), 500
+        # Ссылка берётся из кэша, yt-dlp запускается только для новых или истёкших ссылок
+        try:
+            resolved = resolve_audio_url(video_id)
+        except LookupError as e:
+            return jsonify({
+                "status": "error",
+                "message": str(e)
+            }), 500
         
         return jsonify({
             "status": "success",
@@ -354,8 +478,10 @@ def api_direct_download(video_id):
             "channel_title": row["channel_title"],
             "duration_sec": row["duration_sec"],
             "youtube_url": url,
-            "direct_download_url": audio_url,
-            "format": audio_format,
+            "direct_download_url": resolved["url"],
+            "format": resolved["format"],
+            "expires_at": resolved["expires_at"],
+            "cached": resolved["cached"],
             "message": "Прямая ссылка на аудио получена"
         })
         
@@ -365,6 +491,89 @@ def api_direct_download(video_id):
             "message": f"Ошибка получения прямой ссылки: {str(e)}"
         }), 500
 
+@app.route('/api/direct_links', methods=['POST'])
+def api_direct_links_batch():
+    """
+    API endpoint для пакетного получения прямых ссылок. Ссылки извлекаются параллельно,
+    ответ - NDJSON, по строке на трек в порядке готовности
+    Пример: POST /api/direct_links
+    Body: {"video_ids": ["nSo6GM5ke7M", "Axwi1s7MIDo"]}
+    """
+    data = request.get_json(silent=True) or {}
+    video_ids = [str(v).strip() for v in data.get('video_ids', []) if str(v).strip()]
+    
+    if not video_ids:
+        return jsonify({
+            "status": "error",
+            "message": "Параметр 'video_ids' обязателен"
+        }), 400
+    if len(video_ids) > DIRECT_URL_BATCH_MAX:
+        return jsonify({
+            "status": "error",
+            "message": f"Не больше {DIRECT_URL_BATCH_MAX} треков за запрос"
+        }), 400
+    
+    from db import get_conn
+    with get_conn() as con:
+        qmarks = ",".join(["?"] * len(video_ids))
+        rows = con.execute(f"""
+            SELECT video_id, title, channel_title, duration_sec
+            FROM videos
+            WHERE video_id IN ({qmarks})
+        """, video_ids).fetchall()
+    known = {row["video_id"]: dict(row) for row in rows}
+    
+    def generate():
+        for vid in video_ids:
+            if vid not in known:
+                yield json.dumps({"video_id": vid, "status": "error", "message": "Трек не найден"},
+                                 ensure_ascii=False) + "\n"
+        for vid, resolved, error in resolve_many([v for v in video_ids if v in known]):
+            item = {"video_id": vid, **{k: v for k, v in known[vid].items() if k != "video_id"}}
+            if error is not None:
+                item.update(status="error", message=f"Ошибка получения прямой ссылки: {error}")
+            else:
+                item.update(status="success",
+                            youtube_url=f"https://www.youtube.com/watch?v={vid}",
+                            direct_download_url=resolved["url"],
+                            format=resolved["format"],
+                            expires_at=resolved["expires_at"],
+                            cached=resolved["cached"])
+            yield json.dumps(item, ensure_ascii=False) + "\n"
+    
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+@app.route('/api/stream/<video_id>')
+def api_stream(video_id):
+    """
+    Потоковое аудио для плеера с поддержкой Range (перемотка).
+    Локальный файл отдаётся с диска, иначе аудио проксируется с googlevideo кусками
+    Пример: GET /api/stream/nSo6GM5ke7M
+    """
+    download = get_download(video_id)
+    
+    if download and download["audio_path"] and os.path.exists(download["audio_path"]):
+        touch(video_id)
+        return _send_audio(download["audio_path"], etag=download["blob_hash"])
+    
+    if not download and not video_exists(video_id):
+        return jsonify({
+            "status": "error",
+            "message": "Трек не найден"
+        }), 404
+    
+    try:
+        status, headers, body = open_stream(video_id, request.headers.get('Range'))
+    except RangeNotSatisfiable:
+        return Response(status=416, headers={"Accept-Ranges": "bytes"})
+    except Exception as e:
+        return jsonify({
+            "status": "error",
+            "message": f"Ошибка получения аудио: {str(e)}"
+        }), 502
+    
+    return Response(stream_with_context(body), status=status, headers=headers, direct_passthrough=True)
+
 @app.route('/api/search_direct_links')
 def api_search_direct_links():
     """
@@ -381,28 +590,20 @@ def api_search_direct_links():
                 "message": "Параметр 'query' обязателен"
             }), 400
         
-        # Выполняем поиск через YouTube API и получаем результаты
-        from search_trends import search_by_custom_query
-        found_count = search_by_custom_query(query, max_results)
-        
-        # Получаем найденные видео с последней статистикой
-        from db import get_conn
-        with get_conn() as con:
-            rows = con.execute("""
-                SELECT v.video_id, v.title, v.channel_title, v.duration_sec,
-                       v.primary_genre, v.genre_confidence,
-                       s.view_count, s.like_count, s.comment_count, s.snapshot_date
-                FROM videos v
-                LEFT JOIN (
-                    SELECT video_id, view_count, like_count, comment_count, snapshot_date,
-                           ROW_NUMBER() OVER (PARTITION BY video_id ORDER BY snapshot_date DESC) as rn
-                    FROM stats
-                ) s ON v.video_id = s.video_id AND s.rn = 1
-                WHERE v.is_short = 1 
-                AND (v.title LIKE ? OR v.channel_title LIKE ?)
-                ORDER BY v.last_seen DESC
-                LIMIT ?
-            """, (f'%{query}%', f'%{query}%', max_results)).fetchall()
+        # Сначала отвечаем из локальной базы; YouTube API - только если результатов нет
+        # или они устарели (тогда обновляем в фоне, не задерживая ответ)
+        freshness = search_freshness(query, max_results)
+        rows = _local_search_rows(query, max_results)
+        
+        if freshness == "fresh":
+            source = "local"
+        elif rows and freshness == "stale":
+            source = "local_stale"
+            refresh_in_background(query, max_results)
+        else:
+            source = "upstream"
+            shared_custom_search(query, max_results)
+            rows = _local_search_rows(query, max_results)
         
         links = []
         for row in rows:
@@ -430,6 +631,7 @@ def api_search_direct_links():
             "message": f"Найдено {len(links)} треков по запросу '{query}'",
             "query": query,
             "found": len(links),
+            "source": source,
             "links": links
         })
         
@@ -439,7 +641,33 @@ def api_search_direct_links():
             "message": str(e)
         }), 500
 
-@app.route('/api/search_and_download_force')
+def _local_search_rows(query, max_results):
+    """Треки запроса из локальной базы: результаты последнего поиска YouTube, затем совпадения по названию"""
+    from db import get_conn
+    with get_conn() as con:
+        return con.execute("""
+            WITH matched AS (
+                SELECT v.video_id, v.title, v.channel_title, v.duration_sec,
+                       v.primary_genre, v.genre_confidence, v.last_seen, sr.rank AS search_rank
+                FROM videos v
+                LEFT JOIN search_results sr ON sr.video_id = v.video_id AND sr.query_key = ?
+                WHERE v.is_short = 1
+                AND (sr.video_id IS NOT NULL OR v.title LIKE ? OR v.channel_title LIKE ?)
+                ORDER BY sr.rank IS NULL, sr.rank, v.last_seen DESC
+                LIMIT ?
+            )
+            SELECT m.*, s.view_count, s.like_count, s.comment_count, s.snapshot_date
+            FROM matched m
+            LEFT JOIN stats s ON s.id = (
+                SELECT id FROM stats
+                WHERE video_id = m.video_id
+                ORDER BY snapshot_date DESC, id DESC
+                LIMIT 1
+            )
+            ORDER BY m.search_rank IS NULL, m.search_rank, m.last_seen DESC
+        """, (normalize_query(query), f'%{query}%', f'%{query}%', max_results)).fetchall()
+
+@app.route('/api/search_and_download_force', methods=['POST'])
 def api_search_and_download_force():
     """
     API endpoint для поиска и принудительного скачивания треков
@@ -459,7 +687,7 @@ def api_search_and_download_force():
             }), 400
         
         # Выполняем поиск
-        found = search_by_custom_query(query, max_results)
+        found = shared_custom_search(query, max_results)
         
         if found == 0:
             return jsonify({
@@ -470,17 +698,14 @@ def api_search_and_download_force():
                 "download_links": []
             })
         
-        # Если нужно скачать, запускаем скачивание
+        # Если нужно скачать, ставим задачи в очередь (скачивает фоновый воркер)
+        jobs = {}
         if force_download:
-            from rank_shorts import rank_top_n
-            from download_audio import download_audio_for
-            
             # Получаем топ видео для скачивания
             top_videos = rank_top_n(max_results)
             video_ids = [v["video_id"] for v in top_videos]
             
-            # Скачиваем аудио
-            download_audio_for(video_ids)
+            jobs = enqueue_downloads(not_downloaded_ids(video_ids))
         
         # Получаем обновленную информацию
         from db import get_conn
@@ -508,17 +733,19 @@ def api_search_and_download_force():
                 "is_downloaded": row["audio_path"] is not None,
                 "download_url": f"/download/{row['video_id']}" if row["audio_path"] else None,
                 "youtube_url": f"https://www.youtube.com/watch?v={row['video_id']}",
-                "downloaded_at": row["downloaded_at"]
+                "downloaded_at": row["downloaded_at"],
+                "job_id": jobs.get(row["video_id"])
             }
             download_links.append(video_info)
         
         return jsonify({
             "status": "success",
             "message": f"Найдено {len(download_links)} треков по запросу '{query}'" + 
-                      (" и скачано" if force_download else ""),
+                      (f", в очередь на скачивание: {len(jobs)}" if force_download else ""),
             "query": query,
             "found": len(download_links),
             "downloaded": force_download,
+            "jobs": [{"video_id": vid, "job_id": job_id} for vid, job_id in jobs.items()],
             "download_links": download_links
         })
         
@@ -528,7 +755,82 @@ def api_search_and_download_force():
             "message": str(e)
         }), 500
 
+@app.route('/api/export/<dataset>')
+def api_export(dataset):
+    """
+    Потоковая выгрузка: videos, latest_stats, stats (вся история) или downloads
+    Параметры: format=ndjson|csv, gzip=1, since, until (YYYY-MM-DD), genre (можно несколько), region
+    Пример: GET /api/export/stats?format=csv&gzip=1&since=2024-05-01&genre=pop
+    """
+    fmt = request.args.get('format', 'ndjson').lower()
+    if dataset not in EXPORT_DATASETS:
+        return jsonify({
+            "status": "error",
+            "message": f"Неизвестный набор данных, доступны: {', '.join(EXPORT_DATASETS)}"
+        }), 404
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({
+            "status": "error",
+            "message": f"Неизвестный формат, доступны: {', '.join(EXPORT_FORMATS)}"
+        }), 400
+    
+    gzip = request.args.get('gzip', '').lower() in ('1', 'true', 'yes')
+    body = stream_export(
+        dataset, fmt, gzip,
+        since=request.args.get('since') or None,
+        until=request.args.get('until') or None,
+        genres=request.args.getlist('genre'),
+        region=request.args.get('region') or None,
+    )
+    filename = f"{dataset}.{fmt}" + (".gz" if gzip else "")
+    return Response(stream_with_context(body),
+                    mimetype='application/gzip' if gzip else EXPORT_FORMATS[fmt],
+                    headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+@app.route('/api/download_jobs', methods=['POST'])
+def api_enqueue_downloads():
+    """
+    API endpoint для постановки треков в очередь на скачивание
+    Пример: POST /api/download_jobs
+    Body: {"video_ids": ["nSo6GM5ke7M", "Axwi1s7MIDo"]}
+    """
+    data = request.get_json(silent=True) or {}
+    video_ids = [str(v).strip() for v in data.get('video_ids', []) if str(v).strip()]
+    
+    if not video_ids:
+        return jsonify({
+            "status": "error",
+            "message": "Параметр 'video_ids' обязателен"
+        }), 400
+    
+    jobs = enqueue_downloads(video_ids)
+    return jsonify({
+        "status": "success",
+        "jobs": [{"video_id": vid, "job_id": job_id, "status_url": f"/api/download_jobs/{job_id}"}
+                 for vid, job_id in jobs.items()]
+    }), 202
+
+@app.route('/api/download_jobs/<int:job_id>')
+def api_download_job(job_id):
+    """
+    API endpoint для получения статуса задачи скачивания
+    Пример: GET /api/download_jobs/42
+    """
+    job = get_job(job_id)
+    if not job:
+        return jsonify({
+            "status": "error",
+            "message": "Задача не найдена"
+        }), 404
+    
+    return jsonify({
+        "status": "success",
+        "job": job,
+        "download_url": f"/download/{job['video_id']}" if job["state"] == "done" else None
+    })
+
 if __name__ == '__main__':
     init_db()
+    start_worker_threads()
     port = int(os.getenv('PORT', 5002))
     app.run(debug=False, host='0.0.0.0', port=port)
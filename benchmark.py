@@ -0,0 +1,321 @@
+"""
+Бенчмарки на синтетических данных: ранжирование, читающие эндпоинты, ингест и жанры.
+
+Генератор создаёт базу на 10k, 100k или 1M видео с историей stats от --days-min до --days-max
+дней на видео, загрузками и сохранёнными результатами поиска. База создаётся один раз в
+BENCH_DIR и переиспользуется (имя зависит от размера, истории и seed). Ингест измеряется
+против локального fake_youtube.py, его записи удаляются после прогона, поэтому база не дрейфует.
+
+Результат - JSON с минимумом, медианой, p95 и средним по прогонам каждого бенчмарка.
+С --baseline результаты сравниваются с сохранёнными: регрессия - медиана выросла больше чем на
+порог (--threshold или "thresholds" в файле базовой линии) и больше чем на BENCH_MIN_DELTA_MS;
+тогда код выхода 1.
+
+    python benchmark.py                                  # 10k видео
+    python benchmark.py --scales 10k,100k --out results.json
+    python benchmark.py --scales 10k --save-baseline bench_baseline.json
+    python benchmark.py --scales 10k --baseline bench_baseline.json
+"""
+
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta
+from typing import Optional
+
+import db
+import fake_youtube
+import fetch_shorts
+import response_cache
+import search_trends
+from app import app
+from config import BENCH_DIR, BENCH_MIN_DELTA_MS, BENCH_REGRESSION_PCT, TOP_N_DOWNLOAD
+from db import get_conn, get_downloaded_files, init_db, store_snapshots, store_stats
+from genre_analyzer import GENRE_KEYWORDS, analyze_genre
+from rank_shorts import rank_top_n
+
+SCALES = {"10k": 10_000, "100k": 100_000, "1m": 1_000_000}
+
+DOWNLOADED_FRACTION = 0.01
+SEARCH_RESULTS_PER_QUERY = 50
+# Дата снимков, которые пишут бенчмарки ингеста: по ней они удаляются после прогона
+BENCH_SNAPSHOT_DATE = "2999-12-31"
+_FLUSH_ROWS = 200_000
+
+GENRES = list(GENRE_KEYWORDS)
+KEYWORDS = sorted({kw for words in GENRE_KEYWORDS.values() for kw in words if " " not in kw})
+QUERIES = [GENRE_KEYWORDS[g][0] for g in GENRES[:5]]
+
+def db_path(videos: int, days_min: int, days_max: int, seed: int) -> str:
+    return os.path.join(BENCH_DIR, f"synthetic-{videos}-{days_min}-{days_max}-s{seed}.db")
+
+def _video_id(i: int) -> str:
+    return f"v{i:010d}"
+
+def generate_db(path: str, videos: int, days_min: int = 30, days_max: int = 90, seed: int = 0) -> int:
+    """Создаёт синтетическую базу. Возвращает число строк stats."""
+    tmp = path + ".tmp"
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(tmp + suffix):
+            os.remove(tmp + suffix)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    db.DB_PATH = tmp
+    init_db()
+    rng = random.Random(f"{seed}:{videos}")
+    today = datetime.utcnow().date()
+    dates = [(today - timedelta(days=d)).isoformat() for d in range(days_max + 8)]
+    con = get_conn()
+    con.execute("PRAGMA synchronous=OFF")
+    video_rows, stats_rows, stats_total = [], [], 0
+    t0 = time.monotonic()
+
+    def flush():
+        nonlocal stats_total
+        con.executemany("INSERT INTO videos(video_id, title, channel_title, published_at, duration_sec, is_short, "
+                        "region, first_seen, last_seen, primary_genre, genre_confidence) "
+                        "VALUES(?,?,?,?,?,?,?,?,?,?,?)", video_rows)
+        con.executemany("INSERT INTO stats(video_id, snapshot_date, view_count, like_count, comment_count) "
+                        "VALUES(?,?,?,?,?)", stats_rows)
+        con.commit()
+        stats_total += len(stats_rows)
+        video_rows.clear()
+        stats_rows.clear()
+
+    for i in range(videos):
+        vid = _video_id(i)
+        words = rng.sample(KEYWORDS, 3)
+        seen_offset = rng.randint(0, 7)
+        history = rng.randint(days_min, days_max)
+        last_seen = datetime.combine(today - timedelta(days=seen_offset), datetime.min.time()) \
+            + timedelta(seconds=rng.randint(0, 86399))
+        video_rows.append((
+            vid, f"{' '.join(words)} #shorts", f"Channel {i % 5000}", dates[seen_offset + history] + "T12:00:00Z",
+            rng.randint(5, 60) if rng.random() < 0.85 else rng.randint(61, 600), 1, "US",
+            dates[seen_offset + history - 1] + "T00:00:00", last_seen.isoformat(),
+            rng.choice(GENRES), round(rng.uniform(0.05, 1.0), 3),
+        ))
+        views, growth = rng.randint(100, 10_000), rng.lognormvariate(6, 1.5)
+        for d in range(seen_offset + history - 1, seen_offset - 1, -1):
+            views += int(growth * (0.5 + rng.random()))
+            stats_rows.append((vid, dates[d], views, views // 20, views // 300))
+        if len(stats_rows) >= _FLUSH_ROWS:
+            flush()
+            print(f"[benchmark] {i + 1}/{videos} видео, {stats_total} строк stats, {time.monotonic() - t0:.0f} с")
+    flush()
+
+    downloaded = rng.sample(range(videos), max(1, int(videos * DOWNLOADED_FRACTION)))
+    con.executemany("INSERT INTO downloads(video_id, audio_path, downloaded_at, duration_sec, format, size_bytes) "
+                    "VALUES(?,?,?,?,?,?)",
+                    [(_video_id(i), f"media/blobs/{_video_id(i)}.opus",
+                      f"{dates[rng.randint(0, days_max)]}T{rng.randint(0, 23):02d}:00:00", 30, "opus", 500_000)
+                     for i in downloaded])
+    for query in QUERIES:
+        key = search_trends.normalize_query(query)
+        con.executemany("INSERT OR IGNORE INTO search_results(query_key, video_id, rank) VALUES(?,?,?)",
+                        [(key, _video_id(i), rank) for rank, i in
+                         enumerate(rng.sample(range(videos), min(SEARCH_RESULTS_PER_QUERY, videos)))])
+        con.execute("INSERT OR REPLACE INTO search_freshness(query_key, query, max_results, refreshed_at, found) "
+                    "VALUES(?,?,?,?,?)", (key, query, SEARCH_RESULTS_PER_QUERY, datetime.utcnow().isoformat(),
+                                          SEARCH_RESULTS_PER_QUERY))
+    con.commit()
+    con.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    con.close()
+    os.replace(tmp, path)
+    print(f"[benchmark] База {path}: {videos} видео, {stats_total} строк stats за {time.monotonic() - t0:.0f} с")
+    return stats_total
+
+def open_db(videos: int, days_min: int, days_max: int, seed: int) -> int:
+    """Переключает db на синтетическую базу (создаёт при необходимости). Возвращает число строк stats."""
+    path = db_path(videos, days_min, days_max, seed)
+    if not os.path.exists(path):
+        generate_db(path, videos, days_min, days_max, seed)
+    db.DB_PATH = path
+    init_db()
+    with get_conn() as con:
+        # локальный поиск должен отвечать из базы, а не ходить в YouTube
+        con.execute("UPDATE search_freshness SET refreshed_at = ?", (datetime.utcnow().isoformat(),))
+        return con.execute("SELECT COUNT(*) FROM stats").fetchone()[0]
+
+def measure(fn, repeat: int, warmup: int = 1) -> dict:
+    for _ in range(warmup):
+        fn()
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - t0) * 1000)
+    times.sort()
+    return {
+        "runs": repeat,
+        "min_ms": round(times[0], 3),
+        "median_ms": round(statistics.median(times), 3),
+        "p95_ms": round(times[math.ceil(0.95 * repeat) - 1], 3),
+        "mean_ms": round(statistics.fmean(times), 3),
+    }
+
+def _get(client, url: str, cold: bool = False):
+    if cold:
+        response_cache.clear()
+    response = client.get(url)
+    if response.status_code != 200:
+        raise RuntimeError(f"{url}: HTTP {response.status_code}")
+    return response.get_json()
+
+def _local_search(client):
+    data = _get(client, f"/api/search_direct_links?query={QUERIES[0]}&max_results=5")
+    if data["source"] != "local":
+        raise RuntimeError(f"/api/search_direct_links ответил из {data['source']}, а не из базы")
+
+def _use_fake_api(server):
+    env = fake_youtube.api_env(server)
+    fetch_shorts.YOUTUBE_API_URL = search_trends.YOUTUBE_API_URL = env["YOUTUBE_API_URL"]
+    search_trends.YOUTUBE_SEARCH_URL = env["YOUTUBE_SEARCH_URL"]
+
+def _cleanup_ingest(video_ids: list[str]):
+    with get_conn() as con:
+        con.execute("DELETE FROM stats WHERE snapshot_date = ?", (BENCH_SNAPSHOT_DATE,))
+        con.executemany("DELETE FROM videos WHERE video_id = ?", [(vid,) for vid in video_ids])
+        con.commit()
+
+def benchmarks(client, videos: int, seed: int, snapshot_records: list[dict]) -> list[tuple[str, int, callable]]:
+    """(имя, число прогонов, функция) в порядке выполнения; ингест - последним."""
+    rng = random.Random(f"{seed}:bench")
+    titles = [(" ".join(rng.sample(KEYWORDS, 4)), "", rng.sample(KEYWORDS, 3)) for _ in range(1000)]
+    stats_records = [{"meta": {"video_id": _video_id(i)},
+                      "stats": {"view_count": 1000, "like_count": 50, "comment_count": 3}}
+                     for i in rng.sample(range(videos), min(500, videos))]
+    return [
+        ("rank_top_n", 5, lambda: rank_top_n(TOP_N_DOWNLOAD)),
+        ("api_trending", 20, lambda: _get(client, "/api/trending", cold=True)),
+        ("api_trending_cached", 50, lambda: _get(client, "/api/trending")),
+        ("api_videos_by_genre", 5, lambda: _get(client, f"/api/videos_by_genre?genres={GENRES[0]}&min_confidence=0.5")),
+        ("api_search_direct_links_local", 20, lambda: _local_search(client)),
+        ("get_downloaded_files", 10, get_downloaded_files),
+        ("analyze_genre_1000", 10, lambda: [analyze_genre(*t) for t in titles]),
+        ("ingest_fetch_popular", 5, lambda: [b for b, _ in fetch_shorts.iter_popular_batches("US")]),
+        ("ingest_search_query", 5, lambda: search_trends.search_query_records(QUERIES[0])),
+        ("ingest_store_stats_500", 10, lambda: store_stats(stats_records, BENCH_SNAPSHOT_DATE)),
+        ("ingest_store_snapshots", 10, lambda: store_snapshots(snapshot_records, BENCH_SNAPSHOT_DATE)),
+    ]
+
+def run_scale(scale: str, days_min: int, days_max: int, seed: int, only: Optional[set] = None,
+              repeat: Optional[int] = None) -> list[dict]:
+    videos = SCALES[scale]
+    stats_rows = open_db(videos, days_min, days_max, seed)
+    server = fake_youtube.start(fake_youtube.FakeYouTube(quota=0, seed=seed))
+    _use_fake_api(server)
+    snapshot_records = [r for batch, _ in fetch_shorts.iter_popular_batches("US") for r in batch]
+    snapshot_records += search_trends.search_query_records(QUERIES[0])
+    results = []
+    try:
+        for name, runs, fn in benchmarks(app.test_client(), videos, seed, snapshot_records):
+            if only and name not in only:
+                continue
+            result = {"scale": scale, "benchmark": name, "videos": videos, "stats_rows": stats_rows,
+                      **measure(fn, repeat or runs)}
+            print(f"[benchmark] {scale:<5} {name:<32} median {result['median_ms']:>10.2f} ms"
+                  f"  p95 {result['p95_ms']:>10.2f} ms")
+            results.append(result)
+    finally:
+        server.shutdown()
+        _cleanup_ingest([r["meta"]["video_id"] for r in snapshot_records])
+    return results
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_suite(scales: list[str], days_min: int = 30, days_max: int = 90, seed: int = 0,
+              only: Optional[set] = None, repeat: Optional[int] = None) -> dict:
+    return {
+        "created_at": datetime.utcnow().isoformat(),
+        "git_commit": _git_commit(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "params": {"days_min": days_min, "days_max": days_max, "seed": seed},
+        "results": [r for scale in scales for r in run_scale(scale, days_min, days_max, seed, only, repeat)],
+    }
+
+def compare(current: dict, baseline: dict, threshold_pct: float = BENCH_REGRESSION_PCT,
+            min_delta_ms: float = BENCH_MIN_DELTA_MS) -> list[dict]:
+    """Сравнение медиан с базовой линией; бенчмарки, которых в ней нет, пропускаются."""
+    base = {(r["scale"], r["benchmark"]): r for r in baseline["results"]}
+    thresholds = baseline.get("thresholds", {})
+    report = []
+    for r in current["results"]:
+        b = base.get((r["scale"], r["benchmark"]))
+        if b is None:
+            continue
+        limit = thresholds.get(r["benchmark"], threshold_pct)
+        delta = r["median_ms"] - b["median_ms"]
+        change = round(delta / b["median_ms"] * 100, 1) if b["median_ms"] else None
+        report.append({
+            "scale": r["scale"],
+            "benchmark": r["benchmark"],
+            "baseline_ms": b["median_ms"],
+            "median_ms": r["median_ms"],
+            "change_pct": change,
+            "threshold_pct": limit,
+            "regression": change is not None and change > limit and delta > min_delta_ms,
+        })
+    return report
+
+def _print_comparison(report: list[dict]):
+    print(f"\n{'scale':<6}{'benchmark':<33}{'baseline':>11}{'median':>11}{'change':>9}")
+    for r in report:
+        change = f"{r['change_pct']:+.1f}%" if r["change_pct"] is not None else "-"
+        mark = "  РЕГРЕССИЯ" if r["regression"] else ""
+        print(f"{r['scale']:<6}{r['benchmark']:<33}{r['baseline_ms']:>11.2f}{r['median_ms']:>11.2f}{change:>9}{mark}")
+
+def _write_json(path: str, data: dict):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Бенчмарки на синтетических данных")
+    parser.add_argument("--scales", default="10k", help=f"через запятую: {','.join(SCALES)}")
+    parser.add_argument("--days-min", type=int, default=30, help="минимальная история stats на видео, дней")
+    parser.add_argument("--days-max", type=int, default=90, help="максимальная история stats на видео, дней")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--only", default=None, help="только эти бенчмарки (через запятую)")
+    parser.add_argument("--repeat", type=int, default=None, help="число прогонов вместо значений по умолчанию")
+    parser.add_argument("--out", default=None, help="куда записать результаты (по умолчанию BENCH_DIR/results-*.json)")
+    parser.add_argument("--baseline", default=None, help="сравнить с сохранёнными результатами")
+    parser.add_argument("--threshold", type=float, default=BENCH_REGRESSION_PCT, help="порог регрессии, %%")
+    parser.add_argument("--save-baseline", default=None, help="сохранить результаты как базовую линию")
+    args = parser.parse_args()
+
+    scales = [s.strip().lower() for s in args.scales.split(",") if s.strip()]
+    unknown = [s for s in scales if s not in SCALES]
+    if unknown:
+        parser.error(f"неизвестный размер: {', '.join(unknown)}")
+    only = {n.strip() for n in args.only.split(",")} if args.only else None
+    data = run_suite(scales, args.days_min, args.days_max, args.seed, only, args.repeat)
+
+    out = args.out or os.path.join(BENCH_DIR, f"results-{datetime.utcnow().strftime('%Y%m%dT%H%M%S')}.json")
+    _write_json(out, data)
+    print(f"[benchmark] Результаты: {out}")
+    if args.save_baseline:
+        thresholds = {}
+        if os.path.exists(args.save_baseline):
+            with open(args.save_baseline, encoding="utf-8") as f:
+                thresholds = json.load(f).get("thresholds", {})
+        _write_json(args.save_baseline, data | ({"thresholds": thresholds} if thresholds else {}))
+        print(f"[benchmark] Базовая линия сохранена: {args.save_baseline}")
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            report = compare(data, json.load(f), args.threshold)
+        _print_comparison(report)
+        if any(r["regression"] for r in report):
+            sys.exit(1)
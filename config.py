@@ -12,9 +12,122 @@ TOP_N_DOWNLOAD = int(os.getenv("TOP_N_DOWNLOAD", "10"))
 MEDIA_DIR = os.getenv("MEDIA_DIR", "media")
 DB_PATH = os.getenv("DB_PATH", "data/shorts.db")
 
-# YouTube Data API
-YOUTUBE_API_URL = "https://www.googleapis.com/youtube/v3/videos"
-YOUTUBE_SEARCH_URL = "https://www.googleapis.com/youtube/v3/search"
+# Хранение аудио: "mp3" - перекодировать при скачивании, "native" - сохранять лучший аудиопоток
+# как есть (opus/m4a). В режиме native mp3 делается по запросу и кэшируется
+AUDIO_STORAGE_MODE = os.getenv("AUDIO_STORAGE_MODE", "mp3")
+MP3_QUALITY = os.getenv("MP3_QUALITY", "192")
+TRANSCODE_CACHE_DIR = os.getenv("TRANSCODE_CACHE_DIR", os.path.join(MEDIA_DIR, "mp3_cache"))
+
+# Бюджет диска для MEDIA_DIR в байтах (0 - без ограничения) и политика вытеснения: lru или trend
+MEDIA_CACHE_MAX_BYTES = int(os.getenv("MEDIA_CACHE_MAX_BYTES", "0"))
+MEDIA_EVICTION_POLICY = os.getenv("MEDIA_EVICTION_POLICY", "lru")
+# Файлы, к которым обращались (или которые скачали) за последние N секунд, не вытесняются
+MEDIA_EVICTION_GRACE_SECONDS = int(os.getenv("MEDIA_EVICTION_GRACE_SECONDS", "600"))
+
+# Кэш прямых ссылок на аудио: размер LRU в памяти, запас до истечения ссылки,
+# и время жизни, если в ссылке нет параметра expire
+DIRECT_URL_CACHE_SIZE = int(os.getenv("DIRECT_URL_CACHE_SIZE", "1024"))
+DIRECT_URL_SAFETY_SECONDS = int(os.getenv("DIRECT_URL_SAFETY_SECONDS", "600"))
+DIRECT_URL_DEFAULT_TTL = int(os.getenv("DIRECT_URL_DEFAULT_TTL", "3600"))
+# Сколько ссылок извлекается параллельно в пакетном запросе
+DIRECT_URL_WORKERS = int(os.getenv("DIRECT_URL_WORKERS", "8"))
+DIRECT_URL_BATCH_MAX = int(os.getenv("DIRECT_URL_BATCH_MAX", "50"))
+
+# Размер куска при проксировании аудио в /api/stream
+STREAM_CHUNK_BYTES = int(os.getenv("STREAM_CHUNK_BYTES", str(1024 * 1024)))
+
+# Отдача файлов фронтовым веб-сервером: "" - сам Flask, "x-accel" - nginx (X-Accel-Redirect),
+# "x-sendfile" - Apache/lighttpd (X-Sendfile). Для x-accel MEDIA_DIR должен быть доступен
+# nginx как internal location с префиксом SENDFILE_ACCEL_PREFIX
+SENDFILE_MODE = os.getenv("SENDFILE_MODE", "")
+SENDFILE_ACCEL_PREFIX = os.getenv("SENDFILE_ACCEL_PREFIX", "/protected-media/")
+# Префикс для TRANSCODE_CACHE_DIR, если он вынесен за пределы MEDIA_DIR ("" - такие файлы отдаёт Flask)
+SENDFILE_TRANSCODE_ACCEL_PREFIX = os.getenv("SENDFILE_TRANSCODE_ACCEL_PREFIX", "")
+
+# Кэш ответов API: как часто перечитывать data_version из базы (изменения из других процессов)
+# и сколько ответов держать в памяти
+DATA_VERSION_CHECK_SECONDS = float(os.getenv("DATA_VERSION_CHECK_SECONDS", "1"))
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "256"))
+
+# Server-Sent Events: период проверки data_version, размер очереди клиента, длина списка трендов
+EVENTS_POLL_SECONDS = float(os.getenv("EVENTS_POLL_SECONDS", "2"))
+EVENTS_QUEUE_SIZE = int(os.getenv("EVENTS_QUEUE_SIZE", "100"))
+EVENTS_TRENDING_LIMIT = int(os.getenv("EVENTS_TRENDING_LIMIT", "10"))
+# Сколько SSE-подключений держит один процесс: каждое занимает поток gthread (WEB_THREADS),
+# сверх лимита /api/events отвечает 503 и дашборд переходит на опрос
+EVENTS_MAX_CONNECTIONS = int(os.getenv("EVENTS_MAX_CONNECTIONS", "2"))
+EVENTS_RETRY_SECONDS = int(os.getenv("EVENTS_RETRY_SECONDS", "30"))
+
+# Профилирование по запросу: доля профилируемых запросов (0 - выключено), токен для заголовка
+# X-Profile-Token (включает профиль конкретного запроса и доступ к /api/admin/profiles),
+# профилирование этапов пайплайна, каталог и число хранимых профилей, интервал сэмплирования
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN", "")
+PROFILE_PIPELINE = os.getenv("PROFILE_PIPELINE", "0") == "1"
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(os.path.dirname(DB_PATH) or ".", "profiles"))
+PROFILE_MAX_FILES = int(os.getenv("PROFILE_MAX_FILES", "50"))
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+
+# Сколько пачек записей этапы пайплайна могут опередить писателя SQLite
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", "8"))
+# Незавершённый запуск не старше стольких часов продолжается с контрольных точек
+PIPELINE_RESUME_MAX_AGE_HOURS = float(os.getenv("PIPELINE_RESUME_MAX_AGE_HOURS", "6"))
+# Выполненный в прерванном запуске этап-источник старше стольких минут при продолжении
+# выполняется заново: его данные уже устарели
+PIPELINE_RESUME_RERUN_MINUTES = float(os.getenv("PIPELINE_RESUME_RERUN_MINUTES", "10"))
+
+# Планировщик (scheduler.py): период задач в секундах, час ночного обслуживания (UTC),
+# случайный сдвиг запуска как доля периода, аренда задачи и период проверки расписания
+SCHEDULE_STATS_REFRESH_SECONDS = int(os.getenv("SCHEDULE_STATS_REFRESH_SECONDS", "900"))
+SCHEDULE_CHART_SECONDS = int(os.getenv("SCHEDULE_CHART_SECONDS", "3600"))
+SCHEDULE_SEARCH_SECONDS = int(os.getenv("SCHEDULE_SEARCH_SECONDS", "21600"))
+SCHEDULE_NIGHTLY_HOUR = int(os.getenv("SCHEDULE_NIGHTLY_HOUR", "3"))
+SCHEDULER_JITTER_FRACTION = float(os.getenv("SCHEDULER_JITTER_FRACTION", "0.1"))
+SCHEDULER_LEASE_SECONDS = int(os.getenv("SCHEDULER_LEASE_SECONDS", "1800"))
+SCHEDULER_TICK_SECONDS = float(os.getenv("SCHEDULER_TICK_SECONDS", "15"))
+# Обновление статистики: видео, встречавшиеся в чарте/поиске за последние N дней, не больше M
+STATS_REFRESH_DAYS = int(os.getenv("STATS_REFRESH_DAYS", "7"))
+STATS_REFRESH_MAX_VIDEOS = int(os.getenv("STATS_REFRESH_MAX_VIDEOS", "1000"))
+# Для дней старше N в stats остаётся один снимок на видео за день
+STATS_COMPACT_AFTER_DAYS = int(os.getenv("STATS_COMPACT_AFTER_DAYS", "2"))
+
+# Распределённый сбор (shards.py): регионы через запятую, аренда шарда и период heartbeat,
+# число попыток, сколько id в одном шарде обновления статистики
+SHARD_REGIONS = [r.strip() for r in os.getenv("SHARD_REGIONS", REGION_CODE).split(",") if r.strip()]
+SHARD_LEASE_SECONDS = int(os.getenv("SHARD_LEASE_SECONDS", "120"))
+SHARD_HEARTBEAT_SECONDS = float(os.getenv("SHARD_HEARTBEAT_SECONDS", "30"))
+SHARD_MAX_ATTEMPTS = int(os.getenv("SHARD_MAX_ATTEMPTS", "3"))
+SHARD_STATS_SIZE = int(os.getenv("SHARD_STATS_SIZE", "50"))
+
+# Production-сервер (gunicorn.conf.py): WEB_CONCURRENCY - число процессов (0 - подобрать по CPU
+# и памяти из расчёта WEB_WORKER_MEMORY_MB на процесс), WEB_THREADS - потоков в процессе
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "0"))
+WEB_THREADS = int(os.getenv("WEB_THREADS", "8"))
+WEB_WORKER_MEMORY_MB = int(os.getenv("WEB_WORKER_MEMORY_MB", "200"))
+WEB_MAX_WORKERS = int(os.getenv("WEB_MAX_WORKERS", "8"))
+WEB_TIMEOUT = int(os.getenv("WEB_TIMEOUT", "120"))
+WEB_GRACEFUL_TIMEOUT = int(os.getenv("WEB_GRACEFUL_TIMEOUT", "30"))
+
+# Бенчмарки (benchmark.py): каталог синтетических баз и результатов; регрессия - медиана выросла
+# больше чем на BENCH_REGRESSION_PCT процентов и больше чем на BENCH_MIN_DELTA_MS (шум)
+BENCH_DIR = os.getenv("BENCH_DIR", os.path.join(os.path.dirname(DB_PATH) or ".", "bench"))
+BENCH_REGRESSION_PCT = float(os.getenv("BENCH_REGRESSION_PCT", "20"))
+BENCH_MIN_DELTA_MS = float(os.getenv("BENCH_MIN_DELTA_MS", "2"))
+
+# Очередь скачивания аудио
+DOWNLOAD_MAX_ATTEMPTS = int(os.getenv("DOWNLOAD_MAX_ATTEMPTS", "5"))
+DOWNLOAD_LEASE_SECONDS = int(os.getenv("DOWNLOAD_LEASE_SECONDS", "600"))
+# Как часто воркер продлевает аренду, пока идёт скачивание
+DOWNLOAD_HEARTBEAT_SECONDS = float(os.getenv("DOWNLOAD_HEARTBEAT_SECONDS", "60"))
+DOWNLOAD_BACKOFF_BASE_SECONDS = int(os.getenv("DOWNLOAD_BACKOFF_BASE_SECONDS", "30"))
+DOWNLOAD_BACKOFF_MAX_SECONDS = int(os.getenv("DOWNLOAD_BACKOFF_MAX_SECONDS", "3600"))
+DOWNLOAD_POLL_SECONDS = float(os.getenv("DOWNLOAD_POLL_SECONDS", "2"))
+# Сколько потоков-воркеров запускать внутри веб-приложения (0 - только отдельный процесс)
+DOWNLOAD_WORKER_THREADS = int(os.getenv("DOWNLOAD_WORKER_THREADS", "1"))
+
+# YouTube Data API. Для офлайн-прогонов можно указать локальный fake_youtube.py
+YOUTUBE_API_URL = os.getenv("YOUTUBE_API_URL", "https://www.googleapis.com/youtube/v3/videos")
+YOUTUBE_SEARCH_URL = os.getenv("YOUTUBE_SEARCH_URL", "https://www.googleapis.com/youtube/v3/search")
 
 # Поисковые запросы для трендовых звуков
 SEARCH_QUERIES = [
@@ -33,3 +146,8 @@ SEARCH_QUERIES = [
 # Настройки поиска
 SEARCH_MAX_RESULTS = 50
 SEARCH_ORDER = "relevance"  # relevance, date, rating, viewCount, title
+# Сколько секунд результат пользовательского поиска переиспользуется одинаковыми запросами
+SEARCH_FRESHNESS_SECONDS = int(os.getenv("SEARCH_FRESHNESS_SECONDS", "30"))
+# Сколько секунд локальные результаты запроса считаются свежими для /api/search_direct_links.
+# Устаревшие результаты отдаются сразу и обновляются в фоне
+SEARCH_LOCAL_FRESH_SECONDS = int(os.getenv("SEARCH_LOCAL_FRESH_SECONDS", "3600"))
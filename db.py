@@ -1,9 +1,11 @@
 import os
 import sqlite3
-from datetime import datetime
+import time
+from datetime import datetime, timedelta
 from typing import Optional, Dict, Any
 
 from config import DB_PATH
+from metrics import TimedConnection
 
 os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
 
@@ -34,23 +36,184 @@ CREATE TABLE IF NOT EXISTS stats (
     FOREIGN KEY(video_id) REFERENCES videos(video_id)
 );
 
+CREATE INDEX IF NOT EXISTS idx_stats_video_date ON stats(video_id, snapshot_date);
+
 CREATE TABLE IF NOT EXISTS downloads (
     video_id TEXT PRIMARY KEY,
     audio_path TEXT,
     downloaded_at TEXT,
     duration_sec INTEGER,
-    format TEXT
+    format TEXT,
+    blob_hash TEXT,               -- ссылка на blobs.hash
+    size_bytes INTEGER,
+    last_accessed TEXT            -- последнее обращение через /download
+);
+
+-- Контентно-адресуемое хранилище: один файл на уникальное содержимое
+CREATE TABLE IF NOT EXISTS blobs (
+    hash TEXT PRIMARY KEY,        -- sha256 содержимого
+    path TEXT,
+    size_bytes INTEGER,
+    format TEXT,
+    ref_count INTEGER DEFAULT 0,  -- сколько строк downloads ссылается на файл
+    created_at TEXT
+);
+
+-- Кэш прямых ссылок на аудио (googlevideo), живут до expires_at
+CREATE TABLE IF NOT EXISTS resolved_urls (
+    video_id TEXT PRIMARY KEY,
+    url TEXT,
+    format TEXT,
+    expires_at INTEGER,           -- unix time
+    resolved_at TEXT
+);
+
+-- Служебные значения: data_version растёт при каждой записи данных ингеста
+CREATE TABLE IF NOT EXISTS app_meta (
+    key TEXT PRIMARY KEY,
+    value INTEGER
+);
+
+-- Когда пользовательский запрос последний раз обновлялся из YouTube и что он вернул
+CREATE TABLE IF NOT EXISTS search_freshness (
+    query_key TEXT PRIMARY KEY,   -- нормализованный запрос
+    query TEXT,
+    max_results INTEGER,
+    refreshed_at TEXT,
+    found INTEGER
+);
+
+CREATE TABLE IF NOT EXISTS search_results (
+    query_key TEXT,
+    video_id TEXT,
+    rank INTEGER,
+    PRIMARY KEY (query_key, video_id)
+);
+
+CREATE TABLE IF NOT EXISTS download_jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    video_id TEXT,
+    state TEXT DEFAULT 'queued',  -- queued, running, done, failed
+    attempts INTEGER DEFAULT 0,
+    lease_until TEXT,             -- ISO UTC, пока воркер держит задачу
+    lease_owner TEXT,             -- worker_id() воркера, который держит задачу
+    run_after TEXT,               -- ISO UTC, не брать раньше (backoff)
+    error TEXT,
+    created_at TEXT,
+    updated_at TEXT
+);
+
+CREATE INDEX IF NOT EXISTS idx_download_jobs_state ON download_jobs(state, run_after);
+CREATE INDEX IF NOT EXISTS idx_download_jobs_video ON download_jobs(video_id);
+
+-- Журнал запусков пайплайна (см. ledger.py)
+CREATE TABLE IF NOT EXISTS pipeline_runs (
+    run_id TEXT PRIMARY KEY,
+    trigger TEXT,                 -- api, cli, scheduler
+    status TEXT,                  -- running, done, partial (часть элементов не удалась), failed
+    started_at TEXT,
+    finished_at TEXT,
+    duration_sec REAL,
+    result_count INTEGER,
+    error TEXT
+);
+
+CREATE INDEX IF NOT EXISTS idx_pipeline_runs_started ON pipeline_runs(started_at);
+
+CREATE TABLE IF NOT EXISTS pipeline_stage_spans (
+    run_id TEXT,
+    stage TEXT,
+    status TEXT,
+    started_at TEXT,
+    finished_at TEXT,
+    duration_sec REAL,
+    item_count INTEGER,
+    api_calls INTEGER DEFAULT 0,
+    api_errors INTEGER DEFAULT 0,
+    quota_units INTEGER DEFAULT 0,
+    rows_written INTEGER DEFAULT 0,
+    error TEXT,
+    PRIMARY KEY (run_id, stage)
+);
+
+CREATE INDEX IF NOT EXISTS idx_stage_spans_stage ON pipeline_stage_spans(stage, started_at);
+
+-- Последняя записанная контрольная точка этапа: позиция (JSON) и сколько записей уже сохранено
+CREATE TABLE IF NOT EXISTS pipeline_checkpoints (
+    run_id TEXT,
+    stage TEXT,
+    position TEXT,
+    items INTEGER,
+    updated_at TEXT,
+    PRIMARY KEY (run_id, stage)
+);
+
+-- Части (шарды) распределённого сбора данных (см. shards.py)
+CREATE TABLE IF NOT EXISTS work_shards (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    batch TEXT,                   -- ключ сбора: все воркеры с одним batch делят одни шарды
+    kind TEXT,                    -- search, chart, stats
+    payload TEXT,                 -- JSON: запрос и регион / регион / список video_id
+    state TEXT DEFAULT 'queued',  -- queued, running, done, failed
+    owner TEXT,
+    lease_until TEXT,             -- ISO UTC, продлевается heartbeat
+    heartbeat_at TEXT,
+    attempts INTEGER DEFAULT 0,
+    result_count INTEGER,
+    error TEXT,
+    created_at TEXT,
+    updated_at TEXT,
+    UNIQUE (batch, kind, payload)
+);
+
+CREATE INDEX IF NOT EXISTS idx_work_shards_state ON work_shards(batch, state);
+
+-- Состояние плановых задач (см. scheduler.py)
+CREATE TABLE IF NOT EXISTS schedule_state (
+    job TEXT PRIMARY KEY,
+    scheduled_at TEXT,            -- ISO UTC, слот расписания без jitter
+    next_run_at TEXT,             -- ISO UTC, слот + jitter
+    lease_owner TEXT,
+    lease_until TEXT,             -- ISO UTC, пока задача выполняется
+    last_started_at TEXT,
+    last_finished_at TEXT,
+    last_status TEXT,             -- done, failed
+    last_duration_sec REAL,
+    last_error TEXT
 );
 """
 
+# Колонки, добавленные после первой версии схемы: (таблица, колонка, тип)
+COLUMN_MIGRATIONS = [
+    ("downloads", "blob_hash", "TEXT"),
+    ("downloads", "size_bytes", "INTEGER"),
+    ("downloads", "last_accessed", "TEXT"),
+    ("download_jobs", "lease_owner", "TEXT"),
+]
+
+# Индексы по мигрированным колонкам создаются после миграции
+MIGRATION_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS idx_downloads_blob ON downloads(blob_hash)",
+    "CREATE INDEX IF NOT EXISTS idx_downloads_accessed ON downloads(last_accessed)",
+]
+
 def get_conn():
-    conn = sqlite3.connect(DB_PATH)
+    conn = sqlite3.connect(DB_PATH, factory=TimedConnection)
     conn.row_factory = sqlite3.Row
     return conn
 
 def init_db():
     with get_conn() as con:
         con.executescript(SCHEMA)
+        _migrate_columns(con)
+
+def _migrate_columns(con):
+    for table, column, decl in COLUMN_MIGRATIONS:
+        existing = {row["name"] for row in con.execute(f"PRAGMA table_info({table})")}
+        if column not in existing:
+            con.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+    for sql in MIGRATION_INDEXES:
+        con.execute(sql)
 
 def upsert_video(meta: Dict[str, Any]):
     with get_conn() as con:
@@ -87,6 +250,34 @@ def upsert_video(meta: Dict[str, Any]):
             )
         con.commit()
 
+# Последняя прочитанная версия данных: (версия, time.monotonic() чтения)
+_data_version_seen = (0, float("-inf"))
+
+def bump_data_version() -> int:
+    """Отмечает изменение данных: кэши ответов, построенные на старой версии, становятся неактуальны."""
+    global _data_version_seen
+    with get_conn() as con:
+        con.execute("""
+            INSERT INTO app_meta(key, value) VALUES('data_version', 1)
+            ON CONFLICT(key) DO UPDATE SET value = value + 1
+        """)
+        con.commit()
+        version = con.execute("SELECT value FROM app_meta WHERE key = 'data_version'").fetchone()["value"]
+    _data_version_seen = (version, time.monotonic())
+    return version
+
+def get_data_version(max_age: float = 0.0) -> int:
+    """Текущая версия данных. max_age > 0 - можно вернуть значение, прочитанное не раньше max_age секунд назад."""
+    global _data_version_seen
+    version, seen_at = _data_version_seen
+    if time.monotonic() - seen_at < max_age:
+        return version
+    with get_conn() as con:
+        row = con.execute("SELECT value FROM app_meta WHERE key = 'data_version'").fetchone()
+    version = row["value"] if row else 0
+    _data_version_seen = (version, time.monotonic())
+    return version
+
 def insert_stats(video_id: str, snapshot_date: str, view_count: int,
                  like_count: Optional[int], comment_count: Optional[int]):
     with get_conn() as con:
@@ -95,16 +286,90 @@ def insert_stats(video_id: str, snapshot_date: str, view_count: int,
             VALUES(?,?,?,?,?)""", (video_id, snapshot_date, view_count, like_count, comment_count))
         con.commit()
 
-def last_two_stats(video_id: str):
+def store_snapshots(records: list[Dict[str, Any]], snapshot_date: str) -> int:
+    """
+    Записывает пачку видео и их статистики одной транзакцией.
+    record = {"meta": {...как для upsert_video...}, "stats": {"view_count", "like_count", "comment_count"}}.
+    Жанр, найденный раньше, не затирается записью без жанра (этапы пайплайна идут параллельно).
+    """
+    if not records:
+        return 0
+    with get_conn() as con:
+        write_snapshots(con, records, snapshot_date)
+        con.commit()
+    return len(records)
+
+def write_snapshots(con, records: list[Dict[str, Any]], snapshot_date: str):
+    """То же, что store_snapshots, но в транзакции вызывающего (без commit)."""
+    now = datetime.utcnow().isoformat()
+    con.executemany("""
+        INSERT INTO videos(video_id, title, channel_title, published_at,
+            duration_sec, is_short, region, first_seen, last_seen, primary_genre, genre_confidence)
+        VALUES(?,?,?,?,?,?,?,?,?,?,?)
+        ON CONFLICT(video_id) DO UPDATE SET
+            title=excluded.title, channel_title=excluded.channel_title,
+            published_at=excluded.published_at, duration_sec=excluded.duration_sec,
+            is_short=excluded.is_short, region=excluded.region, last_seen=excluded.last_seen,
+            genre_confidence=CASE WHEN excluded.primary_genre IS NULL
+                                  THEN videos.genre_confidence ELSE excluded.genre_confidence END,
+            primary_genre=COALESCE(excluded.primary_genre, videos.primary_genre)""",
+        [(m["video_id"], m["title"], m["channel_title"], m["published_at"], m["duration_sec"],
+          1 if m["is_short"] else 0, m["region"], now, now,
+          m.get("primary_genre"), m.get("genre_confidence", 0.0))
+         for m in (r["meta"] for r in records)])
+    write_stats(con, records, snapshot_date)
+
+def store_stats(records: list[Dict[str, Any]], snapshot_date: str) -> int:
+    """Только снимки статистики (без обновления videos.last_seen) - для планового обновления."""
+    if not records:
+        return 0
+    with get_conn() as con:
+        write_stats(con, records, snapshot_date)
+        con.commit()
+    return len(records)
+
+def write_stats(con, records: list[Dict[str, Any]], snapshot_date: str):
+    con.executemany("""
+        INSERT INTO stats(video_id, snapshot_date, view_count, like_count, comment_count)
+        VALUES(?,?,?,?,?)""",
+        [(r["meta"]["video_id"], snapshot_date, r["stats"]["view_count"],
+          r["stats"]["like_count"], r["stats"]["comment_count"]) for r in records])
+
+def tracked_video_ids(days: int, limit: int) -> list[str]:
+    """Видео, которые появлялись в чарте или поиске за последние days дней (новые первыми)."""
+    since = (datetime.utcnow() - timedelta(days=days)).isoformat()
     with get_conn() as con:
         rows = con.execute("""
+            SELECT video_id FROM videos
+            WHERE last_seen >= ?
+            ORDER BY last_seen DESC
+            LIMIT ?""", (since, limit)).fetchall()
+    return [r["video_id"] for r in rows]
+
+def last_two_stats(video_id: str):
+    """Последний снимок и последний снимок за предыдущий день.
+
+    Планировщик пишет несколько снимков в день, поэтому скорость считается
+    между днями, а не между двумя соседними снимками одного дня.
+    """
+    with get_conn() as con:
+        latest = con.execute("""
             SELECT snapshot_date, view_count
             FROM stats
             WHERE video_id=?
-            ORDER BY snapshot_date DESC
-            LIMIT 2
-        """, (video_id,)).fetchall()
-        return rows
+            ORDER BY snapshot_date DESC, id DESC
+            LIMIT 1
+        """, (video_id,)).fetchone()
+        if latest is None:
+            return []
+        prev = con.execute("""
+            SELECT snapshot_date, view_count
+            FROM stats
+            WHERE video_id=? AND snapshot_date < ?
+            ORDER BY snapshot_date DESC, id DESC
+            LIMIT 1
+        """, (video_id, latest["snapshot_date"])).fetchone()
+        return [latest, prev] if prev else [latest]
 
 def not_downloaded_ids(candidates: list[str]) -> list[str]:
     if not candidates:
@@ -118,14 +383,6 @@ def not_downloaded_ids(candidates: list[str]) -> list[str]:
         already = {r["video_id"] for r in rows}
     return [vid for vid in candidates if vid not in already]
 
-def mark_download(video_id: str, audio_path: str, duration_sec: int, fmt: str = "mp3"):
-    with get_conn() as con:
-        con.execute("""
-            INSERT OR REPLACE INTO downloads(video_id, audio_path, downloaded_at, duration_sec, format)
-            VALUES(?,?,?,?,?)
-        """, (video_id, audio_path, datetime.utcnow().isoformat(), duration_sec, fmt))
-        con.commit()
-
 def get_downloaded_files():
     with get_conn() as con:
         rows = con.execute("""
@@ -137,6 +394,56 @@ def get_downloaded_files():
         """).fetchall()
         return [dict(row) for row in rows]
 
+def get_trending(limit: int = 10) -> list[Dict[str, Any]]:
+    """Последние увиденные Shorts с последним снимком статистики."""
+    with get_conn() as con:
+        rows = con.execute("""
+            WITH recent AS (
+                SELECT video_id, title, channel_title, duration_sec, primary_genre, genre_confidence, last_seen
+                FROM videos
+                WHERE is_short = 1
+                ORDER BY last_seen DESC
+                LIMIT ?
+            )
+            SELECT r.*, s.view_count, s.like_count, s.comment_count, s.snapshot_date
+            FROM recent r
+            LEFT JOIN stats s ON s.id = (
+                SELECT id FROM stats
+                WHERE video_id = r.video_id
+                ORDER BY snapshot_date DESC, id DESC
+                LIMIT 1
+            )
+            ORDER BY r.last_seen DESC
+        """, (limit,)).fetchall()
+
+    return [{
+        "video_id": row["video_id"],
+        "title": row["title"],
+        "channel_title": row["channel_title"],
+        "duration_sec": row["duration_sec"],
+        "primary_genre": row["primary_genre"],
+        "genre_confidence": row["genre_confidence"],
+        "stats": {
+            "view_count": row["view_count"] or 0,
+            "like_count": row["like_count"] or 0,
+            "comment_count": row["comment_count"] or 0,
+            "last_updated": row["snapshot_date"]
+        }
+    } for row in rows]
+
+def get_download(video_id: str) -> Optional[Dict[str, Any]]:
+    with get_conn() as con:
+        row = con.execute("""
+            SELECT video_id, audio_path, downloaded_at, duration_sec, format, blob_hash, size_bytes
+            FROM downloads
+            WHERE video_id = ?
+        """, (video_id,)).fetchone()
+        return dict(row) if row else None
+
+def video_exists(video_id: str) -> bool:
+    with get_conn() as con:
+        return con.execute("SELECT 1 FROM videos WHERE video_id = ?", (video_id,)).fetchone() is not None
+
 def get_videos_by_genre(genres: list[str], min_confidence: float = 0.1):
     with get_conn() as con:
         if not genres:
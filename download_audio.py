@@ -1,47 +1,96 @@
 import os
-from datetime import datetime
+import subprocess
+import threading
 import yt_dlp
-from db import mark_download, get_conn, not_downloaded_ids
-from config import MEDIA_DIR
+from db import get_conn, not_downloaded_ids
+from config import AUDIO_STORAGE_MODE, MP3_QUALITY, TRANSCODE_CACHE_DIR
+from media_store import INCOMING_DIR, store_file
+from metrics import track_duration, transcode_duration, ytdlp_duration
 
-def _year_month_dir(base: str) -> str:
-    d = datetime.utcnow()
-    path = os.path.join(base, f"{d.year}", f"{d.month:02d}")
-    os.makedirs(path, exist_ok=True)
-    return path
+AUDIO_MIMETYPES = {
+    "mp3": "audio/mpeg",
+    "m4a": "audio/mp4",
+    "webm": "audio/webm",
+    "opus": "audio/ogg",
+    "ogg": "audio/ogg",
+}
 
-def download_audio_for(video_ids: list[str]) -> None:
-    to_download = not_downloaded_ids(video_ids)
-    if not to_download:
-        print("[download_audio] Nothing to download.")
-        return
-
-    out_dir = _year_month_dir(MEDIA_DIR)
+def make_downloader() -> yt_dlp.YoutubeDL:
+    # файлы сначала попадают во временную папку, затем переносятся в хранилище blobs
+    os.makedirs(INCOMING_DIR, exist_ok=True)
     ydl_opts = {
         "format": "bestaudio/best",
-        "outtmpl": os.path.join(out_dir, "%(id)s.%(ext)s"),
-        "postprocessors": [{
-            "key": "FFmpegExtractAudio",
-            "preferredcodec": "mp3",
-            "preferredquality": "192",
-        }],
+        "outtmpl": os.path.join(INCOMING_DIR, "%(id)s.%(ext)s"),
         "quiet": True,
         "noplaylist": True,
     }
+    if AUDIO_STORAGE_MODE == "mp3":
+        ydl_opts["postprocessors"] = [{
+            "key": "FFmpegExtractAudio",
+            "preferredcodec": "mp3",
+            "preferredquality": MP3_QUALITY,
+        }]
+    return yt_dlp.YoutubeDL(ydl_opts)
+
+def download_one(ydl: yt_dlp.YoutubeDL, vid: str) -> str:
+    """Скачивает аудио одного видео и записывает в downloads. Ошибки пробрасываются."""
+    url = f"https://www.youtube.com/watch?v={vid}"
+    with track_duration(ytdlp_duration, "download"):
+        info = ydl.extract_info(url, download=True)
+    if AUDIO_STORAGE_MODE == "mp3":
+        # после постпроцессинга расширение станет .mp3
+        audio_path = os.path.splitext(ydl.prepare_filename(info))[0] + ".mp3"
+        fmt = "mp3"
+    else:
+        # сохраняем исходный поток без перекодирования
+        downloads = info.get("requested_downloads") or [{}]
+        audio_path = downloads[0].get("filepath") or ydl.prepare_filename(info)
+        fmt = os.path.splitext(audio_path)[1].lstrip(".") or info.get("ext", "")
+    duration = int(info.get("duration") or 0)
+    audio_path = store_file(vid, audio_path, duration, fmt)
+    print(f"[download_audio] OK {vid} -> {audio_path}")
+    return audio_path
+
+# Фиксированный набор блокировок: одинаковые ключи попадают на одну, память не растёт
+_TRANSCODE_LOCK_STRIPES = 64
+_transcode_locks = [threading.Lock() for _ in range(_TRANSCODE_LOCK_STRIPES)]
+
+def ensure_mp3(video_id: str, src_path: str) -> str:
+    """Возвращает mp3-версию файла, перекодируя её при первом запросе (результат кэшируется)."""
+    if src_path.lower().endswith(".mp3"):
+        return src_path
+    os.makedirs(TRANSCODE_CACHE_DIR, exist_ok=True)
+    # ключ кэша - имя исходного файла (хэш содержимого), одинаковые звуки перекодируются один раз
+    key = os.path.splitext(os.path.basename(src_path))[0] or video_id
+    out_path = os.path.join(TRANSCODE_CACHE_DIR, f"{key}.mp3")
+
+    with _transcode_locks[hash(key) % _TRANSCODE_LOCK_STRIPES]:
+        if os.path.exists(out_path) and os.path.getmtime(out_path) >= os.path.getmtime(src_path):
+            # mtime - время последнего обращения для бюджета диска (media_cache)
+            os.utime(out_path)
+            return out_path
+        tmp_path = out_path + ".part"
+        with track_duration(transcode_duration):
+            subprocess.run(
+                ["ffmpeg", "-y", "-loglevel", "error", "-i", src_path,
+                 "-vn", "-codec:a", "libmp3lame", "-b:a", f"{MP3_QUALITY}k", "-f", "mp3", tmp_path],
+                check=True,
+            )
+        os.replace(tmp_path, out_path)
+        print(f"[download_audio] Transcoded {video_id} -> {out_path}")
+    return out_path
+
+def download_audio_for(video_ids: list[str]) -> None:
+    """Ставит нескачанные видео в очередь и обрабатывает её в текущем процессе."""
+    from download_queue import enqueue_downloads, run_worker
+
+    to_download = not_downloaded_ids(video_ids)
+    if not to_download:
+        print("[download_audio] Nothing to download.")
+        return
 
-    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-        for vid in to_download:
-            url = f"https://www.youtube.com/watch?v={vid}"
-            try:
-                info = ydl.extract_info(url, download=True)
-                audio_path = ydl.prepare_filename(info)
-                # после постпроцессинга расширение станет .mp3
-                audio_path = os.path.splitext(audio_path)[0] + ".mp3"
-                duration = int(info.get("duration") or 0)
-                mark_download(vid, audio_path, duration, "mp3")
-                print(f"[download_audio] OK {vid} -> {audio_path}")
-            except Exception as e:
-                print(f"[download_audio] FAIL {vid}: {e}")
+    enqueue_downloads(to_download)
+    run_worker(until_empty=True)
 
 def latest_trending_top_n_ids(n: int = 10) -> list[str]:
     with get_conn() as con:
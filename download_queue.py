@@ -0,0 +1,224 @@
+"""
+Очередь скачивания аудио в SQLite (таблица download_jobs).
+
+Задачу забирает воркер под аренду (lease_until, lease_owner) и продлевает её, пока идёт
+скачивание. Если воркер упал, аренда истекает и задачу подхватывает другой процесс; завершить
+задачу может только текущий владелец аренды. Ошибки сохраняются в error, повтор - с
+экспоненциальной задержкой, после DOWNLOAD_MAX_ATTEMPTS задача помечается failed (в том числе
+задача, на которой воркер падал каждый раз).
+
+Запуск отдельного воркера: python download_queue.py
+"""
+
+import os
+import socket
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Optional
+
+from config import (DOWNLOAD_MAX_ATTEMPTS, DOWNLOAD_LEASE_SECONDS, DOWNLOAD_BACKOFF_BASE_SECONDS,
+                    DOWNLOAD_BACKOFF_MAX_SECONDS, DOWNLOAD_HEARTBEAT_SECONDS, DOWNLOAD_POLL_SECONDS,
+                    DOWNLOAD_WORKER_THREADS)
+from db import get_conn, init_db
+
+ACTIVE_STATES = ("queued", "running")
+
+def _now() -> datetime:
+    return datetime.utcnow()
+
+def _iso(d: datetime) -> str:
+    return d.isoformat()
+
+def _backoff_seconds(attempts: int) -> int:
+    return min(DOWNLOAD_BACKOFF_MAX_SECONDS, DOWNLOAD_BACKOFF_BASE_SECONDS * 2 ** max(0, attempts - 1))
+
+def worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}"
+
+def enqueue_downloads(video_ids: list[str]) -> dict[str, int]:
+    """Ставит видео в очередь. Для видео с активной задачей возвращает её id."""
+    now = _iso(_now())
+    job_ids = {}
+    with get_conn() as con:
+        for vid in dict.fromkeys(video_ids):
+            row = con.execute("""
+                SELECT id FROM download_jobs
+                WHERE video_id = ? AND state IN (?, ?)
+                ORDER BY id DESC LIMIT 1
+            """, (vid, *ACTIVE_STATES)).fetchone()
+            if row:
+                job_ids[vid] = row["id"]
+                continue
+            cur = con.execute("""
+                INSERT INTO download_jobs(video_id, state, attempts, run_after, created_at, updated_at)
+                VALUES(?, 'queued', 0, ?, ?, ?)
+            """, (vid, now, now, now))
+            job_ids[vid] = cur.lastrowid
+        con.commit()
+    return job_ids
+
+def get_job(job_id: int) -> Optional[dict]:
+    with get_conn() as con:
+        row = con.execute("SELECT * FROM download_jobs WHERE id = ?", (job_id,)).fetchone()
+        return dict(row) if row else None
+
+def claim_job(owner: str) -> Optional[dict]:
+    """Атомарно забирает готовую к выполнению задачу (или задачу с истёкшей арендой).
+
+    Задачи с истёкшей арендой, у которых попытки уже кончились (воркер падал на них
+    DOWNLOAD_MAX_ATTEMPTS раз), переводятся в failed и больше не выдаются.
+    """
+    now = _now()
+    con = get_conn()
+    con.isolation_level = None
+    try:
+        con.execute("BEGIN IMMEDIATE")
+        con.execute("""
+            UPDATE download_jobs
+            SET state = 'failed', lease_until = NULL, lease_owner = NULL, updated_at = ?,
+                error = COALESCE(error, 'аренда истекла: воркер не завершил задачу')
+            WHERE state = 'running' AND lease_until < ? AND attempts >= ?
+        """, (_iso(now), _iso(now), DOWNLOAD_MAX_ATTEMPTS))
+        row = con.execute("""
+            SELECT * FROM download_jobs
+            WHERE (state = 'queued' AND run_after <= ?)
+               OR (state = 'running' AND lease_until < ?)
+            ORDER BY id
+            LIMIT 1
+        """, (_iso(now), _iso(now))).fetchone()
+        if row is None:
+            con.execute("COMMIT")
+            return None
+        lease_until = _iso(now + timedelta(seconds=DOWNLOAD_LEASE_SECONDS))
+        con.execute("""
+            UPDATE download_jobs
+            SET state = 'running', attempts = attempts + 1, lease_until = ?, lease_owner = ?, updated_at = ?
+            WHERE id = ?
+        """, (lease_until, owner, _iso(now), row["id"]))
+        con.execute("COMMIT")
+        job = dict(row)
+        job.update(state="running", attempts=row["attempts"] + 1, lease_until=lease_until, lease_owner=owner)
+        return job
+    except Exception:
+        if con.in_transaction:
+            con.execute("ROLLBACK")
+        raise
+    finally:
+        con.close()
+
+def renew_lease(job_id: int, owner: str) -> bool:
+    """Продлевает аренду. False - задачу уже забрал другой воркер."""
+    now = _now()
+    with get_conn() as con:
+        cur = con.execute("""
+            UPDATE download_jobs SET lease_until = ?, updated_at = ?
+            WHERE id = ? AND lease_owner = ? AND state = 'running'
+        """, (_iso(now + timedelta(seconds=DOWNLOAD_LEASE_SECONDS)), _iso(now), job_id, owner))
+        con.commit()
+        return cur.rowcount == 1
+
+def complete_job(job_id: int, owner: str) -> bool:
+    """Отмечает задачу done, если аренда всё ещё у owner."""
+    with get_conn() as con:
+        cur = con.execute("""
+            UPDATE download_jobs
+            SET state = 'done', lease_until = NULL, lease_owner = NULL, error = NULL, updated_at = ?
+            WHERE id = ? AND lease_owner = ? AND state = 'running'
+        """, (_iso(_now()), job_id, owner))
+        con.commit()
+        return cur.rowcount == 1
+
+def fail_job(job_id: int, owner: str, attempts: int, error: str) -> bool:
+    """Возвращает задачу в очередь с задержкой или помечает failed, если аренда всё ещё у owner."""
+    now = _now()
+    with get_conn() as con:
+        if attempts >= DOWNLOAD_MAX_ATTEMPTS:
+            cur = con.execute("""
+                UPDATE download_jobs
+                SET state = 'failed', lease_until = NULL, lease_owner = NULL, error = ?, updated_at = ?
+                WHERE id = ? AND lease_owner = ? AND state = 'running'
+            """, (error, _iso(now), job_id, owner))
+        else:
+            run_after = now + timedelta(seconds=_backoff_seconds(attempts))
+            cur = con.execute("""
+                UPDATE download_jobs
+                SET state = 'queued', lease_until = NULL, lease_owner = NULL, run_after = ?, error = ?,
+                    updated_at = ?
+                WHERE id = ? AND lease_owner = ? AND state = 'running'
+            """, (_iso(run_after), error, _iso(now), job_id, owner))
+        con.commit()
+        return cur.rowcount == 1
+
+def _process(ydl, job: dict):
+    from download_audio import download_one
+    from media_cache import enforce_budget, forget_missing
+
+    vid, owner = job["video_id"], job["lease_owner"]
+    stop = threading.Event()
+
+    def beat():
+        while not stop.wait(DOWNLOAD_HEARTBEAT_SECONDS):
+            if not renew_lease(job["id"], owner):
+                print(f"[download_queue] Аренда задачи {job['id']} ({vid}) потеряна")
+                return
+
+    threading.Thread(target=beat, name=f"download-heartbeat-{job['id']}", daemon=True).start()
+    try:
+        if forget_missing(vid):
+            download_one(ydl, vid)
+            enforce_budget(keep=vid)
+        if not complete_job(job["id"], owner):
+            print(f"[download_queue] Задачу {job['id']} ({vid}) уже забрал другой воркер")
+    except Exception as e:
+        print(f"[download_queue] FAIL {vid} (попытка {job['attempts']}): {e}")
+        fail_job(job["id"], owner, job["attempts"], str(e))
+    finally:
+        stop.set()
+
+def next_attempt_at() -> Optional[datetime]:
+    """Когда может появиться готовая задача: ближайший run_after или конец аренды. None - активных задач нет."""
+    with get_conn() as con:
+        row = con.execute("""
+            SELECT MIN(CASE WHEN state = 'queued' THEN run_after ELSE lease_until END) AS at
+            FROM download_jobs WHERE state IN (?, ?)
+        """, ACTIVE_STATES).fetchone()
+    return datetime.fromisoformat(row["at"]) if row["at"] else None
+
+def run_worker(until_empty: bool = False, stop_event: Optional[threading.Event] = None):
+    """
+    Обрабатывает очередь. until_empty=True - выйти, когда в очереди не осталось ни queued, ни
+    running задач: задачи в backoff дожидаются своего run_after и повторяются.
+    """
+    from download_audio import make_downloader
+
+    init_db()
+    owner = worker_id()
+    with make_downloader() as ydl:
+        while not (stop_event and stop_event.is_set()):
+            job = claim_job(owner)
+            if job is None:
+                delay = DOWNLOAD_POLL_SECONDS
+                if until_empty:
+                    at = next_attempt_at()
+                    if at is None:
+                        return
+                    delay = min(delay, max(0.0, (at - _now()).total_seconds()) + 0.1)
+                time.sleep(delay)
+                continue
+            _process(ydl, job)
+
+def start_worker_threads(n: int = DOWNLOAD_WORKER_THREADS,
+                         stop_event: Optional[threading.Event] = None) -> list[threading.Thread]:
+    """Запускает воркеры очереди в фоновых потоках текущего процесса. stop_event - остановка после текущей задачи."""
+    threads = []
+    for i in range(n):
+        t = threading.Thread(target=run_worker, kwargs={"stop_event": stop_event},
+                             name=f"download-worker-{i}", daemon=True)
+        t.start()
+        threads.append(t)
+    return threads
+
+if __name__ == "__main__":
+    print(f"[download_queue] Воркер {worker_id()} запущен")
+    run_worker()
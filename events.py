@@ -0,0 +1,122 @@
+"""
+Server-Sent Events для дашборда (/api/events).
+
+Один фоновый поток на процесс следит за data_version (см. db.bump_data_version) и,
+только когда данные изменились, один раз перечитывает тренды и рассылает подписчикам
+разницу с предыдущим списком. Запуски пайплайна публикуют события этапов через publish().
+Каждое подключение держит поток веб-сервера, поэтому их число на процесс ограничено
+EVENTS_MAX_CONNECTIONS.
+"""
+
+import json
+import queue
+import threading
+import time
+from typing import Any, Optional
+
+from config import EVENTS_MAX_CONNECTIONS, EVENTS_POLL_SECONDS, EVENTS_QUEUE_SIZE, EVENTS_TRENDING_LIMIT
+from db import get_data_version, get_trending
+
+class Broadcaster:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers: set[queue.Queue] = set()
+        self._watcher: Optional[threading.Thread] = None
+        self._version: Optional[int] = None
+        self._trending: list[dict] = []
+
+    def subscribe(self) -> Optional[queue.Queue]:
+        """Новая подписка или None, если процесс уже держит EVENTS_MAX_CONNECTIONS подключений."""
+        q = queue.Queue(maxsize=EVENTS_QUEUE_SIZE)
+        with self._lock:
+            if len(self._subscribers) >= EVENTS_MAX_CONNECTIONS:
+                return None
+            self._subscribers.add(q)
+            if self._watcher is None:
+                self._watcher = threading.Thread(target=self._watch, name="events-watcher", daemon=True)
+                self._watcher.start()
+        return q
+
+    def unsubscribe(self, q: queue.Queue):
+        with self._lock:
+            self._subscribers.discard(q)
+
+    def publish(self, event: str, data: Any):
+        message = format_sse(event, data)
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for q in subscribers:
+            try:
+                q.put_nowait(message)
+            except queue.Full:
+                # клиент не успевает читать - отключаем, браузер переподключится сам
+                self.unsubscribe(q)
+                _disconnect(q)
+
+    def close(self):
+        """Завершает все подписки (остановка процесса): генераторы /api/events выходят сами."""
+        with self._lock:
+            subscribers, self._subscribers = self._subscribers, set()
+        for q in subscribers:
+            _disconnect(q)
+
+    def snapshot(self) -> dict:
+        """Текущий список трендов для нового подписчика (тренды перечитываются, только если данные изменились)."""
+        self._publish_changes(self._refresh())
+        with self._lock:
+            return {"version": self._version, "items": self._trending}
+
+    def _publish_changes(self, diff: Optional[dict]):
+        if diff and (diff["added"] or diff["removed"] or diff["updated"] or diff["changed_order"]):
+            self.publish("trending", diff)
+
+    def _refresh(self) -> Optional[dict]:
+        version = get_data_version()
+        with self._lock:
+            if version == self._version:
+                return None
+            previous = self._trending
+        trending = get_trending(EVENTS_TRENDING_LIMIT)
+        with self._lock:
+            self._version, self._trending = version, trending
+        return diff_trending(previous, trending, version)
+
+    def _watch(self):
+        while True:
+            with self._lock:
+                idle = not self._subscribers
+            if not idle:
+                try:
+                    self._publish_changes(self._refresh())
+                except Exception as e:
+                    print(f"[events] Ошибка обновления трендов: {e}")
+            time.sleep(EVENTS_POLL_SECONDS)
+
+def diff_trending(previous: list[dict], current: list[dict], version: int) -> dict:
+    before = {item["video_id"]: item for item in previous}
+    after = {item["video_id"]: item for item in current}
+    order = [item["video_id"] for item in current]
+    return {
+        "version": version,
+        "added": [item for vid, item in after.items() if vid not in before],
+        "removed": [vid for vid in before if vid not in after],
+        "updated": [item for vid, item in after.items() if vid in before and before[vid] != item],
+        "order": order,
+        "changed_order": order != [item["video_id"] for item in previous],
+    }
+
+def _disconnect(q: queue.Queue):
+    """Кладёт в очередь подписчика None - генератор /api/events завершится."""
+    try:
+        q.put_nowait(None)
+    except queue.Full:
+        try:
+            q.get_nowait()
+            q.put_nowait(None)
+        except (queue.Empty, queue.Full):
+            pass
+
+def format_sse(event: str, data: Any) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+broadcaster = Broadcaster()
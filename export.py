@@ -0,0 +1,123 @@
+"""
+Потоковая выгрузка каталога и истории статистики (NDJSON или CSV, опционально gzip).
+
+Строки читаются из курсора порциями и сразу отдаются клиенту, поэтому память не
+зависит от размера выгрузки. Фильтры: since/until (дата), genre (можно несколько), region.
+"""
+
+import csv
+import io
+import json
+import zlib
+from typing import Iterator, Optional
+
+from db import get_conn
+
+FETCH_SIZE = 1000
+
+# набор данных -> (SELECT ... FROM ..., колонка даты для since/until)
+DATASETS = {
+    "videos": ("""
+        SELECT v.video_id, v.title, v.channel_title, v.published_at, v.duration_sec, v.is_short,
+               v.region, v.first_seen, v.last_seen, v.primary_genre, v.genre_confidence
+        FROM videos v
+    """, "v.last_seen"),
+    "latest_stats": ("""
+        SELECT v.video_id, v.title, v.channel_title, v.region, v.primary_genre,
+               s.snapshot_date, s.view_count, s.like_count, s.comment_count
+        FROM videos v
+        JOIN stats s ON s.id = (
+            SELECT id FROM stats
+            WHERE video_id = v.video_id
+            ORDER BY snapshot_date DESC, id DESC
+            LIMIT 1
+        )
+    """, "s.snapshot_date"),
+    "stats": ("""
+        SELECT s.video_id, s.snapshot_date, s.view_count, s.like_count, s.comment_count
+        FROM stats s
+        JOIN videos v ON v.video_id = s.video_id
+    """, "s.snapshot_date"),
+    "downloads": ("""
+        SELECT d.video_id, d.audio_path, d.downloaded_at, d.duration_sec, d.format,
+               d.blob_hash, d.size_bytes, d.last_accessed, v.title, v.primary_genre
+        FROM downloads d
+        JOIN videos v ON v.video_id = d.video_id
+    """, "d.downloaded_at"),
+}
+
+FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+
+def build_query(dataset: str, since: Optional[str] = None, until: Optional[str] = None,
+                genres: Optional[list[str]] = None, region: Optional[str] = None) -> tuple[str, list]:
+    select, date_col = DATASETS[dataset]
+    where, params = [], []
+    if since:
+        where.append(f"{date_col} >= ?")
+        params.append(since)
+    if until:
+        # until включительно: '2024-05-01' покрывает и '2024-05-01T12:00:00'
+        where.append(f"{date_col} < ?")
+        params.append(until + "\uffff")
+    if genres:
+        where.append(f"v.primary_genre IN ({','.join(['?'] * len(genres))})")
+        params.extend(genres)
+    if region:
+        where.append("v.region = ?")
+        params.append(region)
+    sql = select + (" WHERE " + " AND ".join(where) if where else "")
+    return sql, params
+
+def iter_rows(sql: str, params: list) -> Iterator[tuple[list[str], tuple]]:
+    """Отдаёт (колонки, строка) порциями по FETCH_SIZE; соединение закрывается по завершении."""
+    con = get_conn()
+    try:
+        cur = con.execute(sql, params)
+        columns = [c[0] for c in cur.description]
+        while True:
+            rows = cur.fetchmany(FETCH_SIZE)
+            if not rows:
+                break
+            for row in rows:
+                yield columns, tuple(row)
+    finally:
+        con.close()
+
+def _ndjson(rows: Iterator[tuple[list[str], tuple]]) -> Iterator[str]:
+    for columns, row in rows:
+        yield json.dumps(dict(zip(columns, row)), ensure_ascii=False) + "\n"
+
+def _csv(rows: Iterator[tuple[list[str], tuple]]) -> Iterator[str]:
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    header_written = False
+    for columns, row in rows:
+        if not header_written:
+            writer.writerow(columns)
+            header_written = True
+        writer.writerow(row)
+        if buf.tell() > 64 * 1024:
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+    if buf.tell():
+        yield buf.getvalue()
+
+def _gzip(chunks: Iterator[str]) -> Iterator[bytes]:
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # 31 - формат gzip
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode("utf-8"))
+        if data:
+            yield data
+    yield compressor.flush()
+
+def stream_export(dataset: str, fmt: str = "ndjson", gzip: bool = False, **filters) -> Iterator[bytes]:
+    sql, params = build_query(dataset, **filters)
+    rows = iter_rows(sql, params)
+    chunks = _csv(rows) if fmt == "csv" else _ndjson(rows)
+    if gzip:
+        return _gzip(chunks)
+    return (chunk.encode("utf-8") for chunk in chunks)
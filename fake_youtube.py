@@ -0,0 +1,299 @@
+"""
+Локальная замена YouTube Data API для офлайн-бенчмарков и воспроизведения замедлений.
+
+Отвечает на videos?chart=mostPopular, videos?id=... и search с пагинацией (pageToken),
+считает квоту как настоящий API (search - 100 единиц, videos - 1) и после --quota единиц
+отвечает 403 quotaExceeded, умеет добавлять задержку и случайные ошибки 503. Данные берутся из
+записанных фикстур (--fixtures) или из детерминированного генератора (--seed, --videos).
+В режиме --record запросы проксируются в настоящий API, а ответы сохраняются как фикстуры.
+
+    python fake_youtube.py --port 8765 --latency-ms 80 --error-rate 0.02
+    YOUTUBE_API_URL=http://127.0.0.1:8765/youtube/v3/videos \\
+    YOUTUBE_SEARCH_URL=http://127.0.0.1:8765/youtube/v3/search python pipeline.py --fresh
+
+    python fake_youtube.py --record fixtures/youtube    # нужен YOUTUBE_API_KEY
+    python fake_youtube.py --fixtures fixtures/youtube  # воспроизведение записанного
+
+GET /_fake/stats - запросы, ошибки и потраченная квота; POST /_fake/reset - сброс счётчиков.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+from urllib.parse import parse_qsl, urlsplit
+
+from metrics import YOUTUBE_QUOTA_COST
+
+UPSTREAM_URL = "https://www.googleapis.com/youtube/v3"
+PREFIX = "/youtube/v3/"
+ENDPOINTS = ("videos", "search")
+
+# Настоящий чарт mostPopular отдаёт не больше 200 видео
+CHART_SIZE = 200
+SEARCH_SIZE = 500
+
+_ID_ALPHABET = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-_"
+_WORDS = ["phonk", "remix", "lofi", "trap", "edm", "dance", "sound", "trend", "viral", "beat",
+          "bass", "slowed", "reverb", "tiktok", "challenge", "pop", "rap", "drill", "house", "mashup"]
+
+def _error(code: int, reason: str, message: str) -> tuple[int, dict]:
+    return code, {"error": {"code": code, "message": message,
+                            "errors": [{"reason": reason, "message": message}]}}
+
+def fixture_key(endpoint: str, params: dict) -> str:
+    """Ключ фикстуры: эндпоинт и параметры без API-ключа."""
+    canonical = json.dumps({k: v for k, v in params.items() if k != "key"}, sort_keys=True)
+    return f"{endpoint}-{hashlib.sha1(canonical.encode()).hexdigest()[:16]}"
+
+class SyntheticCatalog:
+    """Детерминированный набор видео: одинаковые seed и запрос дают одинаковый ответ."""
+
+    def __init__(self, seed: int = 0, size: int = 5000, shorts_ratio: float = 0.7):
+        self.seed = seed
+        self.shorts_ratio = shorts_ratio
+        rng = random.Random(f"{seed}:catalog")
+        self.video_ids = ["".join(rng.choice(_ID_ALPHABET) for _ in range(11)) for _ in range(size)]
+
+    def video(self, video_id: str) -> dict:
+        # неизвестные id тоже отвечают: обновление статистики работает для любых сохранённых видео
+        rng = random.Random(f"{self.seed}:{video_id}")
+        duration = rng.randint(5, 60) if rng.random() < self.shorts_ratio else rng.randint(61, 900)
+        words = rng.sample(_WORDS, 3)
+        views = int(rng.lognormvariate(11, 2))
+        published = datetime(2024, 1, 1) + timedelta(days=rng.randint(0, 600), seconds=rng.randint(0, 86399))
+        return {
+            "kind": "youtube#video",
+            "id": video_id,
+            "snippet": {
+                "publishedAt": published.strftime("%Y-%m-%dT%H:%M:%SZ"),
+                "channelId": f"UC{video_id}",
+                "title": " ".join(words).title() + f" #{words[0]} #shorts",
+                "description": f"{' '.join(words)} sound",
+                "channelTitle": f"Channel {video_id[:4]}",
+                "tags": words,
+            },
+            "contentDetails": {"duration": f"PT{duration // 60}M{duration % 60}S"},
+            "statistics": {
+                "viewCount": str(views),
+                "likeCount": str(int(views * rng.uniform(0.01, 0.08))),
+                "commentCount": str(int(views * rng.uniform(0.0005, 0.005))),
+            },
+        }
+
+    def popular(self, region: str) -> list[str]:
+        rng = random.Random(f"{self.seed}:chart:{region}")
+        return rng.sample(self.video_ids, min(CHART_SIZE, len(self.video_ids)))
+
+    def search(self, query: str, region: str) -> list[str]:
+        rng = random.Random(f"{self.seed}:search:{query.lower()}:{region}")
+        return rng.sample(self.video_ids, min(SEARCH_SIZE, len(self.video_ids)))
+
+class FakeYouTube:
+    """Состояние сервера: источник ответов, квота, задержка, ошибки и счётчики."""
+
+    def __init__(self, catalog: Optional[SyntheticCatalog] = None, fixtures_dir: Optional[str] = None,
+                 record_dir: Optional[str] = None, upstream: str = UPSTREAM_URL, quota: int = 10000,
+                 latency_ms: float = 0, jitter_ms: float = 0, error_rate: float = 0, seed: int = 0):
+        self.catalog = catalog or SyntheticCatalog(seed)
+        self.fixtures = self._load_fixtures(fixtures_dir) if fixtures_dir else None
+        self.record_dir = record_dir
+        self.upstream = upstream.rstrip("/")
+        self.quota = quota
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self._rng = random.Random(f"{seed}:errors")
+        self._lock = threading.Lock()
+        self.reset()
+
+    @staticmethod
+    def _load_fixtures(path: str) -> dict[str, tuple[int, dict]]:
+        fixtures = {}
+        for name in os.listdir(path):
+            if name.endswith(".json"):
+                with open(os.path.join(path, name), encoding="utf-8") as f:
+                    data = json.load(f)
+                fixtures[fixture_key(data["endpoint"], data["params"])] = (data["status"], data["body"])
+        print(f"[fake_youtube] Загружено фикстур: {len(fixtures)}")
+        return fixtures
+
+    def reset(self):
+        with self._lock:
+            self.requests: Counter = Counter()
+            self.errors: Counter = Counter()
+            self.quota_used = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"requests": dict(self.requests), "errors": dict(self.errors),
+                    "quota_used": self.quota_used, "quota_limit": self.quota}
+
+    def handle(self, endpoint: str, params: dict) -> tuple[int, dict]:
+        if self.record_dir:
+            # запись идёт без искусственных задержек, ошибок и лимита: квоту считает настоящий API
+            with self._lock:
+                self.requests[endpoint] += 1
+            return self._record(endpoint, params)
+        delay = self.latency_ms + (random.uniform(0, self.jitter_ms) if self.jitter_ms else 0)
+        if delay:
+            time.sleep(delay / 1000)
+        with self._lock:
+            self.requests[endpoint] += 1
+            cost = YOUTUBE_QUOTA_COST[endpoint]
+            if self.quota and self.quota_used + cost > self.quota:
+                self.errors["quotaExceeded"] += 1
+                return _error(403, "quotaExceeded", "The request cannot be completed because you have exceeded your quota.")
+            self.quota_used += cost
+            if self.error_rate and self._rng.random() < self.error_rate:
+                self.errors["backendError"] += 1
+                return _error(503, "backendError", "Injected backend error.")
+        if self.fixtures is not None:
+            found = self.fixtures.get(fixture_key(endpoint, params))
+            if found is None:
+                with self._lock:
+                    self.errors["fixtureNotFound"] += 1
+                return _error(404, "fixtureNotFound", f"Нет фикстуры для {endpoint} {params}")
+            return found
+        return self._search(params) if endpoint == "search" else self._videos(params)
+
+    def _record(self, endpoint: str, params: dict) -> tuple[int, dict]:
+        import requests
+        from config import YOUTUBE_API_KEY
+        r = requests.get(f"{self.upstream}/{endpoint}", params={"key": YOUTUBE_API_KEY, **params}, timeout=20)
+        body = r.json()
+        stored = {k: v for k, v in params.items() if k != "key"}
+        os.makedirs(self.record_dir, exist_ok=True)
+        with open(os.path.join(self.record_dir, fixture_key(endpoint, params) + ".json"), "w", encoding="utf-8") as f:
+            json.dump({"endpoint": endpoint, "params": stored, "status": r.status_code, "body": body},
+                      f, ensure_ascii=False, indent=1)
+        return r.status_code, body
+
+    @staticmethod
+    def _page(ids: list[str], params: dict) -> tuple[list[str], dict]:
+        """Срез по pageToken/maxResults и поля пагинации ответа."""
+        try:
+            size = min(max(int(params.get("maxResults", 5)), 0), 50)
+            offset = int(params.get("pageToken", "P0").lstrip("P") or 0)
+        except ValueError:
+            raise ValueError("invalid maxResults or pageToken")
+        page = ids[offset:offset + size]
+        info = {"pageInfo": {"totalResults": len(ids), "resultsPerPage": size}}
+        if offset + size < len(ids):
+            info["nextPageToken"] = f"P{offset + size}"
+        if offset:
+            info["prevPageToken"] = f"P{max(offset - size, 0)}"
+        return page, info
+
+    def _videos(self, params: dict) -> tuple[int, dict]:
+        parts = {p.strip() for p in params.get("part", "").split(",") if p.strip()}
+        if not parts:
+            return _error(400, "missingRequiredParameter", "No filter selected. Expected one of: part")
+        try:
+            if params.get("chart") == "mostPopular":
+                ids, info = self._page(self.catalog.popular(params.get("regionCode", "US")), params)
+            elif params.get("id"):
+                ids, info = params["id"].split(",")[:50], {}
+            else:
+                return _error(400, "missingRequiredParameter", "No filter selected. Expected one of: chart, id")
+        except ValueError as e:
+            return _error(400, "invalidParameter", str(e))
+        items = []
+        for vid in ids:
+            video = self.catalog.video(vid)
+            items.append({k: v for k, v in video.items() if k in ("kind", "id") or k in parts})
+        info = info or {"pageInfo": {"totalResults": len(items), "resultsPerPage": len(items)}}
+        return 200, {"kind": "youtube#videoListResponse", "items": items, **info}
+
+    def _search(self, params: dict) -> tuple[int, dict]:
+        try:
+            ids, info = self._page(self.catalog.search(params.get("q", ""), params.get("regionCode", "US")), params)
+        except ValueError as e:
+            return _error(400, "invalidParameter", str(e))
+        items = []
+        for vid in ids:
+            snippet = self.catalog.video(vid)["snippet"]
+            items.append({"kind": "youtube#searchResult", "id": {"kind": "youtube#video", "videoId": vid},
+                          "snippet": {k: snippet[k] for k in ("publishedAt", "channelId", "title",
+                                                               "description", "channelTitle")}})
+        return 200, {"kind": "youtube#searchListResponse", "regionCode": params.get("regionCode", "US"),
+                     "items": items, **info}
+
+class _Handler(BaseHTTPRequestHandler):
+    server_version = "FakeYouTube/1.0"
+
+    def _send(self, status: int, body: dict):
+        data = json.dumps(body, ensure_ascii=False).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=UTF-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        fake: FakeYouTube = self.server.fake
+        if url.path == "/_fake/stats":
+            return self._send(200, fake.stats())
+        endpoint = url.path[len(PREFIX):] if url.path.startswith(PREFIX) else None
+        if endpoint not in ENDPOINTS:
+            return self._send(*_error(404, "notFound", f"Unknown path {url.path}"))
+        self._send(*fake.handle(endpoint, dict(parse_qsl(url.query, keep_blank_values=True))))
+
+    def do_POST(self):
+        if urlsplit(self.path).path != "/_fake/reset":
+            return self._send(*_error(404, "notFound", self.path))
+        self.server.fake.reset()
+        self._send(200, {"status": "ok"})
+
+    def log_message(self, format, *args):
+        pass
+
+def start(fake: Optional[FakeYouTube] = None, host: str = "127.0.0.1", port: int = 0) -> ThreadingHTTPServer:
+    """Запускает сервер в фоновом потоке (port=0 - свободный порт). Остановка - server.shutdown()."""
+    server = ThreadingHTTPServer((host, port), _Handler)
+    server.daemon_threads = True
+    server.fake = fake or FakeYouTube()
+    threading.Thread(target=server.serve_forever, name="fake-youtube", daemon=True).start()
+    return server
+
+def base_url(server: ThreadingHTTPServer) -> str:
+    host, port = server.server_address[:2]
+    return f"http://{host}:{port}{PREFIX.rstrip('/')}"
+
+def api_env(server: ThreadingHTTPServer) -> dict:
+    """Переменные окружения, направляющие парсер на этот сервер."""
+    return {"YOUTUBE_API_URL": f"{base_url(server)}/videos", "YOUTUBE_SEARCH_URL": f"{base_url(server)}/search"}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Локальная замена YouTube Data API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--seed", type=int, default=0, help="seed генератора данных и ошибок")
+    parser.add_argument("--videos", type=int, default=5000, help="размер синтетического каталога")
+    parser.add_argument("--fixtures", default=None, help="каталог записанных ответов для воспроизведения")
+    parser.add_argument("--record", default=None, help="проксировать в настоящий API и записывать ответы сюда")
+    parser.add_argument("--upstream", default=UPSTREAM_URL)
+    parser.add_argument("--quota", type=int, default=10000, help="лимит единиц квоты (0 - без лимита)")
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--jitter-ms", type=float, default=0)
+    parser.add_argument("--error-rate", type=float, default=0, help="доля ответов 503")
+    args = parser.parse_args()
+    server = start(FakeYouTube(SyntheticCatalog(args.seed, args.videos), fixtures_dir=args.fixtures,
+                               record_dir=args.record, upstream=args.upstream, quota=args.quota,
+                               latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+                               error_rate=args.error_rate, seed=args.seed),
+                   args.host, args.port)
+    for name, value in api_env(server).items():
+        print(f"{name}={value}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -1,60 +1,95 @@
 import requests
 from tenacity import retry, wait_exponential, stop_after_attempt
 from config import YOUTUBE_API_KEY, YOUTUBE_API_URL, REGION_CODE, SHORTS_MAX_SECONDS
-from db import init_db, upsert_video, insert_stats
+from db import init_db, store_snapshots, store_stats, bump_data_version
+from metrics import track_youtube_call
 from utils import iso_duration_to_seconds, today_str
 
 @retry(wait=wait_exponential(multiplier=1, min=2, max=30), stop=stop_after_attempt(5))
 def _api_call(params):
-    r = requests.get(YOUTUBE_API_URL, params=params, timeout=20)
-    r.raise_for_status()
-    return r.json()
+    with track_youtube_call("videos"):
+        r = requests.get(YOUTUBE_API_URL, params=params, timeout=20)
+        r.raise_for_status()
+        return r.json()
 
-def fetch_and_store():
-    init_db()
-    page_token = None
-    total = 0
+def parse_stats(stats: dict) -> dict:
+    return {
+        "view_count": int(stats.get("viewCount", 0)),
+        "like_count": int(stats.get("likeCount", 0)) if "likeCount" in stats else None,
+        "comment_count": int(stats.get("commentCount", 0)) if "commentCount" in stats else None,
+    }
+
+def _parse_video(it: dict, region: str = REGION_CODE):
+    """Запись для db.store_snapshots или None, если видео не Shorts."""
+    dur_sec = iso_duration_to_seconds(it["contentDetails"]["duration"])
+    is_short = dur_sec <= SHORTS_MAX_SECONDS
+    if not is_short:
+        return None
+    meta = {
+        "video_id": it["id"],
+        "title": it["snippet"]["title"],
+        "channel_title": it["snippet"]["channelTitle"],
+        "published_at": it["snippet"]["publishedAt"],
+        "duration_sec": dur_sec,
+        "is_short": True,
+        "region": region,
+    }
+    return {"meta": meta, "stats": parse_stats(it.get("statistics", {}))}
+
+def iter_popular_batches(region: str = REGION_CODE, resume: dict = None):
+    """
+    Страницы популярных видео региона без записи в базу: отдаёт (записи Shorts для
+    db.store_snapshots, контрольная точка). С resume продолжает со страницы из контрольной точки.
+    """
+    if resume and not resume.get("page_token"):
+        return  # все страницы уже сохранены
+    page_token = (resume or {}).get("page_token")
+    pages = (resume or {}).get("pages", 0)
     while True:
         params = {
             "part": "snippet,contentDetails,statistics",
             "chart": "mostPopular",
-            "regionCode": REGION_CODE,
+            "regionCode": region,
             "maxResults": 50,
             "pageToken": page_token,
             "key": YOUTUBE_API_KEY,
         }
         data = _api_call(params)
-        items = data.get("items", [])
-        for it in items:
-            vid = it["id"]
-            dur_sec = iso_duration_to_seconds(it["contentDetails"]["duration"])
-            is_short = dur_sec <= SHORTS_MAX_SECONDS
-            if not is_short:
-                continue
-            meta = {
-                "video_id": vid,
-                "title": it["snippet"]["title"],
-                "channel_title": it["snippet"]["channelTitle"],
-                "published_at": it["snippet"]["publishedAt"],
-                "duration_sec": dur_sec,
-                "is_short": True,
-                "region": REGION_CODE,
-            }
-            upsert_video(meta)
-            stats = it.get("statistics", {})
-            insert_stats(
-                video_id=vid,
-                snapshot_date=today_str(),
-                view_count=int(stats.get("viewCount", 0)),
-                like_count=int(stats.get("likeCount", 0)) if "likeCount" in stats else None,
-                comment_count=int(stats.get("commentCount", 0)) if "commentCount" in stats else None,
-            )
-            total += 1
-
         page_token = data.get("nextPageToken")
+        pages += 1
+        yield ([r for r in (_parse_video(it, region) for it in data.get("items", [])) if r],
+               {"page_token": page_token, "pages": pages})
         if not page_token:
             break
+
+def iter_stats_batches(video_ids: list[str]):
+    """Свежая статистика уже известных видео, по 50 id на запрос (1 единица квоты)."""
+    for i in range(0, len(video_ids), 50):
+        data = _api_call({
+            "part": "statistics",
+            "id": ",".join(video_ids[i:i + 50]),
+            "key": YOUTUBE_API_KEY,
+        })
+        yield [{"meta": {"video_id": it["id"]}, "stats": parse_stats(it.get("statistics", {}))}
+               for it in data.get("items", [])]
+
+def refresh_stats(video_ids: list[str]) -> int:
+    """Записывает новый снимок статистики для video_ids (videos не трогает)."""
+    total = 0
+    for batch in iter_stats_batches(video_ids):
+        total += store_stats(batch, today_str())
+        bump_data_version()
+    print(f"[fetch_shorts] Refreshed stats for {total} videos.")
+    return total
+
+def fetch_and_store():
+    init_db()
+    total = 0
+    for batch, _ in iter_popular_batches():
+        total += store_snapshots(batch, today_str())
+        bump_data_version()
     print(f"[fetch_shorts] Stored {total} US Shorts snapshots.")
+    return total
 
 if __name__ == "__main__":
     fetch_and_store()
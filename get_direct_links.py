@@ -37,8 +37,10 @@ def get_direct_links(query, max_results=5):
             print("❌ Треки не найдены")
             return
         
-        # Выводим найденные треки с прямыми ссылками
-        for i, track in enumerate(result['links'], 1):
+        # Получаем прямые ссылки одним пакетным запросом и выводим треки по мере готовности
+        tracks = {track['video_id']: track for track in result['links']}
+        for i, resolved in enumerate(resolve_direct_links(list(tracks)), 1):
+            track = tracks[resolved['video_id']]
             print(f"{i:2d}. {track['title']}")
             print(f"    Канал: {track['channel_title']}")
             print(f"    Длительность: {track['duration_sec']} сек")
@@ -47,7 +49,11 @@ def get_direct_links(query, max_results=5):
                 print(f"    Жанр: {track['primary_genre']} (уверенность: {track['genre_confidence']:.2f})")
             
             print(f"    🎥 YouTube: {track['youtube_url']}")
-            print(f"    🔗 Прямая ссылка: {track['direct_download_url']}")
+            if resolved.get('status') == 'success':
+                track['direct_download_url'] = resolved['direct_download_url']
+                print(f"    🔗 Прямая ссылка: {track['direct_download_url']}")
+            else:
+                print(f"    ❌ Ошибка: {resolved.get('message')}")
             print()
         
         # Сохраняем ссылки в файл
@@ -56,6 +62,15 @@ def get_direct_links(query, max_results=5):
     except Exception as e:
         print(f"❌ Ошибка: {e}")
 
+def resolve_direct_links(video_ids):
+    """Пакетное получение прямых ссылок: сервер извлекает их параллельно и присылает по мере готовности"""
+    response = requests.post(f"{BASE_URL}/api/direct_links", json={"video_ids": video_ids},
+                             stream=True, timeout=120)
+    response.raise_for_status()
+    for line in response.iter_lines():
+        if line:
+            yield json.loads(line)
+
 def get_single_direct_link(video_id):
     """Получение прямой ссылки на конкретный трек"""
     url = f"{BASE_URL}/api/direct_download/{video_id}"
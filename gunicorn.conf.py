@@ -0,0 +1,84 @@
+"""
+Настройки gunicorn для production (см. README, раздел «Production-сервер»):
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+Обработчики в основном ждут ввода-вывода (SQLite, YouTube API, yt-dlp, отдача файлов), поэтому
+воркеры gthread: несколько процессов, в каждом WEB_THREADS потоков. Число процессов - из
+WEB_CONCURRENCY или по CPU (2 * CPU + 1) с ограничением по памяти контейнера.
+"""
+
+import os
+import signal
+from typing import Optional
+
+from config import (WEB_CONCURRENCY, WEB_GRACEFUL_TIMEOUT, WEB_MAX_WORKERS, WEB_THREADS, WEB_TIMEOUT,
+                    WEB_WORKER_MEMORY_MB)
+
+# Доля памяти контейнера, которую можно отдать воркерам (остальное - master, SQLite, ffmpeg)
+MEMORY_SHARE = 0.75
+
+def _cpu_count() -> int:
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+def _memory_limit_mb() -> Optional[int]:
+    """Лимит памяти контейнера (cgroup v2, затем v1) или объём RAM."""
+    for path in ("/sys/fs/cgroup/memory.max", "/sys/fs/cgroup/memory/memory.limit_in_bytes"):
+        try:
+            with open(path) as f:
+                value = f.read().strip()
+        except OSError:
+            continue
+        if value.isdigit() and int(value) < 1 << 60:  # "max" или огромное число - лимита нет
+            return int(value) // (1024 * 1024)
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemTotal:"):
+                    return int(line.split()[1]) // 1024
+    except OSError:
+        pass
+    return None
+
+def autotune_workers() -> int:
+    if WEB_CONCURRENCY > 0:
+        return WEB_CONCURRENCY
+    count = 2 * _cpu_count() + 1
+    memory = _memory_limit_mb()
+    if memory:
+        count = min(count, int(memory * MEMORY_SHARE) // WEB_WORKER_MEMORY_MB)
+    return max(1, min(count, WEB_MAX_WORKERS))
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5002')}"
+workers = autotune_workers()
+worker_class = "gthread"
+threads = WEB_THREADS
+preload_app = True
+timeout = WEB_TIMEOUT
+graceful_timeout = WEB_GRACEFUL_TIMEOUT
+keepalive = 5
+
+def when_ready(server):
+    # master, после загрузки приложения и до форка воркеров
+    import wsgi
+    wsgi.warm_up()
+    server.log.info("Воркеров: %s, потоков в воркере: %s", workers, threads)
+
+def post_worker_init(worker):
+    import wsgi
+    wsgi.start_background()
+    handle_exit = signal.getsignal(signal.SIGTERM)
+
+    def on_term(signum, frame):
+        # SSE-потоки бесконечны: без закрытия остановка ждала бы graceful_timeout
+        wsgi.stop_background()
+        handle_exit(signum, frame)
+
+    signal.signal(signal.SIGTERM, on_term)
+
+def worker_exit(server, worker):
+    import wsgi
+    wsgi.stop_background()
+    wsgi.join_background(graceful_timeout)
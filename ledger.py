@@ -0,0 +1,174 @@
+"""
+Журнал запусков пайплайна: pipeline_runs и pipeline_stage_spans.
+
+Для каждого этапа пишется время начала и конца, количество элементов, вызовы YouTube API,
+потраченная квота, число записанных строк и ошибка. Отчёт сравнивает последний запуск с
+медианой предыдущих, чтобы регрессия была видна в данных в день выката.
+
+Контрольные точки (pipeline_checkpoints) пишутся в одной транзакции с пачкой данных, поэтому
+перезапущенный запуск продолжает этап ровно с того места, которое уже сохранено в базе.
+
+Отчёт из командной строки:
+    python ledger.py            # последние 10 запусков
+    python ledger.py --limit 30
+"""
+
+import argparse
+import json
+import statistics
+from datetime import datetime, timedelta
+from typing import Optional
+
+from db import get_conn
+from metrics import SPAN_COUNTERS as SPAN_FIELDS
+
+def start_run(run_id: str, trigger: str):
+    with get_conn() as con:
+        con.execute("""
+            INSERT OR REPLACE INTO pipeline_runs(run_id, trigger, status, started_at)
+            VALUES(?, ?, 'running', ?)""", (run_id, trigger, datetime.utcnow().isoformat()))
+
+def finish_run(run_id: str, status: str, duration_sec: float,
+               result_count: Optional[int] = None, error: Optional[str] = None):
+    with get_conn() as con:
+        con.execute("""
+            UPDATE pipeline_runs
+            SET status = ?, finished_at = ?, duration_sec = ?, result_count = ?, error = ?
+            WHERE run_id = ?""",
+            (status, datetime.utcnow().isoformat(), duration_sec, result_count, error, run_id))
+
+def record_span(run_id: str, span: dict):
+    """Сохраняет завершённый этап (словарь из PipelineTracker.stages)."""
+    with get_conn() as con:
+        con.execute("""
+            INSERT OR REPLACE INTO pipeline_stage_spans(run_id, stage, status, started_at, finished_at,
+                duration_sec, item_count, api_calls, api_errors, quota_units, rows_written, error)
+            VALUES(?,?,?,?,?,?,?,?,?,?,?,?)""",
+            (run_id, span["name"], span["status"], span["started_at"], span["finished_at"],
+             span["duration_sec"], span["count"], *(span.get(f) or 0 for f in SPAN_FIELDS), span["error"]))
+
+def write_checkpoint(con, run_id: str, stage: str, position: dict, items: int):
+    """Сохраняет контрольную точку в транзакции вызывающего (вместе с данными пачки)."""
+    con.execute("""
+        INSERT OR REPLACE INTO pipeline_checkpoints(run_id, stage, position, items, updated_at)
+        VALUES(?,?,?,?,?)""", (run_id, stage, json.dumps(position), items, datetime.utcnow().isoformat()))
+
+def get_checkpoints(run_id: str) -> dict[str, dict]:
+    """stage -> {"position": ..., "items": ...}"""
+    with get_conn() as con:
+        rows = con.execute("SELECT stage, position, items FROM pipeline_checkpoints WHERE run_id = ?",
+                           (run_id,)).fetchall()
+    return {r["stage"]: {"position": json.loads(r["position"]), "items": r["items"]} for r in rows}
+
+def find_resumable(max_age_hours: float) -> Optional[str]:
+    """Последний незавершённый (упавший или прерванный) запуск не старше max_age_hours."""
+    since = (datetime.utcnow() - timedelta(hours=max_age_hours)).isoformat()
+    with get_conn() as con:
+        row = con.execute("""
+            SELECT run_id, status FROM pipeline_runs
+            WHERE started_at >= ?
+            ORDER BY started_at DESC
+            LIMIT 1""", (since,)).fetchone()
+    return row["run_id"] if row and row["status"] in ("failed", "running") else None
+
+def find_partial(max_age_hours: float, exclude: Optional[str] = None) -> Optional[str]:
+    """Последний закончившийся запуск не старше max_age_hours (кроме exclude), если он выполнен частично."""
+    since = (datetime.utcnow() - timedelta(hours=max_age_hours)).isoformat()
+    with get_conn() as con:
+        row = con.execute("""
+            SELECT run_id, status FROM pipeline_runs
+            WHERE started_at >= ? AND status != 'running' AND run_id != ?
+            ORDER BY started_at DESC
+            LIMIT 1""", (since, exclude or "")).fetchone()
+    return row["run_id"] if row and row["status"] == "partial" else None
+
+def resume_run(run_id: str):
+    with get_conn() as con:
+        con.execute("""
+            UPDATE pipeline_runs SET status = 'running', finished_at = NULL, error = NULL
+            WHERE run_id = ?""", (run_id,))
+
+def _spans_by_run(con, run_ids: list[str]) -> dict[str, list[dict]]:
+    if not run_ids:
+        return {}
+    rows = con.execute(f"""
+        SELECT * FROM pipeline_stage_spans
+        WHERE run_id IN ({','.join(['?'] * len(run_ids))})
+        ORDER BY started_at""", run_ids).fetchall()
+    spans: dict[str, list[dict]] = {}
+    for r in rows:
+        spans.setdefault(r["run_id"], []).append(dict(r))
+    return spans
+
+def get_run(run_id: str) -> Optional[dict]:
+    with get_conn() as con:
+        row = con.execute("SELECT * FROM pipeline_runs WHERE run_id = ?", (run_id,)).fetchone()
+        if not row:
+            return None
+        return dict(row) | {"stages": _spans_by_run(con, [run_id]).get(run_id, [])}
+
+def recent_runs(limit: int = 10) -> list[dict]:
+    """Последние запуски (новые первыми) с этапами."""
+    with get_conn() as con:
+        runs = [dict(r) for r in con.execute(
+            "SELECT * FROM pipeline_runs ORDER BY started_at DESC LIMIT ?", (limit,)).fetchall()]
+        spans = _spans_by_run(con, [r["run_id"] for r in runs])
+    for run in runs:
+        run["stages"] = spans.get(run["run_id"], [])
+    return runs
+
+def compare_runs(runs: list[dict]) -> list[dict]:
+    """
+    Сравнивает этапы последнего завершённого запуска с медианой предыдущих успешных.
+    change_pct > 0 - этап стал медленнее.
+    """
+    finished = [r for r in runs if r["status"] != "running"]
+    if not finished:
+        return []
+    latest, previous = finished[0], [r for r in finished[1:] if r["status"] == "done"]
+    report = []
+    for span in latest["stages"]:
+        history = [s for r in previous for s in r["stages"]
+                   if s["stage"] == span["stage"] and s["status"] == "done"]
+        entry = {
+            "stage": span["stage"],
+            "status": span["status"],
+            "duration_sec": span["duration_sec"],
+            "item_count": span["item_count"],
+            **{f: span[f] for f in SPAN_FIELDS},
+            "baseline_runs": len(history),
+            "baseline_duration_sec": None,
+            "change_pct": None,
+        }
+        if history:
+            baseline = statistics.median(s["duration_sec"] for s in history)
+            entry["baseline_duration_sec"] = round(baseline, 3)
+            if baseline > 0 and span["duration_sec"] is not None:
+                entry["change_pct"] = round((span["duration_sec"] / baseline - 1) * 100, 1)
+        report.append(entry)
+    return report
+
+def report(limit: int = 10) -> dict:
+    runs = recent_runs(limit)
+    return {"runs": runs, "latest_vs_baseline": compare_runs(runs)}
+
+def _print_report(limit: int):
+    data = report(limit)
+    print(f"{'run_id':<14}{'trigger':<10}{'status':<9}{'started_at':<21}{'sec':>9}{'api':>6}{'quota':>7}{'rows':>7}")
+    for run in data["runs"]:
+        totals = {f: sum(s[f] or 0 for s in run["stages"]) for f in SPAN_FIELDS}
+        print(f"{run['run_id']:<14}{run['trigger'] or '':<10}{run['status']:<9}{run['started_at'][:19]:<21}"
+              f"{run['duration_sec'] or 0:>9.2f}{totals['api_calls']:>6}{totals['quota_units']:>7}{totals['rows_written']:>7}")
+    if data["latest_vs_baseline"]:
+        print("\nПоследний запуск против медианы предыдущих:")
+        print(f"{'stage':<16}{'sec':>9}{'median':>9}{'change':>9}{'items':>7}{'api':>6}{'errors':>8}{'rows':>7}")
+        for s in data["latest_vs_baseline"]:
+            median = f"{s['baseline_duration_sec']:.2f}" if s["baseline_duration_sec"] is not None else "-"
+            change = f"{s['change_pct']:+.1f}%" if s["change_pct"] is not None else "-"
+            print(f"{s['stage']:<16}{s['duration_sec'] or 0:>9.2f}{median:>9}{change:>9}{s['item_count'] or 0:>7}"
+                  f"{s['api_calls']:>6}{s['api_errors']:>8}{s['rows_written']:>7}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Отчёт по запускам пайплайна")
+    parser.add_argument("--limit", type=int, default=10, help="сколько последних запусков показать")
+    _print_report(parser.parse_args().limit)
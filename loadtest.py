@@ -0,0 +1,322 @@
+"""
+Нагрузочный тест HTTP API: смесь реалистичных запросов против локального экземпляра.
+
+По умолчанию поднимает отдельный процесс приложения (python app.py или --server-cmd) на
+копии синтетической базы из benchmark.py и с локальной заменой YouTube API (fake_youtube.py).
+В копии базы у части треков есть настоящие файлы на диске и свежие прямые ссылки в
+resolved_urls, поэтому скачивания и прямые ссылки работают без сети (yt-dlp не вызывается).
+С --url нагружается уже запущенный экземпляр, цели берутся из его API.
+
+Режимы: замкнутый (--concurrency N клиентов шлют запросы друг за другом) и открытый
+(--rate R запросов в секунду, пуассоновский поток). В открытом режиме задержка считается от
+запланированного момента отправки, поэтому очередь перед сервером тоже попадает в задержку.
+
+Отчёт по маршрутам: пропускная способность, перцентили задержки, доля ошибок; --out - JSON.
+
+    python loadtest.py --concurrency 16 --duration 60
+    python loadtest.py --rate 200 --duration 60 --mix trending=50,download=50
+    python loadtest.py --server-cmd "gunicorn -c gunicorn.conf.py wsgi:app" --concurrency 64
+    python loadtest.py --url http://127.0.0.1:5002 --concurrency 8
+"""
+
+import argparse
+import json
+import math
+import os
+import random
+import shlex
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Optional
+
+import requests
+
+from config import BENCH_DIR
+
+# маршрут -> вес в смеси по умолчанию
+DEFAULT_MIX = {
+    "trending": 30,
+    "genre": 15,
+    "search": 20,
+    "search_upstream": 5,
+    "direct_link": 15,
+    "download": 15,
+}
+
+WORKDIR = os.path.join(BENCH_DIR, "loadtest")
+PERCENTILES = (50, 90, 95, 99)
+ERROR_EXAMPLES = 3
+
+def _url(route: str, targets: dict, rng: random.Random) -> str:
+    if route == "trending":
+        return "/api/trending"
+    if route == "genre":
+        return f"/api/videos_by_genre?genres={rng.choice(targets['genres'])}&min_confidence=0.9"
+    if route == "search":
+        return f"/api/search_direct_links?query={rng.choice(targets['queries'])}&max_results=5"
+    if route == "search_upstream":
+        # новый запрос: ответ идёт через YouTube API и пишет в базу
+        return f"/api/search_direct_links?query={rng.choice(targets['queries'])}%20{rng.getrandbits(32):x}&max_results=5"
+    if route == "direct_link":
+        return f"/api/direct_download/{rng.choice(targets['resolved_ids'])}"
+    if route == "download":
+        # файлы в копии базы - случайные байты, не аудио: перекодирование в mp3 не проверяем
+        return f"/download/{rng.choice(targets['file_ids'])}?format=native"
+    raise ValueError(f"неизвестный маршрут {route}")
+
+def parse_mix(value: Optional[str]) -> dict[str, float]:
+    if not value:
+        return dict(DEFAULT_MIX)
+    mix = {}
+    for part in value.split(","):
+        route, _, weight = part.partition("=")
+        route = route.strip()
+        if route not in DEFAULT_MIX:
+            raise ValueError(f"неизвестный маршрут {route} (есть: {', '.join(DEFAULT_MIX)})")
+        mix[route] = float(weight or 1)
+    return mix
+
+class Recorder:
+    """Задержки и ошибки по маршрутам; потокобезопасно."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies: dict[str, list[float]] = defaultdict(list)
+        self.errors: Counter = Counter()
+        self.statuses: dict[str, Counter] = defaultdict(Counter)
+        self.examples: dict[str, list[str]] = defaultdict(list)
+
+    def add(self, route: str, latency_ms: float, status: str, error: Optional[str] = None):
+        with self._lock:
+            self.latencies[route].append(latency_ms)
+            self.statuses[route][status] += 1
+            if error is not None:
+                self.errors[route] += 1
+                if len(self.examples[route]) < ERROR_EXAMPLES:
+                    self.examples[route].append(error)
+
+    def report(self, elapsed: float) -> dict:
+        with self._lock:
+            routes = {route: _summary(lat, self.errors[route], elapsed) | {
+                          "statuses": dict(self.statuses[route]), "error_examples": self.examples[route]}
+                      for route, lat in sorted(self.latencies.items())}
+            everything = [x for lat in self.latencies.values() for x in lat]
+            total = _summary(everything, sum(self.errors.values()), elapsed)
+        return {"elapsed_sec": round(elapsed, 3), "total": total, "routes": routes}
+
+def _summary(latencies: list[float], errors: int, elapsed: float) -> dict:
+    ordered = sorted(latencies)
+    n = len(ordered)
+    summary = {"requests": n, "errors": errors, "error_rate": round(errors / n, 4) if n else 0.0,
+               "rps": round(n / elapsed, 2) if elapsed else 0.0}
+    for p in PERCENTILES:
+        summary[f"p{p}_ms"] = round(ordered[max(0, math.ceil(p / 100 * n) - 1)], 2) if n else None
+    summary["max_ms"] = round(ordered[-1], 2) if n else None
+    return summary
+
+_local = threading.local()
+
+def _session() -> requests.Session:
+    if not hasattr(_local, "session"):
+        _local.session = requests.Session()
+    return _local.session
+
+def _fire(base: str, route: str, path: str, recorder: Recorder, scheduled: float, timeout: float):
+    """Один запрос; задержка - от scheduled (time.perf_counter)."""
+    try:
+        r = _session().get(base + path, timeout=timeout)
+        r.content  # тело читается целиком, как у настоящего клиента
+        latency = (time.perf_counter() - scheduled) * 1000
+        error = None if r.status_code < 400 else f"HTTP {r.status_code} {path}"
+        recorder.add(route, latency, str(r.status_code), error)
+    except requests.RequestException as e:
+        recorder.add(route, (time.perf_counter() - scheduled) * 1000, type(e).__name__, f"{type(e).__name__}: {e}")
+
+def run_closed(base: str, targets: dict, mix: dict, concurrency: int, duration: float,
+               warmup: float = 0, timeout: float = 30, seed: int = 0) -> dict:
+    """concurrency клиентов, каждый шлёт следующий запрос после ответа на предыдущий."""
+    recorder, warm = Recorder(), Recorder()
+    start = time.perf_counter()
+    measure_from, deadline = start + warmup, start + warmup + duration
+    routes, weights = list(mix), list(mix.values())
+
+    def client(i: int):
+        rng = random.Random(f"{seed}:{i}")
+        while (now := time.perf_counter()) < deadline:
+            route = rng.choices(routes, weights)[0]
+            _fire(base, route, _url(route, targets, rng), recorder if now >= measure_from else warm, now, timeout)
+
+    threads = [threading.Thread(target=client, args=(i,), name=f"loadtest-{i}", daemon=True) for i in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return recorder.report(time.perf_counter() - measure_from) | {"mode": "closed", "concurrency": concurrency}
+
+def run_open(base: str, targets: dict, mix: dict, rate: float, duration: float, warmup: float = 0,
+             timeout: float = 30, seed: int = 0, max_inflight: int = 512) -> dict:
+    """Пуассоновский поток rate запросов в секунду независимо от того, успевает ли сервер."""
+    recorder, warm = Recorder(), Recorder()
+    rng = random.Random(f"{seed}:open")
+    routes, weights = list(mix), list(mix.values())
+    start = time.perf_counter()
+    measure_from, deadline = start + warmup, start + warmup + duration
+    with ThreadPoolExecutor(max_workers=max_inflight, thread_name_prefix="loadtest") as pool:
+        scheduled = start
+        while scheduled < deadline:
+            scheduled += rng.expovariate(rate)
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            route = rng.choices(routes, weights)[0]
+            pool.submit(_fire, base, route, _url(route, targets, rng),
+                        recorder if scheduled >= measure_from else warm, scheduled, timeout)
+    return recorder.report(time.perf_counter() - measure_from) | {"mode": "open", "rate": rate}
+
+def prepare_db(videos: int, files: int, file_kb: int, seed: int = 0) -> tuple[str, dict]:
+    """
+    Копия синтетической базы для нагрузки: у files треков есть файлы на диске и свежие прямые
+    ссылки. Возвращает (путь к базе, цели запросов).
+    """
+    import benchmark
+    benchmark.open_db(videos, 30, 90, seed)
+    src = benchmark.db_path(videos, 30, 90, seed)
+    os.makedirs(os.path.join(WORKDIR, "media"), exist_ok=True)
+    path = os.path.join(WORKDIR, f"loadtest-{videos}.db")
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    with sqlite3.connect(src) as source, sqlite3.connect(path) as target:
+        source.backup(target)
+
+    payload = os.urandom(file_kb * 1024)
+    expires = int(time.time()) + 7 * 24 * 3600
+    con = sqlite3.connect(path)
+    file_ids = [r[0] for r in con.execute("SELECT video_id FROM downloads ORDER BY video_id LIMIT ?", (files,))]
+    for vid in file_ids:
+        audio_path = os.path.join(WORKDIR, "media", f"{vid}.opus")
+        if not os.path.exists(audio_path) or os.path.getsize(audio_path) != len(payload):
+            with open(audio_path, "wb") as f:
+                f.write(payload)
+        con.execute("UPDATE downloads SET audio_path = ?, size_bytes = ? WHERE video_id = ?",
+                    (audio_path, len(payload), vid))
+    resolved_ids = [r[0] for r in con.execute(
+        "SELECT video_id FROM videos WHERE is_short = 1 ORDER BY last_seen DESC LIMIT ?", (files,))]
+    con.executemany("INSERT OR REPLACE INTO resolved_urls(video_id, url, format, expires_at, resolved_at) "
+                    "VALUES(?,?,?,?,?)",
+                    [(vid, f"https://example.invalid/audio/{vid}.webm?expire={expires}", "webm", expires,
+                      datetime.utcnow().isoformat()) for vid in resolved_ids])
+    con.execute("UPDATE search_freshness SET refreshed_at = ?", (datetime.utcnow().isoformat(),))
+    con.commit()
+    con.close()
+    return path, {"genres": benchmark.GENRES, "queries": benchmark.QUERIES,
+                  "file_ids": file_ids, "resolved_ids": resolved_ids}
+
+def discover_targets(base: str) -> dict:
+    """Цели для уже запущенного экземпляра. Прямые ссылки могут запускать yt-dlp."""
+    genres = list(requests.get(f"{base}/api/genres", timeout=30).json())
+    trending = [v["video_id"] for v in requests.get(f"{base}/api/trending", timeout=30).json()]
+    files = [f["video_id"] for f in requests.get(f"{base}/api/files", timeout=30).json()]
+    queries = requests.get(f"{base}/api/search_queries", timeout=30).json()
+    return {"genres": genres or ["pop"], "queries": queries, "file_ids": files or trending,
+            "resolved_ids": trending}
+
+def start_server(cmd: str, port: int, db_file: str, api_env: dict) -> subprocess.Popen:
+    env = os.environ | api_env | {
+        "DB_PATH": db_file,
+        "MEDIA_DIR": os.path.join(WORKDIR, "media"),
+        "PORT": str(port),
+        "DOWNLOAD_WORKER_THREADS": "0",
+    }
+    log = open(os.path.join(WORKDIR, "server.log"), "ab")
+    proc = subprocess.Popen(shlex.split(cmd), env=env, stdout=log, stderr=subprocess.STDOUT,
+                            cwd=os.path.dirname(os.path.abspath(__file__)))
+    base = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"Сервер завершился с кодом {proc.returncode}, см. {WORKDIR}/server.log")
+        try:
+            if requests.get(f"{base}/api/search_queries", timeout=2).status_code == 200:
+                return proc
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    proc.terminate()
+    raise RuntimeError("Сервер не ответил за 60 с")
+
+def _print_report(report: dict):
+    header = f"{'route':<17}{'requests':>9}{'rps':>9}{'errors':>8}" + "".join(f"{f'p{p}':>9}" for p in PERCENTILES) + f"{'max':>9}"
+    print("\n" + header)
+    for route, s in list(report["routes"].items()) + [("TOTAL", report["total"])]:
+        cells = "".join(f"{s[f'p{p}_ms'] or 0:>9.1f}" for p in PERCENTILES)
+        print(f"{route:<17}{s['requests']:>9}{s['rps']:>9.1f}{s['error_rate']:>8.1%}{cells}{s['max_ms'] or 0:>9.1f}")
+    for route, s in report["routes"].items():
+        for example in s["error_examples"]:
+            print(f"[loadtest] {route}: {example}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Нагрузочный тест HTTP API")
+    parser.add_argument("--url", default=None, help="нагружать уже запущенный экземпляр")
+    parser.add_argument("--server-cmd", default=f"{sys.executable} app.py", help="команда запуска приложения")
+    parser.add_argument("--port", type=int, default=5055)
+    parser.add_argument("--scale", default="10k", help="размер синтетической базы (см. benchmark.py)")
+    parser.add_argument("--files", type=int, default=200, help="сколько треков получают файлы и прямые ссылки")
+    parser.add_argument("--file-kb", type=int, default=256, help="размер файла трека, КБ")
+    parser.add_argument("--mix", default=None, help="веса маршрутов: trending=30,genre=15,...")
+    parser.add_argument("--concurrency", type=int, default=None, help="замкнутый режим: число клиентов")
+    parser.add_argument("--rate", type=float, default=None, help="открытый режим: запросов в секунду")
+    parser.add_argument("--max-inflight", type=int, default=512, help="открытый режим: предел одновременных запросов")
+    parser.add_argument("--duration", type=float, default=30, help="длительность измерения, с")
+    parser.add_argument("--warmup", type=float, default=5, help="прогрев без учёта, с")
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--latency-ms", type=float, default=150, help="задержка локального YouTube API")
+    parser.add_argument("--out", default=None, help="записать отчёт в JSON")
+    args = parser.parse_args()
+    if args.rate is None and args.concurrency is None:
+        args.concurrency = 8
+
+    mix = parse_mix(args.mix)
+    proc = fake = None
+    try:
+        if args.url:
+            base = args.url.rstrip("/")
+            targets = discover_targets(base)
+        else:
+            import benchmark
+            import fake_youtube
+            if args.scale not in benchmark.SCALES:
+                parser.error(f"неизвестный размер: {args.scale}")
+            db_file, targets = prepare_db(benchmark.SCALES[args.scale], args.files, args.file_kb, args.seed)
+            fake = fake_youtube.start(fake_youtube.FakeYouTube(quota=0, latency_ms=args.latency_ms, seed=args.seed))
+            proc = start_server(args.server_cmd, args.port, db_file, fake_youtube.api_env(fake))
+            base = f"http://127.0.0.1:{args.port}"
+        print(f"[loadtest] {base}: {json.dumps(mix)}")
+        if args.rate is not None:
+            report = run_open(base, targets, mix, args.rate, args.duration, args.warmup, args.timeout,
+                              args.seed, args.max_inflight)
+        else:
+            report = run_closed(base, targets, mix, args.concurrency, args.duration, args.warmup,
+                                args.timeout, args.seed)
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait(timeout=30)
+        if fake is not None:
+            fake.shutdown()
+
+    report |= {"created_at": datetime.utcnow().isoformat(), "base_url": base, "mix": mix,
+               "server_cmd": None if args.url else args.server_cmd, "scale": None if args.url else args.scale}
+    _print_report(report)
+    if args.out:
+        os.makedirs(os.path.dirname(args.out) or ".", exist_ok=True)
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"[loadtest] Отчёт: {args.out}")
@@ -0,0 +1,60 @@
+"""
+Ночное обслуживание базы: дозаполнение жанров и уплотнение данных.
+
+    python maintenance.py
+"""
+
+import time
+from datetime import datetime, timedelta
+
+from config import STATS_COMPACT_AFTER_DAYS
+from db import bump_data_version, get_conn, init_db
+from genre_analyzer import analyze_genre, get_genre_confidence, get_primary_genre
+
+def backfill_genres() -> int:
+    """Определяет жанр по названию для видео без жанра (например, пришедших из чарта)."""
+    with get_conn() as con:
+        rows = con.execute("SELECT video_id, title FROM videos WHERE primary_genre IS NULL").fetchall()
+        updates = []
+        for r in rows:
+            scores = analyze_genre(r["title"] or "")
+            genre = get_primary_genre(scores)
+            if genre:
+                updates.append((genre, get_genre_confidence(scores), r["video_id"]))
+        con.executemany("UPDATE videos SET primary_genre = ?, genre_confidence = ? WHERE video_id = ?", updates)
+        con.commit()
+    if updates:
+        bump_data_version()
+    print(f"[maintenance] Жанр определён для {len(updates)} из {len(rows)} видео")
+    return len(updates)
+
+def compact() -> dict:
+    """
+    Оставляет один (последний) снимок статистики за день для дней старше STATS_COMPACT_AFTER_DAYS,
+    удаляет просроченные прямые ссылки и обновляет статистику планировщика запросов SQLite.
+    """
+    cutoff = (datetime.utcnow() - timedelta(days=STATS_COMPACT_AFTER_DAYS)).strftime("%Y-%m-%d")
+    with get_conn() as con:
+        stats_deleted = con.execute("""
+            DELETE FROM stats
+            WHERE snapshot_date < ?
+              AND id NOT IN (
+                  SELECT MAX(id) FROM stats
+                  WHERE snapshot_date < ?
+                  GROUP BY video_id, snapshot_date
+              )""", (cutoff, cutoff)).rowcount
+        urls_deleted = con.execute("DELETE FROM resolved_urls WHERE expires_at < ?", (int(time.time()),)).rowcount
+        con.commit()
+        con.execute("PRAGMA optimize")
+        con.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    result = {"stats_deleted": stats_deleted, "resolved_urls_deleted": urls_deleted}
+    print(f"[maintenance] Уплотнение: {result}")
+    return result
+
+def nightly() -> int:
+    backfill_genres()
+    return compact()["stats_deleted"]
+
+if __name__ == "__main__":
+    init_db()
+    nightly()
@@ -0,0 +1,202 @@
+"""
+Бюджет диска для скачанного аудио.
+
+Каждое обращение к /download/<video_id> обновляет downloads.last_accessed.
+Когда суммарный размер файлов превышает MEDIA_CACHE_MAX_BYTES, вытесняются файлы
+с самым старым обращением (lru) или с наименьшим TrendScore (trend). Строки downloads
+удаляются в той же транзакции, вытесненный трек скачивается заново при следующем запросе.
+mp3 из TRANSCODE_CACHE_DIR входят в тот же бюджет отдельными единицами: время обращения -
+mtime файла (ensure_mp3 обновляет его при каждой отдаче), вытесненный mp3 перекодируется заново.
+
+Ручной запуск: python media_cache.py
+"""
+
+import os
+from datetime import datetime, timedelta
+from typing import Optional
+
+from config import MEDIA_CACHE_MAX_BYTES, MEDIA_EVICTION_GRACE_SECONDS, MEDIA_EVICTION_POLICY, TRANSCODE_CACHE_DIR
+from db import get_conn
+from media_store import release
+
+# Единица вытеснения - файл: blob (общий для нескольких видео) или файл старой раскладки
+_UNITS_SQL = """
+    SELECT COALESCE(d.blob_hash, 'path:' || d.audio_path) AS unit,
+           MAX(COALESCE(b.size_bytes, d.size_bytes, 0)) AS size_bytes,
+           MAX(COALESCE(d.last_accessed, d.downloaded_at)) AS last_accessed,
+           GROUP_CONCAT(d.video_id) AS video_ids,
+           MAX(d.audio_path) AS audio_path
+    FROM downloads d
+    LEFT JOIN blobs b ON b.hash = d.blob_hash
+    GROUP BY unit
+"""
+
+def touch(video_id: str):
+    with get_conn() as con:
+        con.execute("UPDATE downloads SET last_accessed = ? WHERE video_id = ?",
+                    (datetime.utcnow().isoformat(), video_id))
+        con.commit()
+
+def _backfill_sizes(con):
+    """Размер файлов, скачанных до появления учёта (старая раскладка без blob)."""
+    rows = con.execute("""
+        SELECT video_id, audio_path FROM downloads
+        WHERE blob_hash IS NULL AND size_bytes IS NULL
+    """).fetchall()
+    for row in rows:
+        path = row["audio_path"]
+        size = os.path.getsize(path) if path and os.path.exists(path) else 0
+        con.execute("UPDATE downloads SET size_bytes = ? WHERE video_id = ?", (size, row["video_id"]))
+
+def _stem(path: str) -> str:
+    return os.path.splitext(os.path.basename(path))[0]
+
+def _transcoded_units(units: list[dict]) -> list[dict]:
+    """mp3 из TRANSCODE_CACHE_DIR как единицы вытеснения; video_ids - от исходного файла."""
+    try:
+        names = os.listdir(TRANSCODE_CACHE_DIR)
+    except FileNotFoundError:
+        return []
+    sources = {_stem(u["audio_path"]): u for u in units if u["audio_path"]}
+    source_paths = {os.path.abspath(u["audio_path"]) for u in units if u["audio_path"]}
+    result = []
+    for name in names:
+        path = os.path.join(TRANSCODE_CACHE_DIR, name)
+        # .part - перекодирование ещё идёт; mp3 в режиме AUDIO_STORAGE_MODE=mp3 учтён как исходный
+        if not name.endswith(".mp3") or os.path.abspath(path) in source_paths:
+            continue
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            continue
+        source = sources.get(_stem(name))
+        result.append({
+            "unit": f"mp3:{name}",
+            "size_bytes": st.st_size,
+            "last_accessed": datetime.utcfromtimestamp(max(st.st_mtime, st.st_atime)).isoformat(),
+            "video_ids": source["video_ids"] if source else "",
+            "audio_path": path,
+            "transcoded": True,
+        })
+    return result
+
+def _all_units(con) -> list[dict]:
+    units = [dict(row) for row in con.execute(_UNITS_SQL)]
+    return units + _transcoded_units(units)
+
+def usage_bytes() -> int:
+    with get_conn() as con:
+        _backfill_sizes(con)
+        con.commit()
+        return sum(u["size_bytes"] for u in _all_units(con))
+
+def _trend_scores(units: list[dict]) -> dict[str, float]:
+    """TrendScore видео из units; считается до блокировки записи (по запросу на видео)."""
+    from rank_shorts import compute_trend_score
+    vids = {vid for u in units for vid in u["video_ids"].split(",") if vid}
+    return {vid: compute_trend_score(vid) for vid in vids}
+
+def _order_victims(units: list[dict], policy: str, scores: dict[str, float]) -> list[dict]:
+    if policy == "trend":
+        for u in units:
+            vids = [vid for vid in u["video_ids"].split(",") if vid]
+            # mp3 без исходного файла никому не нужен - он вытесняется первым
+            u["score"] = max((scores.get(vid, 0.0) for vid in vids), default=-1.0)
+        return sorted(units, key=lambda u: (u["score"], u["last_accessed"] or ""))
+    return sorted(units, key=lambda u: u["last_accessed"] or "")
+
+def _transcoded_path(audio_path: Optional[str]) -> Optional[str]:
+    if not audio_path:
+        return None
+    mp3_path = os.path.join(TRANSCODE_CACHE_DIR, f"{_stem(audio_path)}.mp3")
+    return mp3_path if mp3_path != audio_path else None
+
+def _drop_transcoded(audio_path: Optional[str]):
+    mp3_path = _transcoded_path(audio_path)
+    if mp3_path and os.path.exists(mp3_path):
+        os.remove(mp3_path)
+
+def enforce_budget(max_bytes: int = MEDIA_CACHE_MAX_BYTES, policy: str = MEDIA_EVICTION_POLICY,
+                   keep: Optional[str] = None) -> int:
+    """
+    Вытесняет файлы, пока занятый объём больше max_bytes. Возвращает число освобождённых байт.
+    Не трогает файл видео keep (только что скачанный) и файлы, к которым обращались за последние
+    MEDIA_EVICTION_GRACE_SECONDS: иначе новый трек без истории (TrendScore 0) вытеснялся бы сразу
+    и скачивался заново по кругу.
+    """
+    if max_bytes <= 0:
+        return 0
+
+    scores = {}
+    if policy == "trend":
+        with get_conn() as con:
+            scores = _trend_scores([dict(row) for row in con.execute(_UNITS_SQL)])
+    grace_since = (datetime.utcnow() - timedelta(seconds=MEDIA_EVICTION_GRACE_SECONDS)).isoformat()
+
+    con = get_conn()
+    con.isolation_level = None
+    orphans, transcoded = [], []
+    freed = 0
+    try:
+        con.execute("BEGIN IMMEDIATE")
+        _backfill_sizes(con)
+        units = _all_units(con)
+        total = sum(u["size_bytes"] for u in units)
+        if total > max_bytes:
+            mp3_units = {u["audio_path"]: u for u in units if u.get("transcoded")}
+            evicted = set()
+            for u in _order_victims(units, policy, scores):
+                if total <= max_bytes:
+                    break
+                if u["unit"] in evicted or (u["last_accessed"] or "") >= grace_since \
+                        or (keep and keep in u["video_ids"].split(",")):
+                    continue
+                evicted.add(u["unit"])
+                size = u["size_bytes"]
+                if u.get("transcoded"):
+                    transcoded.append(u["audio_path"])
+                else:
+                    for vid in u["video_ids"].split(","):
+                        path = release(con, vid)
+                        if path:
+                            orphans.append(path)
+                    # mp3 удаляется вместе с исходным файлом
+                    mp3 = mp3_units.get(_transcoded_path(u["audio_path"]))
+                    if mp3 and mp3["unit"] not in evicted:
+                        evicted.add(mp3["unit"])
+                        size += mp3["size_bytes"]
+                total -= size
+                freed += size
+                print(f"[media_cache] EVICT {u['video_ids'] or u['unit']} ({size} bytes)")
+        con.execute("COMMIT")
+    except Exception:
+        if con.in_transaction:
+            con.execute("ROLLBACK")
+        raise
+    finally:
+        con.close()
+
+    for path in orphans:
+        if os.path.exists(path):
+            os.remove(path)
+        _drop_transcoded(path)
+    for path in transcoded:
+        if os.path.exists(path):
+            os.remove(path)
+    return freed
+
+def forget_missing(video_id: str) -> bool:
+    """Удаляет строку downloads, если файл пропал с диска. True - трек нужно скачать заново."""
+    with get_conn() as con:
+        row = con.execute("SELECT audio_path FROM downloads WHERE video_id = ?", (video_id,)).fetchone()
+        if row is None:
+            return True
+        if row["audio_path"] and os.path.exists(row["audio_path"]):
+            return False
+        release(con, video_id)
+        con.commit()
+        return True
+
+if __name__ == "__main__":
+    freed = enforce_budget()
+    print(f"[media_cache] Занято {usage_bytes()} байт, освобождено {freed} байт")
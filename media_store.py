@@ -0,0 +1,108 @@
+"""
+Контентно-адресуемое хранилище аудио.
+
+Каждый файл хранится один раз под sha256 своего содержимого в шардированных папках
+MEDIA_DIR/blobs/ab/cd/<hash>.<ext>. Строки downloads ссылаются на blobs.hash,
+а blobs.ref_count считает ссылки - одинаковые звуки разных Shorts не дублируются.
+"""
+
+import hashlib
+import os
+import shutil
+from datetime import datetime
+from typing import Optional
+
+from config import MEDIA_DIR
+from db import get_conn
+
+BLOBS_DIR = os.path.join(MEDIA_DIR, "blobs")
+INCOMING_DIR = os.path.join(MEDIA_DIR, "incoming")
+
+def hash_file(path: str, chunk_size: int = 1 << 20) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def blob_path(digest: str, ext: str) -> str:
+    name = f"{digest}.{ext}" if ext else digest
+    return os.path.join(BLOBS_DIR, digest[:2], digest[2:4], name)
+
+def _decref(con, digest: Optional[str]) -> Optional[str]:
+    """Уменьшает счётчик ссылок. Возвращает путь файла, если ссылок не осталось."""
+    if not digest:
+        return None
+    con.execute("UPDATE blobs SET ref_count = ref_count - 1 WHERE hash = ?", (digest,))
+    row = con.execute("SELECT path, ref_count FROM blobs WHERE hash = ?", (digest,)).fetchone()
+    if row and row["ref_count"] <= 0:
+        con.execute("DELETE FROM blobs WHERE hash = ?", (digest,))
+        return row["path"]
+    return None
+
+def _unlink(path: Optional[str]):
+    if path and os.path.exists(path):
+        os.remove(path)
+
+def store_file(video_id: str, src_path: str, duration_sec: int, fmt: str) -> str:
+    """
+    Переносит скачанный файл в хранилище и записывает downloads для video_id.
+    Если такое содержимое уже есть, новый файл удаляется, а счётчик ссылок растёт.
+    """
+    digest = hash_file(src_path)
+    size = os.path.getsize(src_path)
+    dest = blob_path(digest, fmt)
+    now = datetime.utcnow().isoformat()
+
+    con = get_conn()
+    con.isolation_level = None
+    orphan = None
+    try:
+        con.execute("BEGIN IMMEDIATE")
+        blob = con.execute("SELECT path FROM blobs WHERE hash = ?", (digest,)).fetchone()
+        if blob and os.path.exists(blob["path"]):
+            dest = blob["path"]
+            os.remove(src_path)
+            print(f"[media_store] DUP {video_id} -> {digest[:12]}")
+        else:
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+            shutil.move(src_path, dest)
+            con.execute("""
+                INSERT OR REPLACE INTO blobs(hash, path, size_bytes, format, ref_count, created_at)
+                VALUES(?, ?, ?, ?, COALESCE((SELECT ref_count FROM blobs WHERE hash = ?), 0), ?)
+            """, (digest, dest, size, fmt, digest, now))
+
+        prev = con.execute("SELECT blob_hash FROM downloads WHERE video_id = ?", (video_id,)).fetchone()
+        if not (prev and prev["blob_hash"] == digest):
+            con.execute("UPDATE blobs SET ref_count = ref_count + 1 WHERE hash = ?", (digest,))
+            orphan = _decref(con, prev["blob_hash"] if prev else None)
+
+        con.execute("""
+            INSERT OR REPLACE INTO downloads(video_id, audio_path, downloaded_at, duration_sec, format,
+                                             blob_hash, size_bytes, last_accessed)
+            VALUES(?, ?, ?, ?, ?, ?, ?, ?)
+        """, (video_id, dest, now, duration_sec, fmt, digest, size, now))
+        con.execute("COMMIT")
+    except Exception:
+        if con.in_transaction:
+            con.execute("ROLLBACK")
+        raise
+    finally:
+        con.close()
+
+    _unlink(orphan)
+    return dest
+
+def release(con, video_id: str) -> Optional[str]:
+    """
+    Удаляет строку downloads и снимает ссылку на blob в транзакции вызывающего.
+    Возвращает путь файла, который больше никем не используется (удалить после COMMIT).
+    """
+    row = con.execute("SELECT audio_path, blob_hash FROM downloads WHERE video_id = ?", (video_id,)).fetchone()
+    if not row:
+        return None
+    con.execute("DELETE FROM downloads WHERE video_id = ?", (video_id,))
+    if row["blob_hash"]:
+        return _decref(con, row["blob_hash"])
+    # файл из старой раскладки MEDIA_DIR/YYYY/MM, принадлежит одному видео
+    return row["audio_path"]
@@ -0,0 +1,226 @@
+"""
+Метрики в текстовом формате Prometheus (/metrics).
+
+Счётчики и гистограммы хранятся в памяти процесса: запись - это поиск по словарю и
+несколько сложений под локом, поэтому инструментирование горячих путей почти ничего не стоит.
+Собираются: время ответа Flask по маршрутам, вызовы YouTube API (количество, время,
+ошибки, квота), извлечение yt-dlp, перекодирование, запросы SQLite и этапы пайплайна.
+"""
+
+import bisect
+import contextvars
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+# границы корзин гистограмм, секунды
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+SLOW_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0)
+
+# стоимость запросов YouTube Data API в единицах квоты
+YOUTUBE_QUOTA_COST = {"search": 100, "videos": 1}
+
+_registry: list["_Metric"] = []
+
+# счётчики текущего этапа пайплайна (api_calls, api_errors, quota_units, rows_written),
+# см. pipeline.PipelineTracker и ledger.py; вне этапа - None
+SPAN_COUNTERS = ("api_calls", "api_errors", "quota_units", "rows_written")
+stage_counters: contextvars.ContextVar[dict | None] = contextvars.ContextVar("stage_counters", default=None)
+
+def _count(field: str, amount: int):
+    counters = stage_counters.get()
+    if counters is not None:
+        counters[field] = counters.get(field, 0) + amount
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values: dict[tuple, object] = {}
+        _registry.append(self)
+
+    def _header(self) -> list[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount: float = 1.0):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def render(self) -> list[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return self._header() + [f"{self.name}{_format_labels(self.labelnames, k)} {v:g}" for k, v in items]
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, *labels, value: float):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(labels)
+            if state is None:
+                # [счётчики корзин..., +Inf], сумма
+                state = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][i] += 1
+            state[1] += value
+
+    @contextmanager
+    def time(self, *labels):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(*labels, value=time.perf_counter() - t0)
+
+    def render(self) -> list[str]:
+        with self._lock:
+            items = sorted((k, (list(v[0]), v[1])) for k, v in self._values.items())
+        lines = self._header()
+        for labels, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                le_label = f'le="{le}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, le_label)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {total:.6f}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+def render() -> str:
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# --- метрики приложения ---
+
+http_requests = Counter("http_requests_total", "HTTP-запросы по маршрутам", ("route", "method", "status"))
+http_latency = Histogram("http_request_duration_seconds", "Время ответа Flask до начала отдачи тела",
+                         ("route", "method"))
+
+youtube_calls = Counter("youtube_api_calls_total", "Запросы к YouTube Data API", ("endpoint", "status"))
+youtube_latency = Histogram("youtube_api_duration_seconds", "Время запросов к YouTube Data API", ("endpoint",))
+youtube_quota = Counter("youtube_api_quota_units_total", "Потраченные единицы квоты YouTube Data API", ("endpoint",))
+
+ytdlp_duration = Histogram("ytdlp_extract_duration_seconds", "Время extract_info yt-dlp",
+                           ("kind", "status"), buckets=SLOW_BUCKETS)
+transcode_duration = Histogram("transcode_duration_seconds", "Время перекодирования в mp3",
+                               ("status",), buckets=SLOW_BUCKETS)
+
+sqlite_latency = Histogram("sqlite_query_duration_seconds", "Время выполнения запросов SQLite (execute)",
+                           ("operation",))
+
+scheduler_job_duration = Histogram("scheduler_job_duration_seconds", "Длительность плановых задач",
+                                   ("job", "status"), buckets=SLOW_BUCKETS)
+
+pipeline_stage_duration = Histogram("pipeline_stage_duration_seconds", "Длительность этапов пайплайна",
+                                    ("stage", "status"), buckets=SLOW_BUCKETS)
+
+# --- инструментирование ---
+
+@contextmanager
+def track_youtube_call(endpoint: str):
+    """Оборачивает один HTTP-запрос к YouTube API (каждую попытку retry отдельно)."""
+    t0 = time.perf_counter()
+    status = "error"
+    try:
+        yield
+        status = "ok"
+    finally:
+        youtube_latency.observe(endpoint, value=time.perf_counter() - t0)
+        youtube_calls.inc(endpoint, status)
+        # квота списывается и за неуспешные запросы
+        quota = YOUTUBE_QUOTA_COST.get(endpoint, 1)
+        youtube_quota.inc(endpoint, amount=quota)
+        _count("api_calls", 1)
+        _count("quota_units", quota)
+        if status == "error":
+            _count("api_errors", 1)
+
+@contextmanager
+def track_duration(histogram: Histogram, *labels):
+    """Время блока с меткой status=ok/error последней в списке меток."""
+    t0 = time.perf_counter()
+    status = "error"
+    try:
+        yield
+        status = "ok"
+    finally:
+        histogram.observe(*labels, status, value=time.perf_counter() - t0)
+
+WRITE_OPERATIONS = {"insert", "update", "delete", "replace"}
+
+def _operation(sql: str) -> str:
+    word = sql.lstrip().split(None, 1)[:1]
+    return word[0].lower() if word else "empty"
+
+class TimedCursor(sqlite3.Cursor):
+    def _timed(self, method, sql, parameters):
+        t0 = time.perf_counter()
+        operation = _operation(sql)
+        try:
+            result = method(sql, parameters)
+        finally:
+            sqlite_latency.observe(operation, value=time.perf_counter() - t0)
+        if operation in WRITE_OPERATIONS and self.rowcount > 0:
+            _count("rows_written", self.rowcount)
+        return result
+
+    def execute(self, sql, parameters=()):
+        return self._timed(super().execute, sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self._timed(super().executemany, sql, seq_of_parameters)
+
+class TimedConnection(sqlite3.Connection):
+    """Соединение, у которого execute()/cursor() пишут время запросов в sqlite_query_duration_seconds."""
+
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+def init_app(app):
+    """Подключает замер времени ответа ко всем маршрутам Flask-приложения."""
+    from flask import g, request
+
+    @app.before_request
+    def _start_timer():
+        g._metrics_t0 = time.perf_counter()
+
+    @app.after_request
+    def _record_request(response):
+        t0 = g.pop("_metrics_t0", None)
+        if t0 is not None:
+            route = request.url_rule.rule if request.url_rule else "unmatched"
+            http_latency.observe(route, request.method, value=time.perf_counter() - t0)
+            http_requests.inc(route, request.method, str(response.status_code))
+        return response
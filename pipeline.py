@@ -1,25 +1,376 @@
-from config import TOP_N_DOWNLOAD
-from fetch_shorts import fetch_and_store
-from search_trends import search_trending_sounds
+import queue
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+try:
+    import fcntl
+except ImportError:  # Windows: блокировка между процессами недоступна
+    fcntl = None
+
+import ledger
+from config import (DB_PATH, PIPELINE_QUEUE_SIZE, PIPELINE_RESUME_MAX_AGE_HOURS, PIPELINE_RESUME_RERUN_MINUTES,
+                    TOP_N_DOWNLOAD)
+from db import bump_data_version, get_conn, init_db, write_snapshots
+from fetch_shorts import iter_popular_batches
+from search_trends import iter_search_batches
 from rank_shorts import rank_top_n
 from download_audio import download_audio_for
+from metrics import SPAN_COUNTERS, pipeline_stage_duration, stage_counters
+from profiling import profile_stage
+from utils import today_str
+
+# (имя, заголовок) этапов в порядке выполнения
+PIPELINE_STAGES = [
+    ("fetch_popular", "Получение популярных Shorts"),
+    ("search_sounds", "Поиск трендовых звуков"),
+    ("rank", "Ранжирование и отбор"),
+]
+
+# Этапы-источники: имя -> генератор (пачка записей для db.store_snapshots, контрольная точка),
+# принимающий resume=контрольная точка. Друг от друга не зависят и выполняются параллельно
+SOURCE_STAGES = {
+    "fetch_popular": iter_popular_batches,
+    "search_sounds": iter_search_batches,
+}
+
+# Зависимые этапы: имя -> (этапы, чьи записи должны быть в базе, функция этапа)
+DEPENDENT_STAGES = {
+    "rank": (("fetch_popular", "search_sounds"), lambda: rank_top_n(TOP_N_DOWNLOAD)),
+}
+
+_DONE = object()
+
+# Файл блокировки запуска: держит процесс, выполняющий пайплайн (веб-приложение или CLI)
+LOCK_PATH = DB_PATH + ".pipeline.lock"
+
+class PipelineBusy(RuntimeError):
+    """Пайплайн уже выполняется в другом процессе."""
+
+class PartialStage(RuntimeError):
+    """Этап выполнен не полностью: неудавшиеся элементы остались в контрольной точке."""
+
+def acquire_run_lock():
+    """Блокировка запуска без ожидания: файл блокировки или None, если она занята (снимается и при падении процесса)."""
+    f = open(LOCK_PATH, "a")
+    if fcntl is not None:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            f.close()
+            return None
+    return f
+
+def release_run_lock(f):
+    if fcntl is not None:
+        fcntl.flock(f, fcntl.LOCK_UN)
+    f.close()
+
+class PipelineTracker:
+    """
+    Записывает время, количество обработанных элементов, вызовы API, квоту, записанные строки
+    и ошибку каждого этапа. Завершённые этапы сохраняются в журнал (ledger.py) под run_id.
+    """
+
+    def __init__(self, on_change=None, run_id: str = None, trigger: str = "cli"):
+        # on_change(span) вызывается при старте и завершении каждого этапа
+        self.on_change = on_change
+        self.run_id = run_id or uuid.uuid4().hex[:12]
+        self.trigger = trigger
+        self.stages = [{"name": name, "title": title, "status": "pending", "started_at": None,
+                        "finished_at": None, "duration_sec": None, "count": None, "error": None,
+                        **dict.fromkeys(SPAN_COUNTERS, 0)}
+                       for name, title in PIPELINE_STAGES]
+        self._started: dict[str, float] = {}
+        # длительность этапа в прерванном запуске, который продолжается (см. restore)
+        self._prior_duration: dict[str, float] = {}
+
+    def _span(self, name: str) -> dict:
+        return next(s for s in self.stages if s["name"] == name)
+
+    def restore(self, spans: list[dict]):
+        """Переносит этапы из журнала продолжаемого запуска: выполненные не повторяются, счётчики копятся."""
+        for saved in spans:
+            span = self._span(saved["stage"])
+            for field in SPAN_COUNTERS:
+                span[field] = saved[field] or 0
+            self._prior_duration[span["name"]] = saved["duration_sec"] or 0.0
+            if saved["status"] == "done":
+                span.update(status="done", count=saved["item_count"], started_at=saved["started_at"],
+                            finished_at=saved["finished_at"], duration_sec=saved["duration_sec"])
+
+    def partial_error(self):
+        """Ошибки этапов, выполненных частично (None - все этапы выполнены полностью)."""
+        return "; ".join(f"{s['name']}: {s['error']}" for s in self.stages if s["status"] == "partial") or None
+
+    def begin(self, name: str) -> dict:
+        span = self._span(name)
+        print(f"=== {span['title']} ===")
+        span.update(status="running", started_at=datetime.utcnow().isoformat())
+        self._started[name] = time.monotonic()
+        # этап виден в журнале сразу, а не только после завершения (статус из других процессов)
+        self._record(span)
+        self._notify(span)
+        return span
+
+    def finish(self, name: str, error: Exception = None, *counters: dict):
+        """Завершает этап; counters - счётчики API и записанных строк (из разных потоков суммируются)."""
+        span = self._span(name)
+        elapsed = time.monotonic() - self._started.pop(name) + self._prior_duration.pop(name, 0.0)
+        for c in counters:
+            for field, value in c.items():
+                span[field] += value
+        status = "partial" if isinstance(error, PartialStage) else "failed" if error else "done"
+        span.update(status=status, error=str(error) if error else None,
+                    finished_at=datetime.utcnow().isoformat(), duration_sec=round(elapsed, 3))
+        pipeline_stage_duration.observe(name, span["status"], value=elapsed)
+        self._record(span)
+        self._notify(span)
+
+    @contextmanager
+    def stage(self, name: str):
+        span = self.begin(name)
+        counters = {}
+        token = stage_counters.set(counters)
+        error = None
+        try:
+            with profile_stage(name):
+                yield span
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            stage_counters.reset(token)
+            self.finish(name, error, counters)
+
+    def _record(self, span: dict):
+        try:
+            ledger.record_span(self.run_id, span)
+        except Exception as e:
+            print(f"[pipeline] Не удалось записать этап в журнал: {e}")
+
+    def _notify(self, span: dict):
+        if self.on_change:
+            try:
+                self.on_change(dict(span))
+            except Exception as e:
+                print(f"[pipeline] Ошибка обработчика этапа: {e}")
+
+def run_pipeline(tracker: PipelineTracker = None, resume: bool = True, run_lock=None, sources=None):
+    """
+    Запускает пайплайн. Если последний запуск не старше PIPELINE_RESUME_MAX_AGE_HOURS упал или
+    был прерван (или tracker несёт run_id такого запуска), он продолжается с контрольных точек;
+    выполненные в нём источники старше PIPELINE_RESUME_RERUN_MINUTES выполняются заново.
+    После частично выполненного запуска начинается новый, в который переносятся только
+    неудавшиеся запросы поиска (carry_over_checkpoints).
+    sources - этапы-источники этого запуска (по умолчанию все); зависимые этапы для остальных
+    берут данные, уже записанные в базу (так планировщик собирает чарт и поиск со своим периодом).
+
+    Запуск идёт под блокировкой LOCK_PATH: run_lock - уже взятая вызывающим блокировка (она
+    снимается по завершении), иначе она берётся здесь. Пока блокировка у нас, запуск в статусе
+    running не может выполняться где-то ещё - его процесс умер, и запуск можно продолжать.
+    """
+    if run_lock is None:
+        run_lock = acquire_run_lock()
+        if run_lock is None:
+            raise PipelineBusy("Пайплайн уже выполняется в другом процессе")
+    try:
+        init_db()
+        if tracker is None:
+            tracker = PipelineTracker(run_id=find_resumable_run() if resume else None)
+        checkpoints = {}
+        previous = ledger.get_run(tracker.run_id)
+        if previous:
+            # запуск мог быть уже записан в журнал вызывающим (pipeline_jobs) - тогда этапов нет
+            stale = _stale_sources(previous["stages"])
+            tracker.restore([s for s in previous["stages"] if s["stage"] not in stale])
+            checkpoints = {stage: c for stage, c in ledger.get_checkpoints(tracker.run_id).items()
+                           if stage not in stale}
+            ledger.resume_run(tracker.run_id)
+            if previous["stages"]:
+                print(f"=== Продолжение запуска {tracker.run_id} ===")
+            if stale:
+                print(f"[pipeline] Выполняются заново (данные устарели): {', '.join(sorted(stale))}")
+        else:
+            ledger.start_run(tracker.run_id, tracker.trigger)
+        if resume and not (previous and previous["stages"]):
+            checkpoints = carry_over_checkpoints(tracker.run_id, sources)
+        t0 = time.monotonic()
+        try:
+            top = _run_stages(tracker, checkpoints, sources)
+        except Exception as e:
+            ledger.finish_run(tracker.run_id, "failed", round(time.monotonic() - t0, 3), error=str(e))
+            raise
+        partial = tracker.partial_error()
+        # незавершённые элементы повторятся, когда следующий запуск продолжит этот
+        ledger.finish_run(tracker.run_id, "partial" if partial else "done", round(time.monotonic() - t0, 3),
+                          result_count=len(top), error=partial)
+        return top
+    finally:
+        release_run_lock(run_lock)
+
+def find_resumable_run():
+    return ledger.find_resumable(PIPELINE_RESUME_MAX_AGE_HOURS)
+
+def _stale_sources(spans: list[dict]) -> set:
+    """Этапы-источники продолжаемого запуска, выполненные раньше PIPELINE_RESUME_RERUN_MINUTES назад."""
+    since = (datetime.utcnow() - timedelta(minutes=PIPELINE_RESUME_RERUN_MINUTES)).isoformat()
+    return {s["stage"] for s in spans
+            if s["stage"] in SOURCE_STAGES and s["status"] == "done" and (s["finished_at"] or "") < since}
+
+def carry_over_checkpoints(run_id: str, sources=None) -> dict:
+    """
+    Контрольные точки нового запуска run_id после частично выполненного: из его поиска
+    переносятся выполненные запросы, так что повторяются только неудавшиеся. Остальные этапы
+    выполняются заново. Перенесённые точки сразу пишутся в журнал под run_id.
+    """
+    if sources is not None and "search_sounds" not in sources:
+        return {}
+    partial_id = ledger.find_partial(PIPELINE_RESUME_MAX_AGE_HOURS, exclude=run_id)
+    if partial_id is None:
+        return {}
+    position = ledger.get_checkpoints(partial_id).get("search_sounds", {}).get("position") or {}
+    if not position.get("failed"):
+        return {}
+    carried = {"search_sounds": {"position": {"done": position.get("done", []), "failed": []}, "items": 0}}
+    con = get_conn()
+    try:
+        ledger.write_checkpoint(con, run_id, "search_sounds", carried["search_sounds"]["position"], 0)
+        con.commit()
+    finally:
+        con.close()
+    print(f"[pipeline] Из частичного запуска {partial_id} повторяются запросы: {', '.join(position['failed'])}")
+    return carried
+
+def _produce(name: str, batches, resume, out: queue.Queue, stop: threading.Event, abandoned: threading.Event):
+    """
+    Поток этапа-источника: кладёт в очередь (name, пачка, контрольная точка, None, None),
+    в конце - (name, _DONE, None, счётчики, ошибка).
+    """
+    counters = {}
+    stage_counters.set(counters)
+    error = None
+
+    def put(item):
+        # очередь ограничена: ждём писателя, пока он жив
+        while not abandoned.is_set():
+            try:
+                out.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+
+    position = None
+    try:
+        with profile_stage(name):
+            for batch, position in batches(resume=resume):
+                if stop.is_set():
+                    error = RuntimeError("Этап остановлен из-за ошибки другого этапа")
+                    break
+                put((name, batch, position, None, None))
+        if error is None and position and position.get("failed"):
+            # неудавшиеся элементы остались в контрольной точке и повторятся при продолжении,
+            # зависимые этапы работают с тем, что удалось записать
+            error = PartialStage(f"Не выполнены: {', '.join(map(str, position['failed']))}")
+    except Exception as e:
+        error = e
+    put((name, _DONE, None, counters, error))
+
+def _commit_batch(run_id: str, name: str, batch: list[dict], position: dict, items: int, snapshot_date: str):
+    """Пачка и контрольная точка этапа - одной транзакцией."""
+    con = get_conn()
+    try:
+        write_snapshots(con, batch, snapshot_date)
+        ledger.write_checkpoint(con, run_id, name, position, items)
+        con.commit()
+    finally:
+        con.close()
+
+def _run_dag(tracker: PipelineTracker, checkpoints: dict = None, sources=None):
+    """
+    Этапы-источники работают параллельно и передают записи через ограниченную очередь
+    единственному писателю SQLite (этот поток). Зависимый этап стартует, как только все его
+    входы записаны в базу, поэтому время запуска близко к самому долгому этапу, а не к сумме.
+    После каждой пачки сохраняется контрольная точка; выполненные в прерванном запуске этапы
+    пропускаются, остальные продолжаются с последней точки.
+    """
+    checkpoints = checkpoints or {}
+    out = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    stop, abandoned = threading.Event(), threading.Event()
+    writer_counters = {name: {} for name in SOURCE_STAGES}
+    # не выбранные источники не выполняются: для зависимых этапов их данные уже в базе
+    done = {name for name in SOURCE_STAGES
+            if tracker._span(name)["status"] == "done" or (sources is not None and name not in sources)}
+    pending, results = set(SOURCE_STAGES) - done, {}
+
+    for name in pending:
+        checkpoint = checkpoints.get(name, {})
+        tracker.begin(name)["count"] = checkpoint.get("items", 0)
+        threading.Thread(target=_produce, args=(name, SOURCE_STAGES[name], checkpoint.get("position"),
+                                                out, stop, abandoned),
+                         name=f"pipeline-{name}", daemon=True).start()
+
+    snapshot_date = today_str()
+    error = None
+    try:
+        if not pending:
+            _run_ready_stages(tracker, done, results)
+        while pending:
+            name, batch, position, producer_counters, stage_error = out.get()
+            span = tracker._span(name)
+            if batch is not _DONE:
+                token = stage_counters.set(writer_counters[name])
+                try:
+                    _commit_batch(tracker.run_id, name, batch, position, span["count"] + len(batch), snapshot_date)
+                    span["count"] += len(batch)
+                    bump_data_version()
+                finally:
+                    stage_counters.reset(token)
+                continue
+
+            pending.discard(name)
+            tracker.finish(name, stage_error, producer_counters, writer_counters[name])
+            print(f"[pipeline] {span['title']}: записано {span['count']}")
+            if stage_error and not isinstance(stage_error, PartialStage):
+                error = error or stage_error
+                stop.set()
+                continue
+            done.add(name)
+            _run_ready_stages(tracker, done, results)
+    except Exception as e:
+        stop.set()
+        abandoned.set()
+        for name in pending:
+            tracker.finish(name, e, writer_counters[name])
+        raise
+    if error:
+        raise error
+    return results
+
+def _run_ready_stages(tracker: PipelineTracker, done: set, results: dict):
+    """Запускает зависимые этапы, все входы которых уже записаны."""
+    for stage, (deps, run) in DEPENDENT_STAGES.items():
+        if stage not in results and set(deps) <= done:
+            with tracker.stage(stage) as stage_span:
+                results[stage] = run()
+                stage_span["count"] = len(results[stage])
 
-def run_pipeline():
-    # 1) получить популярные Shorts (US) и записать метрики
-    print("=== Получение популярных Shorts ===")
-    fetch_and_store()
-    
-    # 2) поиск трендовых звуков по ключевым словам
-    print("=== Поиск трендовых звуков ===")
-    search_trending_sounds()
-
-    # 3) отранжировать и выбрать топ N (по простому TrendScore)
-    print("=== Ранжирование и отбор ===")
-    top = rank_top_n(TOP_N_DOWNLOAD)
+def _run_stages(tracker: PipelineTracker, checkpoints: dict = None, sources=None):
+    top = _run_dag(tracker, checkpoints, sources)["rank"]
     print(f"Найдено {len(top)} трендовых треков")
 
-    # 4) больше не скачиваем локально - только прямые ссылки
+    # больше не скачиваем локально - только прямые ссылки
     print("=== Готово! Используйте API для получения прямых ссылок ===")
+    return top
 
 if __name__ == "__main__":
-    run_pipeline()
+    import argparse
+    parser = argparse.ArgumentParser(description="Запуск пайплайна")
+    parser.add_argument("--fresh", action="store_true", help="не продолжать незавершённый запуск")
+    try:
+        run_pipeline(resume=not parser.parse_args().fresh)
+    except PipelineBusy as e:
+        print(f"[pipeline] {e}")
+        raise SystemExit(1)
@@ -0,0 +1,112 @@
+"""
+Фоновый запуск пайплайна из веб-приложения.
+
+Одновременно выполняется не больше одного запуска (single-flight): повторный
+POST /run_pipeline во время работы возвращает id текущего запуска, в том числе из другого
+процесса (воркеры gunicorn, python pipeline.py): запуск защищён блокировкой файла рядом с
+базой (pipeline.acquire_run_lock). Упавший или прерванный недавний запуск продолжается под
+своим id (см. pipeline.run_pipeline). Прогресс по этапам доступен через
+/api/pipeline/runs/<run_id>.
+"""
+
+import threading
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+from typing import Optional
+
+import ledger
+from db import init_db
+from pipeline import PipelineTracker, acquire_run_lock, find_resumable_run, release_run_lock, run_pipeline
+
+KEEP_RUNS = 20
+
+_lock = threading.Lock()
+_runs_lock = threading.Lock()
+_runs: "OrderedDict[str, dict]" = OrderedDict()
+_current_id: Optional[str] = None
+
+def _running_elsewhere() -> dict:
+    """Запуск, который выполняет другой процесс (по журналу)."""
+    running = [r for r in ledger.recent_runs(1) if r["status"] == "running"]
+    return {"run_id": running[0]["run_id"] if running else None, "status": "running"}
+
+def _snapshot(run: dict) -> dict:
+    return {k: v for k, v in run.items() if k != "tracker"} | {
+        "stages": [dict(s) for s in run["tracker"].stages]
+    }
+
+def _publish(event: str, data: dict):
+    from events import broadcaster
+    broadcaster.publish(event, data)
+
+def _execute(run: dict, run_lock):
+    global _current_id
+    _publish("pipeline", {"run_id": run["run_id"], "status": "running"})
+    try:
+        # блокировку между процессами снимает run_pipeline
+        run["result_count"] = len(run_pipeline(run["tracker"], run_lock=run_lock))
+        run["error"] = run["tracker"].partial_error()
+        run["status"] = "partial" if run["error"] else "done"
+    except Exception as e:
+        run["status"] = "failed"
+        run["error"] = str(e)
+        print(f"[pipeline_jobs] Запуск {run['run_id']} завершился ошибкой: {e}")
+    finally:
+        run["finished_at"] = datetime.utcnow().isoformat()
+        with _runs_lock:
+            _current_id = None
+        _lock.release()
+        _publish("pipeline", {"run_id": run["run_id"], "status": run["status"],
+                              "error": run["error"], "result_count": run["result_count"]})
+
+def start_run() -> tuple[dict, bool]:
+    """Запускает пайплайн в фоне. Возвращает (запуск, True) или (текущий запуск, False)."""
+    global _current_id
+    if not _lock.acquire(blocking=False):
+        with _runs_lock:
+            current = _runs.get(_current_id)
+        return (_snapshot(current) if current else {"run_id": None, "status": "running"}), False
+
+    run_lock = acquire_run_lock()
+    if run_lock is None:
+        _lock.release()
+        return _running_elsewhere(), False
+    try:
+        init_db()
+        # незавершённый недавний запуск продолжается с контрольных точек под тем же id
+        run_id = find_resumable_run()
+        # запуск попадает в журнал до ответа 202: его статус виден из любого воркера gunicorn
+        if run_id:
+            ledger.resume_run(run_id)
+        else:
+            run_id = uuid.uuid4().hex[:12]
+            ledger.start_run(run_id, "api")
+    except Exception:
+        release_run_lock(run_lock)
+        _lock.release()
+        raise
+    run = {
+        "run_id": run_id,
+        "status": "running",
+        "started_at": datetime.utcnow().isoformat(),
+        "finished_at": None,
+        "error": None,
+        "result_count": None,
+    }
+    run["tracker"] = PipelineTracker(
+        on_change=lambda span: _publish("pipeline", {"run_id": run["run_id"], "status": "running", "stage": span}),
+        run_id=run["run_id"], trigger="api",
+    )
+    with _runs_lock:
+        _current_id = run["run_id"]
+        _runs[run["run_id"]] = run
+        while len(_runs) > KEEP_RUNS:
+            _runs.popitem(last=False)
+    threading.Thread(target=_execute, args=(run, run_lock), name=f"pipeline-{run['run_id']}", daemon=True).start()
+    return _snapshot(run), True
+
+def get_run(run_id: str) -> Optional[dict]:
+    with _runs_lock:
+        run = _runs.get(run_id)
+    return _snapshot(run) if run else None
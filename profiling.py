@@ -0,0 +1,157 @@
+"""
+Сэмплирующий профайлер по запросу для обработчиков Flask и этапов пайплайна.
+
+Пока идёт профилируемый участок, фоновый поток каждые PROFILE_INTERVAL_MS снимает стек
+профилируемого потока (sys._current_frames) и считает одинаковые стеки. Результат пишется
+в PROFILE_DIR в формате collapsed stacks (строка "корень;...;лист число"), который понимают
+flamegraph.pl и speedscope. В каталоге хранятся последние PROFILE_MAX_FILES профилей.
+
+Профилируется доля PROFILE_SAMPLE_RATE запросов или запрос с заголовком
+X-Profile-Token: <PROFILE_TOKEN>; этапы пайплайна - при PROFILE_PIPELINE=1. Если всё это
+выключено, хуки не регистрируются и накладных расходов нет.
+"""
+
+import hmac
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+from typing import Optional
+
+from config import (PROFILE_DIR, PROFILE_INTERVAL_MS, PROFILE_MAX_FILES, PROFILE_PIPELINE,
+                    PROFILE_SAMPLE_RATE, PROFILE_TOKEN)
+
+TOKEN_HEADER = "X-Profile-Token"
+SUFFIX = ".collapsed"
+
+_write_lock = threading.Lock()
+
+class Sampler:
+    """Снимает стеки одного потока с заданным интервалом до вызова stop()."""
+
+    def __init__(self, thread_id: int, interval: float):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+
+    def start(self) -> "Sampler":
+        self._thread.start()
+        return self
+
+    def stop(self) -> Counter:
+        self._stop.set()
+        self._thread.join()
+        return self.samples
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            self.samples[";".join(reversed(stack))] += 1
+
+def _safe_name(label: str) -> str:
+    return re.sub(r"[^A-Za-z0-9_.-]+", "_", label).strip("_")[:80] or "root"
+
+def _prune():
+    files = sorted((f for f in os.listdir(PROFILE_DIR) if f.endswith(SUFFIX)),
+                   key=lambda f: os.path.getmtime(os.path.join(PROFILE_DIR, f)))
+    for f in files[:max(0, len(files) - PROFILE_MAX_FILES)]:
+        try:
+            os.remove(os.path.join(PROFILE_DIR, f))
+        except FileNotFoundError:
+            pass
+
+def write_profile(kind: str, label: str, samples: Counter, elapsed: float) -> Optional[str]:
+    if not samples:
+        return None
+    name = (f"{datetime.utcnow().strftime('%Y%m%dT%H%M%S%f')}-{kind}-{_safe_name(label)}"
+            f"-{int(elapsed * 1000)}ms{SUFFIX}")
+    with _write_lock:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        path = os.path.join(PROFILE_DIR, name)
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in samples.most_common():
+                f.write(f"{stack} {count}\n")
+        _prune()
+    return name
+
+@contextmanager
+def profile(kind: str, label: str):
+    """Профилирует текущий поток на время блока и сохраняет результат."""
+    sampler = Sampler(threading.get_ident(), PROFILE_INTERVAL_MS / 1000).start()
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        samples = sampler.stop()
+        try:
+            write_profile(kind, label, samples, time.perf_counter() - t0)
+        except OSError as e:
+            print(f"[profiling] Не удалось сохранить профиль {label}: {e}")
+
+def profile_stage(name: str):
+    """Контекст для этапа пайплайна: профилирует, только если включено PROFILE_PIPELINE."""
+    return profile("stage", name) if PROFILE_PIPELINE else nullcontext()
+
+def token_ok(value: Optional[str]) -> bool:
+    return bool(PROFILE_TOKEN) and value is not None and hmac.compare_digest(value, PROFILE_TOKEN)
+
+def list_profiles() -> list[dict]:
+    if not os.path.isdir(PROFILE_DIR):
+        return []
+    profiles = []
+    for f in os.listdir(PROFILE_DIR):
+        if not f.endswith(SUFFIX):
+            continue
+        st = os.stat(os.path.join(PROFILE_DIR, f))
+        profiles.append({"name": f, "size_bytes": st.st_size,
+                         "created_at": datetime.utcfromtimestamp(st.st_mtime).isoformat()})
+    profiles.sort(key=lambda p: p["created_at"], reverse=True)
+    return profiles
+
+def profile_path(name: str) -> Optional[str]:
+    if os.path.basename(name) != name or not name.endswith(SUFFIX):
+        return None
+    path = os.path.join(PROFILE_DIR, name)
+    return path if os.path.isfile(path) else None
+
+def init_app(app):
+    """Регистрирует хуки профилирования запросов, если профилирование включено."""
+    if PROFILE_SAMPLE_RATE <= 0 and not PROFILE_TOKEN:
+        return
+    from flask import g, request
+
+    @app.before_request
+    def _start_profile():
+        requested = token_ok(request.headers.get(TOKEN_HEADER))
+        if requested or (PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE):
+            route = request.url_rule.rule if request.url_rule else request.path
+            g._profile = profile("req", f"{request.method}_{route}")
+            g._profile.__enter__()
+
+    @app.after_request
+    def _stop_profile(response):
+        ctx = g.pop("_profile", None)
+        if ctx is not None:
+            ctx.__exit__(None, None, None)
+        return response
+
+    @app.teardown_request
+    def _stop_profile_on_error(exc):
+        # after_request не вызывается, если обработчик упал с необработанной ошибкой
+        ctx = g.pop("_profile", None)
+        if ctx is not None:
+            ctx.__exit__(None, None, None)
@@ -0,0 +1,65 @@
+"""
+Кэш JSON-ответов для читающих эндпоинтов.
+
+Ключ - путь и нормализованные параметры запроса. Хранятся готовые байты ответа и
+ETag (sha1 тела), поэтому повторный запрос не трогает базу, а клиент с If-None-Match
+получает 304. Запись действительна, пока не изменилась версия данных
+(db.bump_data_version вызывается ингестом после записи).
+"""
+
+import hashlib
+import threading
+from collections import OrderedDict
+from functools import wraps
+
+from flask import Response, current_app, request
+
+from config import DATA_VERSION_CHECK_SECONDS, RESPONSE_CACHE_SIZE
+from db import get_data_version
+
+_cache: "OrderedDict[tuple, tuple[int, bytes, str]]" = OrderedDict()
+_lock = threading.Lock()
+
+def _key() -> tuple:
+    args = tuple(sorted((k, v.strip()) for k, v in request.args.items(multi=True)))
+    return request.path, args
+
+def _respond(body: bytes, etag: str) -> Response:
+    if etag in request.if_none_match:
+        response = Response(status=304)
+    else:
+        response = Response(body, mimetype="application/json")
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+def cached_json(view):
+    """Декоратор для эндпоинтов, отдающих JSON, который меняется только вместе с данными."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        key = _key()
+        version = get_data_version(DATA_VERSION_CHECK_SECONDS)
+        with _lock:
+            entry = _cache.get(key)
+            if entry is not None:
+                _cache.move_to_end(key)
+        if entry is not None and entry[0] == version:
+            return _respond(entry[1], entry[2])
+
+        response = current_app.make_response(view(*args, **kwargs))
+        if response.status_code != 200 or response.mimetype != "application/json":
+            return response
+        body = response.get_data()
+        etag = hashlib.sha1(body).hexdigest()
+        with _lock:
+            _cache[key] = (version, body, etag)
+            _cache.move_to_end(key)
+            while len(_cache) > RESPONSE_CACHE_SIZE:
+                _cache.popitem(last=False)
+        return _respond(body, etag)
+    return wrapper
+
+def clear():
+    """Сбрасывает кэш (бенчмарки холодных ответов)."""
+    with _lock:
+        _cache.clear()
@@ -0,0 +1,187 @@
+"""
+Планировщик: долго живущий процесс, который запускает задачи каждую со своим периодом.
+
+Расписание хранится в SQLite (schedule_state): слот scheduled_at идёт по фиксированной
+сетке (предыдущий слот + период), к нему добавляется случайный сдвиг, чтобы нагрузка
+распределялась по времени. Перед запуском задача берётся под аренду (lease_until), поэтому
+одна и та же задача не выполняется одновременно, даже если запущено несколько планировщиков.
+Сбор чарта и поиска идёт через пайплайн (pipeline.run_pipeline): если пайплайн уже выполняется,
+слот пропускается.
+После перезапуска просроченные задачи выполняются сразу, один раз за все пропущенные слоты.
+
+    python scheduler.py            # запуск
+    python scheduler.py --status   # состояние задач
+"""
+
+import argparse
+import random
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Optional
+
+from config import (SCHEDULE_CHART_SECONDS, SCHEDULE_NIGHTLY_HOUR, SCHEDULE_SEARCH_SECONDS,
+                    SCHEDULE_STATS_REFRESH_SECONDS, SCHEDULER_JITTER_FRACTION, SCHEDULER_LEASE_SECONDS,
+                    SCHEDULER_TICK_SECONDS, STATS_REFRESH_DAYS, STATS_REFRESH_MAX_VIDEOS)
+from db import get_conn, init_db, tracked_video_ids
+from download_queue import worker_id
+from fetch_shorts import refresh_stats
+from maintenance import nightly
+from metrics import scheduler_job_duration, track_duration
+from pipeline import PipelineBusy, PipelineTracker, run_pipeline
+
+DAY_SECONDS = 24 * 3600
+
+class SlotSkipped(RuntimeError):
+    """Слот пропущен: задачу сейчас выполнять нельзя, она запустится в следующем слоте."""
+
+def _refresh_tracked_stats() -> int:
+    return refresh_stats(tracked_video_ids(STATS_REFRESH_DAYS, STATS_REFRESH_MAX_VIDEOS))
+
+def _pipeline_job(source: str) -> int:
+    """
+    Сбор одного источника через пайплайн: под блокировкой запуска, с записью в журнал и
+    контрольными точками, затем ранжирование. Всегда новый запуск - незавершённые продолжает
+    pipeline.py или POST /run_pipeline.
+    """
+    try:
+        return len(run_pipeline(PipelineTracker(trigger="scheduler"), resume=False, sources=(source,)))
+    except PipelineBusy as e:
+        raise SlotSkipped(str(e))
+
+def _chart() -> int:
+    return _pipeline_job("fetch_popular")
+
+def _search() -> int:
+    return _pipeline_job("search_sounds")
+
+# задача -> (период в секундах, час UTC первого слота или None, функция)
+JOBS = {
+    "stats_refresh": (SCHEDULE_STATS_REFRESH_SECONDS, None, _refresh_tracked_stats),
+    "chart": (SCHEDULE_CHART_SECONDS, None, _chart),
+    "search": (SCHEDULE_SEARCH_SECONDS, None, _search),
+    "nightly": (DAY_SECONDS, SCHEDULE_NIGHTLY_HOUR, nightly),
+}
+
+def _now() -> datetime:
+    return datetime.utcnow()
+
+def _iso(d: datetime) -> str:
+    return d.isoformat()
+
+def _jitter(interval: int) -> timedelta:
+    return timedelta(seconds=random.uniform(0, SCHEDULER_JITTER_FRACTION * interval))
+
+def _first_slot(job: str, now: datetime) -> datetime:
+    interval, at_hour, _ = JOBS[job]
+    if at_hour is None:
+        return now
+    slot = now.replace(hour=at_hour, minute=0, second=0, microsecond=0)
+    return slot if slot > now else slot + timedelta(days=1)
+
+def next_slot(scheduled_at: datetime, interval: int, now: datetime) -> datetime:
+    """Следующий слот сетки после now; пропущенные слоты не накапливаются."""
+    missed = max(0, int((now - scheduled_at).total_seconds() // interval))
+    return scheduled_at + timedelta(seconds=interval * (missed + 1))
+
+def ensure_jobs():
+    """Добавляет в schedule_state задачи, которых там ещё нет."""
+    now = _now()
+    with get_conn() as con:
+        for job, (interval, _, _) in JOBS.items():
+            slot = _first_slot(job, now)
+            con.execute("""
+                INSERT OR IGNORE INTO schedule_state(job, scheduled_at, next_run_at)
+                VALUES(?, ?, ?)""", (job, _iso(slot), _iso(slot + _jitter(interval))))
+        con.commit()
+
+def acquire(job: str, owner: str) -> bool:
+    """Берёт просроченную задачу под аренду. Условие и запись - одним UPDATE, это атомарно."""
+    now = _now()
+    with get_conn() as con:
+        cur = con.execute("""
+            UPDATE schedule_state
+            SET lease_owner = ?, lease_until = ?, last_started_at = ?
+            WHERE job = ? AND next_run_at <= ? AND (lease_until IS NULL OR lease_until < ?)""",
+            (owner, _iso(now + timedelta(seconds=SCHEDULER_LEASE_SECONDS)), _iso(now), job, _iso(now), _iso(now)))
+        con.commit()
+        return cur.rowcount == 1
+
+def renew(job: str, owner: str):
+    with get_conn() as con:
+        con.execute("UPDATE schedule_state SET lease_until = ? WHERE job = ? AND lease_owner = ?",
+                    (_iso(_now() + timedelta(seconds=SCHEDULER_LEASE_SECONDS)), job, owner))
+        con.commit()
+
+def release(job: str, owner: str, status: str, duration_sec: float, error: Optional[str] = None):
+    """Снимает аренду и назначает следующий слот."""
+    interval = JOBS[job][0]
+    now = _now()
+    with get_conn() as con:
+        row = con.execute("SELECT scheduled_at FROM schedule_state WHERE job = ?", (job,)).fetchone()
+        slot = next_slot(datetime.fromisoformat(row["scheduled_at"]), interval, now)
+        con.execute("""
+            UPDATE schedule_state
+            SET lease_owner = NULL, lease_until = NULL, scheduled_at = ?, next_run_at = ?,
+                last_finished_at = ?, last_status = ?, last_duration_sec = ?, last_error = ?
+            WHERE job = ? AND lease_owner = ?""",
+            (_iso(slot), _iso(slot + _jitter(interval)), _iso(now), status, round(duration_sec, 3),
+             error, job, owner))
+        con.commit()
+
+def run_job(job: str, owner: str):
+    fn = JOBS[job][2]
+    print(f"[scheduler] Запуск {job}")
+    t0 = time.monotonic()
+    try:
+        with track_duration(scheduler_job_duration, job):
+            result = fn()
+    except SlotSkipped as e:
+        print(f"[scheduler] {job} пропущен до следующего слота: {e}")
+        release(job, owner, "skipped", time.monotonic() - t0, str(e))
+        return
+    except Exception as e:
+        print(f"[scheduler] {job} завершился ошибкой: {e}")
+        release(job, owner, "failed", time.monotonic() - t0, str(e))
+        return
+    print(f"[scheduler] {job} готово: {result}")
+    release(job, owner, "done", time.monotonic() - t0)
+
+def get_status() -> list[dict]:
+    with get_conn() as con:
+        return [dict(r) for r in con.execute("SELECT * FROM schedule_state ORDER BY next_run_at").fetchall()]
+
+def run_forever(stop_event: Optional[threading.Event] = None):
+    init_db()
+    ensure_jobs()
+    owner = worker_id()
+    running: dict[str, threading.Thread] = {}
+    print(f"[scheduler] Задачи: {', '.join(JOBS)}")
+    while not (stop_event and stop_event.is_set()):
+        for job, thread in list(running.items()):
+            if thread.is_alive():
+                renew(job, owner)
+            else:
+                del running[job]
+        for job in JOBS:
+            if job not in running and acquire(job, owner):
+                running[job] = threading.Thread(target=run_job, args=(job, owner),
+                                                name=f"scheduler-{job}", daemon=True)
+                running[job].start()
+        time.sleep(SCHEDULER_TICK_SECONDS)
+
+def _print_status():
+    init_db()
+    ensure_jobs()
+    print(f"{'job':<15}{'next_run_at':<21}{'last_status':<13}{'last_finished_at':<21}{'sec':>9}  lease_owner")
+    for r in get_status():
+        print(f"{r['job']:<15}{r['next_run_at'][:19]:<21}{r['last_status'] or '-':<13}"
+              f"{(r['last_finished_at'] or '-')[:19]:<21}{r['last_duration_sec'] or 0:>9.2f}  {r['lease_owner'] or '-'}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Планировщик задач парсера")
+    parser.add_argument("--status", action="store_true", help="показать состояние задач и выйти")
+    if parser.parse_args().status:
+        _print_status()
+    else:
+        run_forever()
@@ -1,174 +1,159 @@
 import requests
 from tenacity import retry, wait_exponential, stop_after_attempt
-from config import YOUTUBE_API_KEY, YOUTUBE_SEARCH_URL, YOUTUBE_API_URL, REGION_CODE, SHORTS_MAX_SECONDS, SEARCH_QUERIES, SEARCH_MAX_RESULTS, SEARCH_ORDER
-from db import init_db, upsert_video, insert_stats
+from config import YOUTUBE_API_KEY, YOUTUBE_SEARCH_URL, YOUTUBE_API_URL, REGION_CODE, SHORTS_MAX_SECONDS, SEARCH_QUERIES, SEARCH_MAX_RESULTS, SEARCH_ORDER, SEARCH_FRESHNESS_SECONDS, SEARCH_LOCAL_FRESH_SECONDS
+from db import init_db, get_conn, store_snapshots, write_snapshots, bump_data_version
 from utils import iso_duration_to_seconds, today_str
 from genre_analyzer import analyze_genre, get_primary_genre, get_genre_confidence
+from fetch_shorts import parse_stats
+from metrics import track_youtube_call
+from singleflight import SingleFlight
+from datetime import datetime
+import threading
 import time
 import random
 
+# Общие результаты пользовательских поисков (см. shared_custom_search)
+_search_flight = SingleFlight(ttl=SEARCH_FRESHNESS_SECONDS)
+
 @retry(wait=wait_exponential(multiplier=1, min=2, max=30), stop=stop_after_attempt(5))
 def _search_api_call(params):
-    r = requests.get(YOUTUBE_SEARCH_URL, params=params, timeout=20)
-    r.raise_for_status()
-    return r.json()
+    with track_youtube_call("search"):
+        r = requests.get(YOUTUBE_SEARCH_URL, params=params, timeout=20)
+        r.raise_for_status()
+        return r.json()
 
 @retry(wait=wait_exponential(multiplier=1, min=2, max=30), stop=stop_after_attempt(5))
 def _videos_api_call(params):
-    r = requests.get(YOUTUBE_API_URL, params=params, timeout=20)
-    r.raise_for_status()
-    return r.json()
+    with track_youtube_call("videos"):
+        r = requests.get(YOUTUBE_API_URL, params=params, timeout=20)
+        r.raise_for_status()
+        return r.json()
 
-def search_trending_sounds():
-    """Поиск трендовых звуков по ключевым словам"""
-    init_db()
-    total_found = 0
+def search_query_records(query: str, region: str = REGION_CODE, max_results: int = SEARCH_MAX_RESULTS) -> list[dict]:
+    """Shorts по одному запросу в регионе - записи для db.store_snapshots. Ошибки API пробрасываются."""
+    # Поиск видео по запросу
+    search_params = {
+        "part": "snippet",
+        "q": query,
+        "type": "video",
+        "regionCode": region,
+        "maxResults": max_results,
+        "order": SEARCH_ORDER,
+        "publishedAfter": "2024-01-01T00:00:00Z",  # Только свежие видео
+        "key": YOUTUBE_API_KEY,
+    }
+    search_data = _search_api_call(search_params)
+    video_ids = [item["id"]["videoId"] for item in search_data.get("items", [])]
     
-    for query in SEARCH_QUERIES:
-        print(f"[search_trends] Поиск по запросу: '{query}'")
+    if not video_ids:
+        return []
         
-        # Поиск видео по запросу
-        search_params = {
-            "part": "snippet",
-            "q": query,
-            "type": "video",
-            "regionCode": REGION_CODE,
-            "maxResults": SEARCH_MAX_RESULTS,
-            "order": SEARCH_ORDER,
-            "publishedAfter": "2024-01-01T00:00:00Z",  # Только свежие видео
-            "key": YOUTUBE_API_KEY,
-        }
+    # Получаем детальную информацию о видео
+    videos_params = {
+        "part": "snippet,contentDetails,statistics",
+        "id": ",".join(video_ids),
+        "key": YOUTUBE_API_KEY,
+    }
+    videos_data = _videos_api_call(videos_params)
+    
+    records = []
+    for item in videos_data.get("items", []):
+        dur_sec = iso_duration_to_seconds(item["contentDetails"]["duration"])
+        is_short = dur_sec <= SHORTS_MAX_SECONDS
         
-        try:
-            search_data = _search_api_call(search_params)
-            video_ids = [item["id"]["videoId"] for item in search_data.get("items", [])]
-            
-            if not video_ids:
-                continue
-                
-            # Получаем детальную информацию о видео
-            videos_params = {
-                "part": "snippet,contentDetails,statistics",
-                "id": ",".join(video_ids),
-                "key": YOUTUBE_API_KEY,
-            }
-            
-            videos_data = _videos_api_call(videos_params)
-            items = videos_data.get("items", [])
+        if not is_short:
+            continue
+        
+        # Анализируем жанр
+        title = item["snippet"]["title"]
+        description = item["snippet"].get("description", "")
+        tags = item["snippet"].get("tags", [])
+        
+        genre_scores = analyze_genre(title, description, tags)
             
-            for item in items:
-                vid = item["id"]
-                dur_sec = iso_duration_to_seconds(item["contentDetails"]["duration"])
-                is_short = dur_sec <= SHORTS_MAX_SECONDS
-                
-                if not is_short:
-                    continue
-                
-                # Анализируем жанр
-                title = item["snippet"]["title"]
-                description = item["snippet"].get("description", "")
-                tags = item["snippet"].get("tags", [])
-                
-                genre_scores = analyze_genre(title, description, tags)
-                primary_genre = get_primary_genre(genre_scores)
-                genre_confidence = get_genre_confidence(genre_scores)
-                    
-                meta = {
-                    "video_id": vid,
-                    "title": title,
-                    "channel_title": item["snippet"]["channelTitle"],
-                    "published_at": item["snippet"]["publishedAt"],
-                    "duration_sec": dur_sec,
-                    "is_short": True,
-                    "region": REGION_CODE,
-                    "primary_genre": primary_genre,
-                    "genre_confidence": genre_confidence,
-                }
-                upsert_video(meta)
-                
-                stats = item.get("statistics", {})
-                insert_stats(
-                    video_id=vid,
-                    snapshot_date=today_str(),
-                    view_count=int(stats.get("viewCount", 0)),
-                    like_count=int(stats.get("likeCount", 0)) if "likeCount" in stats else None,
-                    comment_count=int(stats.get("commentCount", 0)) if "commentCount" in stats else None,
-                )
-                total_found += 1
-                
+        meta = {
+            "video_id": item["id"],
+            "title": title,
+            "channel_title": item["snippet"]["channelTitle"],
+            "published_at": item["snippet"]["publishedAt"],
+            "duration_sec": dur_sec,
+            "is_short": True,
+            "region": region,
+            "primary_genre": get_primary_genre(genre_scores),
+            "genre_confidence": get_genre_confidence(genre_scores),
+        }
+        records.append({"meta": meta, "stats": parse_stats(item.get("statistics", {}))})
+    return records
+
+def iter_search_batches(resume: dict = None):
+    """
+    Поиск трендовых звуков по ключевым словам без записи в базу: на каждый запрос отдаёт
+    (записи Shorts для db.store_snapshots, контрольная точка). Ошибка одного запроса не
+    останавливает остальные, но запрос попадает в failed контрольной точки. С resume
+    выполненные запросы пропускаются, а неудавшиеся повторяются.
+    """
+    done = list((resume or {}).get("done", []))
+    failed = []
+    pending = [q for q in SEARCH_QUERIES if q not in done]
+    for i, query in enumerate(pending):
+        if i:
             # Небольшая пауза между запросами
             time.sleep(random.uniform(0.5, 1.5))
-            
+        print(f"[search_trends] Поиск по запросу: '{query}'")
+        try:
+            batch = search_query_records(query)
+            done.append(query)
         except Exception as e:
             print(f"[search_trends] Ошибка при поиске '{query}': {e}")
-            continue
+            batch = []
+            failed.append(query)
+        yield batch, {"done": list(done), "failed": list(failed)}
+
+def search_trending_sounds():
+    """Поиск трендовых звуков по ключевым словам"""
+    init_db()
+    total_found = 0
+    for batch, _ in iter_search_batches():
+        total_found += store_snapshots(batch, today_str())
+        bump_data_version()
     
     print(f"[search_trends] Найдено {total_found} трендовых Shorts по поисковым запросам")
     return total_found
 
+def _run_custom_search(query, max_results):
+    """
+    Поиск по запросу с записью в базу. Ошибки API пробрасываются. Записи пишутся пачкой через
+    write_snapshots, как в пайплайне: найденный раньше жанр не затирается.
+    """
+    records = search_query_records(query, REGION_CODE, max_results)
+    with get_conn() as con:
+        write_snapshots(con, records, today_str())
+        _record_search(con, query, max_results, [r["meta"]["video_id"] for r in records])
+        con.commit()
+    bump_data_version()
+    return len(records)
+
+def _record_search(con, query, max_results, video_ids):
+    """Запоминает, что вернул запрос, и время обновления - для локального поиска (в транзакции вызывающего)."""
+    key = normalize_query(query)
+    con.execute("DELETE FROM search_results WHERE query_key = ?", (key,))
+    con.executemany(
+        "INSERT OR IGNORE INTO search_results(query_key, video_id, rank) VALUES(?,?,?)",
+        [(key, vid, rank) for rank, vid in enumerate(video_ids)]
+    )
+    con.execute("""
+        INSERT OR REPLACE INTO search_freshness(query_key, query, max_results, refreshed_at, found)
+        VALUES(?,?,?,?,?)
+    """, (key, query, max_results, datetime.utcnow().isoformat(), len(video_ids)))
+
 def search_by_custom_query(query, max_results=50):
     """Поиск по пользовательскому запросу"""
     init_db()
-    found = 0
     
     print(f"[search_trends] Пользовательский поиск: '{query}'")
     
-    search_params = {
-        "part": "snippet",
-        "q": query,
-        "type": "video",
-        "regionCode": REGION_CODE,
-        "maxResults": max_results,
-        "order": SEARCH_ORDER,
-        "publishedAfter": "2024-01-01T00:00:00Z",
-        "key": YOUTUBE_API_KEY,
-    }
-    
     try:
-        search_data = _search_api_call(search_params)
-        video_ids = [item["id"]["videoId"] for item in search_data.get("items", [])]
-        
-        if not video_ids:
-            return 0
-            
-        videos_params = {
-            "part": "snippet,contentDetails,statistics",
-            "id": ",".join(video_ids),
-            "key": YOUTUBE_API_KEY,
-        }
-        
-        videos_data = _videos_api_call(videos_params)
-        items = videos_data.get("items", [])
-        
-        for item in items:
-            vid = item["id"]
-            dur_sec = iso_duration_to_seconds(item["contentDetails"]["duration"])
-            is_short = dur_sec <= SHORTS_MAX_SECONDS
-            
-            if not is_short:
-                continue
-                
-            meta = {
-                "video_id": vid,
-                "title": item["snippet"]["title"],
-                "channel_title": item["snippet"]["channelTitle"],
-                "published_at": item["snippet"]["publishedAt"],
-                "duration_sec": dur_sec,
-                "is_short": True,
-                "region": REGION_CODE,
-            }
-            upsert_video(meta)
-            
-            stats = item.get("statistics", {})
-            insert_stats(
-                video_id=vid,
-                snapshot_date=today_str(),
-                view_count=int(stats.get("viewCount", 0)),
-                like_count=int(stats.get("likeCount", 0)) if "likeCount" in stats else None,
-                comment_count=int(stats.get("commentCount", 0)) if "commentCount" in stats else None,
-            )
-            found += 1
-            
+        found = _run_custom_search(query, max_results)
     except Exception as e:
         print(f"[search_trends] Ошибка при пользовательском поиске: {e}")
         return 0
@@ -176,5 +161,48 @@ def search_by_custom_query(query, max_results=50):
     print(f"[search_trends] Найдено {found} Shorts по запросу '{query}'")
     return found
 
+def normalize_query(query: str) -> str:
+    return " ".join(query.lower().split())
+
+def shared_custom_search(query, max_results=50):
+    """
+    Пользовательский поиск с объединением одинаковых запросов: одновременные вызовы
+    с тем же запросом и max_results ждут один запрос к YouTube API, а в течение
+    SEARCH_FRESHNESS_SECONDS после него повторно используют результат.
+    """
+    key = (normalize_query(query), int(max_results))
+    try:
+        return _search_flight.do(key, lambda: _shared_search_leader(query, int(max_results)))
+    except Exception as e:
+        print(f"[search_trends] Ошибка при пользовательском поиске: {e}")
+        return 0
+
+def search_freshness(query, max_results):
+    """
+    Состояние локальных результатов запроса: "fresh", "stale" или None (запрос ещё не выполнялся).
+    Запрос с большим max_results, чем при последнем обновлении, считается устаревшим.
+    """
+    with get_conn() as con:
+        row = con.execute("SELECT max_results, refreshed_at FROM search_freshness WHERE query_key = ?",
+                          (normalize_query(query),)).fetchone()
+    if row is None:
+        return None
+    age = (datetime.utcnow() - datetime.fromisoformat(row["refreshed_at"])).total_seconds()
+    if age < SEARCH_LOCAL_FRESH_SECONDS and row["max_results"] >= int(max_results):
+        return "fresh"
+    return "stale"
+
+def refresh_in_background(query, max_results=50):
+    """Обновляет результаты запроса из YouTube в фоновом потоке (дубли объединяются)."""
+    threading.Thread(target=shared_custom_search, args=(query, max_results),
+                     name="search-refresh", daemon=True).start()
+
+def _shared_search_leader(query, max_results):
+    init_db()
+    print(f"[search_trends] Пользовательский поиск: '{query}'")
+    found = _run_custom_search(query, max_results)
+    print(f"[search_trends] Найдено {found} Shorts по запросу '{query}'")
+    return found
+
 if __name__ == "__main__":
     search_trending_sounds()
@@ -0,0 +1,236 @@
+"""
+Распределённый сбор данных несколькими процессами и хостами с общей базой.
+
+Сбор с ключом batch делится на шарды (work_shards): поиск - пара (запрос, регион), чарт -
+регион, обновление статистики - пачка video_id. План идемпотентен (UNIQUE по batch, kind,
+payload), поэтому его может создать любой воркер; пачки статистики создаёт только первый. Шард забирается под аренду, которую воркер
+продлевает heartbeat-ом; если воркер умер, аренда истекает и шард достаётся другому.
+Результат шарда пишется в базу в одной транзакции с отметкой done и только если аренда всё ещё
+принадлежит воркеру - повторно выполненный шард не даёт дублей статистики.
+
+    python shards.py                   # спланировать сбор текущего часа и обрабатывать шарды
+    python shards.py --batch 2024-05-01 --kinds search,chart
+    python shards.py --status --batch 2024-05-01
+"""
+
+import argparse
+import json
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Optional
+
+from config import (SEARCH_QUERIES, SHARD_HEARTBEAT_SECONDS, SHARD_LEASE_SECONDS, SHARD_MAX_ATTEMPTS,
+                    SHARD_REGIONS, SHARD_STATS_SIZE, STATS_REFRESH_DAYS, STATS_REFRESH_MAX_VIDEOS)
+from db import bump_data_version, get_conn, init_db, tracked_video_ids, write_snapshots, write_stats
+from download_queue import worker_id
+from fetch_shorts import iter_popular_batches, iter_stats_batches
+from search_trends import search_query_records
+from utils import today_str
+
+KINDS = ("search", "chart", "stats")
+
+class LeaseLost(Exception):
+    """Аренда шарда истекла и его забрал другой воркер - результат не записан."""
+
+def _now() -> datetime:
+    return datetime.utcnow()
+
+def _iso(d: datetime) -> str:
+    return d.isoformat()
+
+def default_batch() -> str:
+    return _now().strftime("%Y-%m-%dT%H")
+
+def plan_shards(batch: str, kinds: tuple = KINDS) -> int:
+    """Создаёт шарды сбора batch (существующие не трогает). Возвращает число новых.
+
+    Пачки статистики планируются один раз на batch: список отслеживаемых видео меняется по мере
+    того, как шарды чарта и поиска обновляют last_seen, и поздний воркер нарезал бы другие,
+    пересекающиеся пачки.
+    """
+    payloads = []
+    if "search" in kinds:
+        payloads += [("search", {"query": q, "region": r}) for q in SEARCH_QUERIES for r in SHARD_REGIONS]
+    if "chart" in kinds:
+        payloads += [("chart", {"region": r}) for r in SHARD_REGIONS]
+    now = _iso(_now())
+    con = get_conn()
+    con.isolation_level = None
+    try:
+        con.execute("BEGIN IMMEDIATE")
+        if "stats" in kinds and not con.execute(
+                "SELECT 1 FROM work_shards WHERE batch = ? AND kind = 'stats' LIMIT 1", (batch,)).fetchone():
+            ids = sorted(tracked_video_ids(STATS_REFRESH_DAYS, STATS_REFRESH_MAX_VIDEOS))
+            payloads += [("stats", {"video_ids": ids[i:i + SHARD_STATS_SIZE]})
+                         for i in range(0, len(ids), SHARD_STATS_SIZE)]
+        before = con.total_changes
+        con.executemany("""
+            INSERT OR IGNORE INTO work_shards(batch, kind, payload, state, attempts, created_at, updated_at)
+            VALUES(?, ?, ?, 'queued', 0, ?, ?)""",
+            [(batch, kind, json.dumps(p, sort_keys=True), now, now) for kind, p in payloads])
+        created = con.total_changes - before
+        con.execute("COMMIT")
+        return created
+    except Exception:
+        if con.in_transaction:
+            con.execute("ROLLBACK")
+        raise
+    finally:
+        con.close()
+
+def claim_shard(batch: str, owner: str) -> Optional[dict]:
+    """Атомарно забирает свободный шард или шард с истёкшей арендой.
+
+    Шарды с истёкшей арендой, у которых попытки уже кончились (процесс падал на них
+    SHARD_MAX_ATTEMPTS раз), переводятся в failed и больше не выдаются.
+    """
+    now = _now()
+    con = get_conn()
+    con.isolation_level = None
+    try:
+        con.execute("BEGIN IMMEDIATE")
+        con.execute("""
+            UPDATE work_shards
+            SET state = 'failed', lease_until = NULL, updated_at = ?,
+                error = COALESCE(error, 'аренда истекла: процесс не завершил шард')
+            WHERE batch = ? AND state = 'running' AND lease_until < ? AND attempts >= ?
+        """, (_iso(now), batch, _iso(now), SHARD_MAX_ATTEMPTS))
+        row = con.execute("""
+            SELECT * FROM work_shards
+            WHERE batch = ? AND (state = 'queued' OR (state = 'running' AND lease_until < ? AND attempts < ?))
+            ORDER BY id
+            LIMIT 1
+        """, (batch, _iso(now), SHARD_MAX_ATTEMPTS)).fetchone()
+        if row is None:
+            con.execute("COMMIT")
+            return None
+        lease_until = _iso(now + timedelta(seconds=SHARD_LEASE_SECONDS))
+        con.execute("""
+            UPDATE work_shards
+            SET state = 'running', owner = ?, attempts = attempts + 1, lease_until = ?,
+                heartbeat_at = ?, updated_at = ?
+            WHERE id = ?
+        """, (owner, lease_until, _iso(now), _iso(now), row["id"]))
+        con.execute("COMMIT")
+        shard = dict(row)
+        shard.update(state="running", owner=owner, attempts=row["attempts"] + 1, lease_until=lease_until)
+        return shard
+    except Exception:
+        if con.in_transaction:
+            con.execute("ROLLBACK")
+        raise
+    finally:
+        con.close()
+
+def heartbeat(shard_id: int, owner: str) -> bool:
+    now = _now()
+    with get_conn() as con:
+        cur = con.execute("""
+            UPDATE work_shards SET lease_until = ?, heartbeat_at = ?
+            WHERE id = ? AND owner = ? AND state = 'running'
+        """, (_iso(now + timedelta(seconds=SHARD_LEASE_SECONDS)), _iso(now), shard_id, owner))
+        con.commit()
+        return cur.rowcount == 1
+
+def _fetch(shard: dict) -> tuple[list[dict], bool]:
+    """Записи шарда и признак «только статистика»."""
+    payload = json.loads(shard["payload"])
+    if shard["kind"] == "search":
+        return search_query_records(payload["query"], payload["region"]), False
+    if shard["kind"] == "chart":
+        return [r for batch, _ in iter_popular_batches(payload["region"]) for r in batch], False
+    return [r for batch in iter_stats_batches(payload["video_ids"]) for r in batch], True
+
+def complete_shard(shard: dict, owner: str, records: list[dict], stats_only: bool):
+    """Пишет записи и отмечает шард done одной транзакцией, если аренда ещё у owner."""
+    con = get_conn()
+    con.isolation_level = None
+    try:
+        con.execute("BEGIN IMMEDIATE")
+        cur = con.execute("""
+            UPDATE work_shards
+            SET state = 'done', lease_until = NULL, error = NULL, result_count = ?, updated_at = ?
+            WHERE id = ? AND owner = ? AND state = 'running'
+        """, (len(records), _iso(_now()), shard["id"], owner))
+        if cur.rowcount != 1:
+            con.execute("ROLLBACK")
+            raise LeaseLost(f"шард {shard['id']}")
+        if stats_only:
+            write_stats(con, records, today_str())
+        else:
+            write_snapshots(con, records, today_str())
+        con.execute("COMMIT")
+    except Exception:
+        if con.in_transaction:
+            con.execute("ROLLBACK")
+        raise
+    finally:
+        con.close()
+    bump_data_version()
+
+def fail_shard(shard: dict, owner: str, error: str):
+    state = "failed" if shard["attempts"] >= SHARD_MAX_ATTEMPTS else "queued"
+    with get_conn() as con:
+        con.execute("""
+            UPDATE work_shards
+            SET state = ?, lease_until = NULL, error = ?, updated_at = ?
+            WHERE id = ? AND owner = ?
+        """, (state, error, _iso(_now()), shard["id"], owner))
+        con.commit()
+
+def process_shard(shard: dict, owner: str) -> int:
+    stop = threading.Event()
+
+    def beat():
+        while not stop.wait(SHARD_HEARTBEAT_SECONDS):
+            if not heartbeat(shard["id"], owner):
+                return
+
+    threading.Thread(target=beat, name=f"shard-heartbeat-{shard['id']}", daemon=True).start()
+    try:
+        records, stats_only = _fetch(shard)
+        complete_shard(shard, owner, records, stats_only)
+        return len(records)
+    finally:
+        stop.set()
+
+def run_worker(batch: str, owner: Optional[str] = None) -> int:
+    """Обрабатывает шарды batch, пока они есть. Возвращает число записанных записей."""
+    owner = owner or worker_id()
+    total = 0
+    while True:
+        shard = claim_shard(batch, owner)
+        if shard is None:
+            break
+        try:
+            total += process_shard(shard, owner)
+            print(f"[shards] OK {shard['kind']} {shard['payload']}")
+        except LeaseLost as e:
+            print(f"[shards] Аренда потеряна, результат отброшен: {e}")
+        except Exception as e:
+            print(f"[shards] FAIL {shard['kind']} {shard['payload']} (попытка {shard['attempts']}): {e}")
+            fail_shard(shard, owner, str(e))
+    return total
+
+def get_status(batch: str) -> dict:
+    with get_conn() as con:
+        rows = con.execute("""
+            SELECT kind, state, COUNT(*) AS n, COALESCE(SUM(result_count), 0) AS records
+            FROM work_shards WHERE batch = ? GROUP BY kind, state
+        """, (batch,)).fetchall()
+    return {f"{r['kind']}:{r['state']}": {"shards": r["n"], "records": r["records"]} for r in rows}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Распределённый сбор данных")
+    parser.add_argument("--batch", default=None, help="ключ сбора (по умолчанию - текущий час UTC)")
+    parser.add_argument("--kinds", default=",".join(KINDS), help="search,chart,stats")
+    parser.add_argument("--status", action="store_true", help="показать состояние шардов и выйти")
+    args = parser.parse_args()
+    init_db()
+    batch = args.batch or default_batch()
+    if not args.status:
+        created = plan_shards(batch, tuple(k.strip() for k in args.kinds.split(",")))
+        print(f"[shards] Сбор {batch}: новых шардов {created}")
+        print(f"[shards] Записано {run_worker(batch)} записей")
+    print(json.dumps(get_status(batch), ensure_ascii=False, indent=2))
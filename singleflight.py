@@ -0,0 +1,60 @@
+"""
+Объединение одинаковых одновременных вызовов: пока выполняется вызов по ключу,
+остальные вызывающие с тем же ключом ждут его результат вместо повторной работы.
+С ttl > 0 успешный результат ещё ttl секунд отдаётся последующим вызовам без повторного вызова.
+"""
+
+import threading
+import time
+from typing import Any, Callable, Hashable
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class SingleFlight:
+    def __init__(self, ttl: float = 0.0):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._calls: dict[Hashable, _Call] = {}
+        self._recent: dict[Hashable, tuple[float, Any]] = {}
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        with self._lock:
+            if self.ttl > 0:
+                recent = self._recent.get(key)
+                if recent is not None:
+                    if time.monotonic() - recent[0] < self.ttl:
+                        return recent[1]
+                    del self._recent[key]
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+                if self.ttl > 0 and call.error is None:
+                    self._recent[key] = (time.monotonic(), call.result)
+                    self._prune()
+            call.done.set()
+        return call.result
+
+    def _prune(self):
+        now = time.monotonic()
+        for k in [k for k, (at, _) in self._recent.items() if now - at >= self.ttl]:
+            del self._recent[k]
@@ -0,0 +1,153 @@
+"""
+Проксирование аудио googlevideo для /api/stream/<video_id>.
+
+Запрос клиента (в том числе с заголовком Range) разбивается на последовательные
+запросы к googlevideo по STREAM_CHUNK_BYTES, каждый кусок сразу отдаётся клиенту -
+файл целиком в памяти не держится. Ссылка берётся из url_cache; если googlevideo
+отвечает 403/404/410 (ссылка истекла или привязана к другому IP), она разрешается заново.
+"""
+
+import re
+from typing import Iterator, Optional
+
+import requests
+
+from config import STREAM_CHUNK_BYTES
+from url_cache import invalidate, resolve
+
+EXPIRED_STATUSES = (403, 404, 410)
+READ_SIZE = 64 * 1024
+
+_session = requests.Session()
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+def parse_range(header: Optional[str]) -> tuple[int, Optional[int]]:
+    """Разбирает 'bytes=start-end' (поддерживается один диапазон). Без заголовка - весь файл."""
+    if not header:
+        return 0, None
+    m = re.fullmatch(r"\s*bytes=(\d*)-(\d*)\s*", header)
+    if not m or (not m.group(1) and not m.group(2)):
+        raise RangeNotSatisfiable(header)
+    if not m.group(1):
+        # суффикс: последние N байт, размер файла узнаем из первого ответа
+        return -int(m.group(2)), None
+    start = int(m.group(1))
+    end = int(m.group(2)) if m.group(2) else None
+    if end is not None and end < start:
+        raise RangeNotSatisfiable(header)
+    return start, end
+
+def _get(video_id: str, start: int, end: int) -> requests.Response:
+    for attempt in range(2):
+        url = resolve(video_id)["url"]
+        r = _session.get(url, headers={"Range": f"bytes={start}-{end}"}, stream=True, timeout=20)
+        if r.status_code in EXPIRED_STATUSES and attempt == 0:
+            r.close()
+            invalidate(video_id)
+            continue
+        if r.status_code == 416:
+            r.close()
+            raise RangeNotSatisfiable(f"bytes={start}-{end}")
+        r.raise_for_status()
+        return r
+    raise requests.HTTPError(f"googlevideo вернул {r.status_code}")
+
+def _total_size(r: requests.Response) -> Optional[int]:
+    m = re.search(r"/(\d+)$", r.headers.get("Content-Range", ""))
+    if m:
+        return int(m.group(1))
+    length = r.headers.get("Content-Length")
+    return int(length) if length and r.status_code == 200 else None
+
+def _probe_total(video_id: str) -> Optional[int]:
+    """Размер файла по HEAD, если googlevideo не сообщил его в ответе на Range."""
+    try:
+        r = _session.head(resolve(video_id)["url"], allow_redirects=True, timeout=10)
+    except requests.RequestException:
+        return None
+    length = r.headers.get("Content-Length")
+    return int(length) if r.status_code == 200 and length and length.isdigit() else None
+
+def open_stream(video_id: str, range_header: Optional[str]) -> tuple[int, dict, Iterator[bytes]]:
+    """Возвращает (статус, заголовки, генератор байтов) для ответа клиенту."""
+    start, end = parse_range(range_header)
+    probe_start = max(start, 0)
+    first = _get(video_id, probe_start, probe_start + STREAM_CHUNK_BYTES - 1)
+    total = _total_size(first)
+
+    if start < 0:
+        if total is None:
+            first.close()
+            raise RangeNotSatisfiable(range_header)
+        # Range: bytes=-N - нужен конец файла, первый кусок не подходит
+        start = max(0, total + start)
+        first.close()
+        first = _get(video_id, start, start + STREAM_CHUNK_BYTES - 1)
+    if total is None and end is None and start > 0:
+        total = _probe_total(video_id)
+        if total is None:
+            # без размера не записать Content-Range для bytes=N-: отдаём весь файл ответом 200
+            first.close()
+            start = 0
+            first = _get(video_id, 0, STREAM_CHUNK_BYTES - 1)
+    if total is not None:
+        if start >= total:
+            first.close()
+            raise RangeNotSatisfiable(range_header)
+        end = total - 1 if end is None else min(end, total - 1)
+
+    headers = {
+        "Accept-Ranges": "bytes",
+        "Content-Type": first.headers.get("Content-Type", "application/octet-stream"),
+        "Cache-Control": "no-store",
+    }
+    if end is not None:
+        headers["Content-Length"] = str(end - start + 1)
+    status = 200
+    if range_header and end is not None:
+        status = 206
+        headers["Content-Range"] = f"bytes {start}-{end}/{total if total is not None else '*'}"
+
+    def generate():
+        r = first
+        pos = start
+        requested = STREAM_CHUNK_BYTES
+        try:
+            while True:
+                # если googlevideo проигнорировал Range и прислал файл с начала, пропускаем уже отданное
+                skip = pos if r.status_code == 200 else 0
+                got = 0
+                for chunk in r.iter_content(READ_SIZE):
+                    got += len(chunk)
+                    if skip:
+                        dropped = min(skip, len(chunk))
+                        chunk, skip = chunk[dropped:], skip - dropped
+                        if not chunk:
+                            continue
+                    if end is not None and pos + len(chunk) > end + 1:
+                        chunk = chunk[:end + 1 - pos]
+                    if not chunk:
+                        break
+                    pos += len(chunk)
+                    yield chunk
+                r.close()
+                if end is not None and pos > end:
+                    return
+                # размер неизвестен: файл кончился, если кусок пришёл короче запрошенного
+                # или googlevideo отдал весь файл ответом 200
+                if end is None and (got < requested or r.status_code == 200):
+                    return
+                chunk_end = pos + STREAM_CHUNK_BYTES - 1 if end is None else min(end, pos + STREAM_CHUNK_BYTES - 1)
+                requested = chunk_end - pos + 1
+                try:
+                    r = _get(video_id, pos, chunk_end)
+                except RangeNotSatisfiable:
+                    if end is None:
+                        return  # 416 - позиция за концом файла
+                    raise
+        finally:
+            r.close()
+
+    return status, headers, generate()
@@ -0,0 +1,44 @@
+"""
+Общие фикстуры: у каждого теста своя база SQLite во временном каталоге, YouTube API заменяет
+fake_youtube. Настройки читаются при импорте config, поэтому окружение задаётся до импорта модулей.
+"""
+
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+_tmp = tempfile.mkdtemp(prefix="shorts-tests-")
+os.environ.update(DB_PATH=os.path.join(_tmp, "shorts.db"), MEDIA_DIR=os.path.join(_tmp, "media"),
+                  YOUTUBE_API_KEY="test")
+
+import pytest
+
+import db
+import fake_youtube
+import fetch_shorts
+import pipeline
+import search_trends
+
+@pytest.fixture
+def db_path(tmp_path, monkeypatch):
+    """Пустая база с актуальной схемой; блокировка запуска пайплайна - рядом с ней."""
+    path = str(tmp_path / "shorts.db")
+    monkeypatch.setattr(db, "DB_PATH", path)
+    monkeypatch.setattr(pipeline, "LOCK_PATH", path + ".pipeline.lock")
+    db.init_db()
+    return path
+
+@pytest.fixture
+def youtube(monkeypatch):
+    """Локальный fake_youtube; сбор ходит в него, паузы между поисковыми запросами выключены."""
+    server = fake_youtube.start(fake_youtube.FakeYouTube(quota=0))
+    env = fake_youtube.api_env(server)
+    monkeypatch.setattr(fetch_shorts, "YOUTUBE_API_URL", env["YOUTUBE_API_URL"])
+    monkeypatch.setattr(search_trends, "YOUTUBE_API_URL", env["YOUTUBE_API_URL"])
+    monkeypatch.setattr(search_trends, "YOUTUBE_SEARCH_URL", env["YOUTUBE_SEARCH_URL"])
+    monkeypatch.setattr(search_trends.random, "uniform", lambda a, b: 0)
+    yield server.fake
+    server.shutdown()
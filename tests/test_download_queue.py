@@ -0,0 +1,74 @@
+from datetime import datetime, timedelta
+
+import download_queue
+from config import DOWNLOAD_LEASE_SECONDS, DOWNLOAD_MAX_ATTEMPTS
+
+def _at(monkeypatch, moment: datetime):
+    monkeypatch.setattr(download_queue, "_now", lambda: moment)
+
+def test_claim_takes_job_under_lease(db_path):
+    job_id = download_queue.enqueue_downloads(["vid1"])["vid1"]
+    job = download_queue.claim_job("w1")
+    assert job["id"] == job_id
+    assert job["attempts"] == 1 and job["lease_owner"] == "w1"
+    # пока аренда действует, задачу никто другой не получит
+    assert download_queue.claim_job("w2") is None
+
+def test_expired_lease_is_reclaimed_and_old_owner_loses_it(db_path, monkeypatch):
+    t0 = datetime.utcnow()
+    _at(monkeypatch, t0)
+    job_id = download_queue.enqueue_downloads(["vid1"])["vid1"]
+    download_queue.claim_job("w1")
+
+    _at(monkeypatch, t0 + timedelta(seconds=DOWNLOAD_LEASE_SECONDS + 1))
+    job = download_queue.claim_job("w2")
+    assert job["id"] == job_id and job["attempts"] == 2 and job["lease_owner"] == "w2"
+
+    # опоздавший воркер не продлит аренду и не перепишет результат нового
+    assert not download_queue.renew_lease(job_id, "w1")
+    assert not download_queue.complete_job(job_id, "w1")
+    assert not download_queue.fail_job(job_id, "w1", 1, "late")
+    assert download_queue.complete_job(job_id, "w2")
+    assert download_queue.get_job(job_id)["state"] == "done"
+
+def test_heartbeat_keeps_lease(db_path, monkeypatch):
+    t0 = datetime.utcnow()
+    _at(monkeypatch, t0)
+    download_queue.enqueue_downloads(["vid1"])
+    job = download_queue.claim_job("w1")
+
+    _at(monkeypatch, t0 + timedelta(seconds=DOWNLOAD_LEASE_SECONDS - 1))
+    assert download_queue.renew_lease(job["id"], "w1")
+    _at(monkeypatch, t0 + timedelta(seconds=DOWNLOAD_LEASE_SECONDS + 1))
+    assert download_queue.claim_job("w2") is None
+
+def test_expired_lease_after_last_attempt_fails_job(db_path, monkeypatch):
+    t = datetime.utcnow()
+    _at(monkeypatch, t)
+    job_id = download_queue.enqueue_downloads(["vid1"])["vid1"]
+    # воркер падает на задаче каждый раз, не успевая вызвать fail_job
+    for attempt in range(1, DOWNLOAD_MAX_ATTEMPTS + 1):
+        _at(monkeypatch, t)
+        job = download_queue.claim_job(f"w{attempt}")
+        assert job["attempts"] == attempt
+        t += timedelta(seconds=DOWNLOAD_LEASE_SECONDS + 1)
+
+    _at(monkeypatch, t)
+    assert download_queue.claim_job("w-last") is None
+    job = download_queue.get_job(job_id)
+    assert job["state"] == "failed" and job["lease_owner"] is None
+    assert "аренда истекла" in job["error"]
+    assert download_queue.next_attempt_at() is None
+
+def test_failed_attempt_is_retried_after_backoff(db_path, monkeypatch):
+    t0 = datetime.utcnow()
+    _at(monkeypatch, t0)
+    job_id = download_queue.enqueue_downloads(["vid1"])["vid1"]
+    job = download_queue.claim_job("w1")
+    assert download_queue.fail_job(job_id, "w1", job["attempts"], "network")
+
+    assert download_queue.claim_job("w1") is None
+    retry_at = download_queue.next_attempt_at()
+    assert retry_at > t0
+    _at(monkeypatch, retry_at)
+    assert download_queue.claim_job("w1")["attempts"] == 2
@@ -0,0 +1,93 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+import ledger
+import pipeline
+import search_trends
+from config import SEARCH_QUERIES
+from db import get_conn
+
+@pytest.fixture
+def searches(youtube, monkeypatch):
+    """Выполненные поисковые запросы; запросы из failing падают с ошибкой API."""
+    calls, failing = [], set()
+    search = search_trends.search_query_records
+
+    def flaky(query, *args, **kwargs):
+        calls.append(query)
+        if query in failing:
+            raise RuntimeError("quotaExceeded")
+        return search(query, *args, **kwargs)
+
+    monkeypatch.setattr(search_trends, "search_query_records", flaky)
+    return calls, failing
+
+def _stages(run_id: str) -> dict:
+    return {s["stage"]: s["status"] for s in ledger.get_run(run_id)["stages"]}
+
+def test_partial_run_is_not_resumed(db_path, searches):
+    calls, failing = searches
+    failing.add(SEARCH_QUERIES[0])
+    pipeline.run_pipeline()
+    partial = ledger.recent_runs(1)[0]
+    assert partial["status"] == "partial" and SEARCH_QUERIES[0] in partial["error"]
+    assert ledger.find_resumable(6) is None
+
+    calls.clear()
+    failing.clear()
+    pipeline.run_pipeline()
+    run = ledger.recent_runs(1)[0]
+    # новый запуск: чарт собирается заново, из поиска повторяется только неудавшийся запрос
+    assert run["run_id"] != partial["run_id"] and run["status"] == "done"
+    assert _stages(run["run_id"]) == {"fetch_popular": "done", "search_sounds": "done", "rank": "done"}
+    assert calls == [SEARCH_QUERIES[0]]
+
+    calls.clear()
+    pipeline.run_pipeline()
+    assert calls == SEARCH_QUERIES
+
+def test_fresh_run_does_not_carry_over(db_path, searches):
+    calls, failing = searches
+    failing.add(SEARCH_QUERIES[0])
+    pipeline.run_pipeline()
+    calls.clear()
+    failing.clear()
+    pipeline.run_pipeline(resume=False)
+    assert calls == SEARCH_QUERIES
+
+def _interrupted_run(run_id: str, finished_ago: timedelta):
+    """Прерванный запуск, в котором чарт уже выполнен."""
+    finished = (datetime.utcnow() - finished_ago).isoformat()
+    ledger.start_run(run_id, "cli")
+    ledger.record_span(run_id, {"name": "fetch_popular", "status": "done", "started_at": finished,
+                                "finished_at": finished, "duration_sec": 1.0, "count": 7, "error": None})
+    with get_conn() as con:
+        con.execute("UPDATE pipeline_runs SET started_at = ? WHERE run_id = ?", (finished, run_id))
+
+def test_interrupted_run_is_resumed_without_done_stages(db_path, searches):
+    calls, _ = searches
+    _interrupted_run("crashed", timedelta(minutes=1))
+    assert ledger.find_resumable(6) == "crashed"
+    pipeline.run_pipeline()
+    run = ledger.get_run("crashed")
+    assert run["status"] == "done"
+    fetch = next(s for s in run["stages"] if s["stage"] == "fetch_popular")
+    assert fetch["item_count"] == 7  # выполненный этап не повторялся
+    assert calls == SEARCH_QUERIES
+
+def test_stale_done_stage_is_rerun_on_resume(db_path, searches):
+    _interrupted_run("crashed", timedelta(hours=1))
+    pipeline.run_pipeline()
+    run = ledger.get_run("crashed")
+    assert run["status"] == "done"
+    fetch = next(s for s in run["stages"] if s["stage"] == "fetch_popular")
+    assert fetch["item_count"] > 7
+
+def test_busy_lock(db_path):
+    lock = pipeline.acquire_run_lock()
+    try:
+        with pytest.raises(pipeline.PipelineBusy):
+            pipeline.run_pipeline()
+    finally:
+        pipeline.release_run_lock(lock)
@@ -0,0 +1,34 @@
+import pipeline
+import scheduler
+from db import get_conn
+
+def _due(job: str):
+    with get_conn() as con:
+        con.execute("UPDATE schedule_state SET next_run_at = '2000-01-01T00:00:00' WHERE job = ?", (job,))
+
+def test_chart_runs_through_pipeline(db_path, youtube):
+    scheduler.ensure_jobs()
+    _due("chart")
+    assert scheduler.acquire("chart", "s1")
+    scheduler.run_job("chart", "s1")
+    state = next(s for s in scheduler.get_status() if s["job"] == "chart")
+    assert state["last_status"] == "done"
+    with get_conn() as con:
+        run = con.execute("SELECT * FROM pipeline_runs").fetchone()
+        stages = {r["stage"] for r in con.execute("SELECT stage FROM pipeline_stage_spans")}
+    assert run["trigger"] == "scheduler" and run["status"] == "done"
+    assert stages == {"fetch_popular", "rank"}
+
+def test_slot_is_skipped_while_pipeline_runs(db_path):
+    scheduler.ensure_jobs()
+    _due("search")
+    lock = pipeline.acquire_run_lock()
+    try:
+        assert scheduler.acquire("search", "s1")
+        scheduler.run_job("search", "s1")
+    finally:
+        pipeline.release_run_lock(lock)
+    state = next(s for s in scheduler.get_status() if s["job"] == "search")
+    assert state["last_status"] == "skipped" and state["lease_owner"] is None
+    with get_conn() as con:
+        assert con.execute("SELECT COUNT(*) FROM pipeline_runs").fetchone()[0] == 0
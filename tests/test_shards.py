@@ -0,0 +1,52 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+import shards
+from config import SHARD_LEASE_SECONDS, SHARD_MAX_ATTEMPTS
+
+BATCH = "2024-05-01T09"
+
+def _at(monkeypatch, moment: datetime):
+    monkeypatch.setattr(shards, "_now", lambda: moment)
+
+@pytest.fixture
+def one_shard(db_path):
+    assert shards.plan_shards(BATCH, kinds=("chart",)) >= 1
+    # остальные шарды (если регионов несколько) не мешают проверке одного
+    with shards.get_conn() as con:
+        con.execute("DELETE FROM work_shards WHERE id != (SELECT MIN(id) FROM work_shards)")
+    return BATCH
+
+def test_plan_is_idempotent(one_shard):
+    assert shards.plan_shards(BATCH, kinds=("chart",)) == 0
+
+def test_expired_shard_is_reclaimed(one_shard, monkeypatch):
+    t0 = datetime.utcnow()
+    _at(monkeypatch, t0)
+    first = shards.claim_shard(BATCH, "w1")
+    assert first["attempts"] == 1
+    assert shards.claim_shard(BATCH, "w2") is None
+
+    _at(monkeypatch, t0 + timedelta(seconds=SHARD_LEASE_SECONDS + 1))
+    second = shards.claim_shard(BATCH, "w2")
+    assert second["id"] == first["id"] and second["attempts"] == 2 and second["owner"] == "w2"
+    assert not shards.heartbeat(first["id"], "w1")
+    with pytest.raises(shards.LeaseLost):
+        shards.complete_shard(first, "w1", [], stats_only=False)
+
+def test_expired_shard_after_last_attempt_fails(one_shard, monkeypatch):
+    t = datetime.utcnow()
+    for attempt in range(1, SHARD_MAX_ATTEMPTS + 1):
+        _at(monkeypatch, t)
+        assert shards.claim_shard(BATCH, f"w{attempt}")["attempts"] == attempt
+        t += timedelta(seconds=SHARD_LEASE_SECONDS + 1)
+
+    _at(monkeypatch, t)
+    assert shards.claim_shard(BATCH, "w-last") is None
+    assert shards.get_status(BATCH) == {"chart:failed": {"shards": 1, "records": 0}}
+
+def test_worker_processes_shards(db_path, youtube):
+    shards.plan_shards(BATCH, kinds=("chart",))
+    assert shards.run_worker(BATCH, "w1") > 0
+    assert all(key.endswith(":done") for key in shards.get_status(BATCH))
@@ -0,0 +1,103 @@
+import pytest
+
+import stream_proxy
+
+DATA = bytes(range(256)) * 4  # 1024 байта
+
+class FakeResponse:
+    def __init__(self, status_code: int, body: bytes, headers: dict):
+        self.status_code, self.body, self.headers = status_code, body, headers
+        self.closed = False
+
+    def iter_content(self, size):
+        for i in range(0, len(self.body), size):
+            yield self.body[i:i + size]
+
+    def close(self):
+        self.closed = True
+
+class FakeUpstream:
+    """googlevideo: отвечает 206 на Range; total=False - без размера файла, ignore_range - всегда 200."""
+
+    def __init__(self, total: bool = True, ignore_range: bool = False, head_size: bool = False):
+        self.total, self.ignore_range, self.head_size = total, ignore_range, head_size
+        self.requests = []
+
+    def get(self, video_id, start, end):
+        self.requests.append((start, end))
+        if self.ignore_range:
+            return FakeResponse(200, DATA, {"Content-Length": str(len(DATA))})
+        if start >= len(DATA):
+            raise stream_proxy.RangeNotSatisfiable(f"bytes={start}-{end}")
+        end = min(end, len(DATA) - 1)
+        size = len(DATA) if self.total else "*"
+        return FakeResponse(206, DATA[start:end + 1], {"Content-Range": f"bytes {start}-{end}/{size}"})
+
+    def probe(self, video_id):
+        return len(DATA) if self.head_size else None
+
+@pytest.fixture
+def upstream(monkeypatch):
+    def make(**kwargs):
+        fake = FakeUpstream(**kwargs)
+        monkeypatch.setattr(stream_proxy, "_get", fake.get)
+        monkeypatch.setattr(stream_proxy, "_probe_total", fake.probe)
+        monkeypatch.setattr(stream_proxy, "STREAM_CHUNK_BYTES", 100)
+        monkeypatch.setattr(stream_proxy, "READ_SIZE", 32)
+        return fake
+    return make
+
+def _open(range_header):
+    status, headers, body = stream_proxy.open_stream("vid1", range_header)
+    return status, headers, b"".join(body)
+
+def test_whole_file_without_range(upstream):
+    upstream()
+    status, headers, body = _open(None)
+    assert status == 200 and body == DATA
+    assert headers["Content-Length"] == str(len(DATA)) and "Content-Range" not in headers
+
+@pytest.mark.parametrize("header, start, end", [
+    ("bytes=10-299", 10, 299),
+    ("bytes=500-", 500, len(DATA) - 1),
+    ("bytes=-50", len(DATA) - 50, len(DATA) - 1),
+    ("bytes=1000-5000", 1000, len(DATA) - 1),
+])
+def test_range_is_206_with_content_range(upstream, header, start, end):
+    upstream()
+    status, headers, body = _open(header)
+    assert status == 206
+    assert headers["Content-Range"] == f"bytes {start}-{end}/{len(DATA)}"
+    assert headers["Content-Length"] == str(end - start + 1)
+    assert body == DATA[start:end + 1]
+
+def test_range_past_end_is_not_satisfiable(upstream):
+    upstream()
+    with pytest.raises(stream_proxy.RangeNotSatisfiable):
+        _open(f"bytes={len(DATA)}-")
+
+def test_open_range_with_unknown_size_uses_head(upstream):
+    upstream(total=False, head_size=True)
+    status, headers, body = _open("bytes=300-")
+    assert status == 206 and headers["Content-Range"] == f"bytes 300-{len(DATA) - 1}/{len(DATA)}"
+    assert body == DATA[300:]
+
+def test_open_range_with_unknown_size_falls_back_to_200(upstream):
+    # без размера Content-Range для bytes=N- не записать: 206 без него не отправляется
+    upstream(total=False)
+    status, headers, body = _open("bytes=300-")
+    assert status == 200 and "Content-Range" not in headers
+    assert body == DATA
+
+def test_closed_range_with_unknown_size(upstream):
+    upstream(total=False)
+    status, headers, body = _open("bytes=300-649")
+    assert status == 206 and headers["Content-Range"] == "bytes 300-649/*"
+    assert body == DATA[300:650]
+
+def test_upstream_ignoring_range(upstream):
+    fake = upstream(ignore_range=True)
+    status, headers, body = _open("bytes=300-649")
+    assert status == 206 and headers["Content-Range"] == f"bytes 300-649/{len(DATA)}"
+    assert body == DATA[300:650]
+    assert len(fake.requests) == 1
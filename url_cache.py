@@ -0,0 +1,152 @@
+"""
+Кэш прямых ссылок на аудио для /api/direct_download.
+
+Ссылка googlevideo содержит параметр expire (unix time). Запись живёт до expire минус
+DIRECT_URL_SAFETY_SECONDS. Два уровня: LRU в памяти процесса и таблица resolved_urls
+в SQLite (общая для процессов и переживает перезапуск). Одновременные запросы одного
+video_id объединяются - yt-dlp запускается один раз.
+
+Для пакетных запросов resolve_many извлекает ссылки параллельно в общем пуле потоков
+(DIRECT_URL_WORKERS), переиспользуя уже созданные экземпляры YoutubeDL.
+"""
+
+import queue
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Iterator, Optional
+from urllib.parse import parse_qs, urlparse
+
+import yt_dlp
+
+from config import DIRECT_URL_CACHE_SIZE, DIRECT_URL_SAFETY_SECONDS, DIRECT_URL_DEFAULT_TTL, DIRECT_URL_WORKERS
+from db import get_conn
+from metrics import track_duration, ytdlp_duration
+from singleflight import SingleFlight
+
+YDL_OPTS = {
+    "format": "bestaudio/best",
+    "quiet": True,
+    "no_warnings": True,
+    "extract_flat": False,
+}
+
+_memory: "OrderedDict[str, dict]" = OrderedDict()
+_memory_lock = threading.Lock()
+_flight = SingleFlight()
+
+# YoutubeDL не потокобезопасен: каждый поток берёт свой экземпляр из пула и возвращает его
+_ydl_pool: "queue.LifoQueue[yt_dlp.YoutubeDL]" = queue.LifoQueue()
+_executor = ThreadPoolExecutor(max_workers=DIRECT_URL_WORKERS, thread_name_prefix="url-resolve")
+
+@contextmanager
+def _borrow_ydl():
+    try:
+        ydl = _ydl_pool.get_nowait()
+    except queue.Empty:
+        ydl = yt_dlp.YoutubeDL(YDL_OPTS)
+    try:
+        yield ydl
+    finally:
+        _ydl_pool.put(ydl)
+
+def url_expires_at(url: str) -> int:
+    """Время истечения ссылки из параметра expire (или now + DIRECT_URL_DEFAULT_TTL)."""
+    try:
+        return int(parse_qs(urlparse(url).query)["expire"][0])
+    except (KeyError, IndexError, ValueError):
+        return int(time.time()) + DIRECT_URL_DEFAULT_TTL
+
+def _fresh(entry: Optional[dict]) -> bool:
+    return entry is not None and entry["expires_at"] - DIRECT_URL_SAFETY_SECONDS > time.time()
+
+def _memory_get(video_id: str) -> Optional[dict]:
+    with _memory_lock:
+        entry = _memory.get(video_id)
+        if entry is not None:
+            _memory.move_to_end(video_id)
+        return entry
+
+def _memory_put(video_id: str, entry: dict):
+    with _memory_lock:
+        _memory[video_id] = entry
+        _memory.move_to_end(video_id)
+        while len(_memory) > DIRECT_URL_CACHE_SIZE:
+            _memory.popitem(last=False)
+
+def _db_get(video_id: str) -> Optional[dict]:
+    with get_conn() as con:
+        row = con.execute("SELECT url, format, expires_at FROM resolved_urls WHERE video_id = ?",
+                          (video_id,)).fetchone()
+        return dict(row) if row else None
+
+def _db_put(video_id: str, entry: dict):
+    with get_conn() as con:
+        con.execute("""
+            INSERT OR REPLACE INTO resolved_urls(video_id, url, format, expires_at, resolved_at)
+            VALUES(?, ?, ?, ?, ?)
+        """, (video_id, entry["url"], entry["format"], entry["expires_at"], datetime.utcnow().isoformat()))
+        con.commit()
+
+def pick_audio_format(info: dict) -> tuple[Optional[str], Optional[str]]:
+    """URL и расширение лучшего аудиопотока из результата extract_info."""
+    # yt-dlp уже применил селектор bestaudio/best - выбранный формат лежит в корне info
+    if info.get("url") and info.get("acodec") != "none":
+        return info["url"], info.get("ext")
+    best = None
+    for fmt in info.get("formats") or []:
+        if fmt.get("acodec") != "none" and fmt.get("vcodec") == "none" and fmt.get("url"):
+            if best is None or (fmt.get("abr") or 0) > (best.get("abr") or 0):
+                best = fmt
+    if best is None:
+        return None, None
+    return best["url"], best.get("ext", "mp3")
+
+def extract_audio_url(video_id: str) -> dict:
+    url = f"https://www.youtube.com/watch?v={video_id}"
+    with _borrow_ydl() as ydl, track_duration(ytdlp_duration, "resolve"):
+        info = ydl.extract_info(url, download=False)
+    audio_url, audio_format = pick_audio_format(info)
+    if not audio_url:
+        raise LookupError("Не удалось получить прямую ссылку на аудио")
+    return {"url": audio_url, "format": audio_format, "expires_at": url_expires_at(audio_url)}
+
+def _resolve_uncached(video_id: str) -> dict:
+    entry = _db_get(video_id)
+    cached = _fresh(entry)
+    if not cached:
+        entry = extract_audio_url(video_id)
+        _db_put(video_id, entry)
+    _memory_put(video_id, entry)
+    return {**entry, "cached": cached}
+
+def resolve(video_id: str) -> dict:
+    """
+    Прямая ссылка на аудио: {"url", "format", "expires_at", "cached"}.
+    Ошибки yt-dlp пробрасываются.
+    """
+    entry = _memory_get(video_id)
+    if _fresh(entry):
+        return {**entry, "cached": True}
+    return _flight.do(video_id, lambda: _resolve_uncached(video_id))
+
+def resolve_many(video_ids: list[str]) -> Iterator[tuple[str, Optional[dict], Optional[Exception]]]:
+    """Параллельно разрешает ссылки. Отдаёт (video_id, entry, error) по мере готовности."""
+    futures = {_executor.submit(resolve, vid): vid for vid in dict.fromkeys(video_ids)}
+    for future in as_completed(futures):
+        vid = futures[future]
+        try:
+            yield vid, future.result(), None
+        except Exception as e:
+            yield vid, None, e
+
+def invalidate(video_id: str):
+    """Сбрасывает ссылку (например, если googlevideo ответил 403)."""
+    with _memory_lock:
+        _memory.pop(video_id, None)
+    with get_conn() as con:
+        con.execute("DELETE FROM resolved_urls WHERE video_id = ?", (video_id,))
+        con.commit()
@@ -0,0 +1,47 @@
+"""
+Точка входа production-сервера:
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+Приложение загружается один раз в master-процессе (preload_app), warm_up() до форка создаёт
+схему, читает версию данных и заполняет кэш ответов, поэтому воркеры стартуют с тёплым кэшем,
+а страницы базы уже в кэше ОС. В каждом воркере start_background() запускает воркеры очереди
+скачивания; stop_background() при остановке закрывает SSE-подписки и просит воркеры очереди
+завершиться после текущей задачи, join_background() их дожидается.
+"""
+
+import threading
+import time
+
+from app import app
+from db import get_data_version, init_db
+from download_queue import start_worker_threads
+from events import broadcaster
+
+# Кэшируемые эндпоинты, которые дашборд запрашивает сразу при открытии
+WARM_URLS = ("/api/trending", "/api/genres", "/api/search_queries")
+
+_stop = threading.Event()
+_threads: list[threading.Thread] = []
+
+def warm_up():
+    init_db()
+    get_data_version()
+    with app.test_client() as client:
+        for url in WARM_URLS:
+            try:
+                client.get(url)
+            except Exception as e:
+                print(f"[wsgi] Не удалось прогреть {url}: {e}")
+
+def start_background():
+    _threads.extend(start_worker_threads(stop_event=_stop))
+
+def stop_background():
+    broadcaster.close()
+    _stop.set()
+
+def join_background(timeout: float):
+    deadline = time.monotonic() + timeout
+    for t in _threads:
+        t.join(max(0.0, deadline - time.monotonic()))